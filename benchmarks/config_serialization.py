@@ -0,0 +1,93 @@
+"""
+Compares the time and file size of saving a QuaConfig with many waveform samples using `QuaConfig.save`, the JSON
+`QuaConfig.dump` and the original implementation, which dumped the config data with lists of samples as JSON in a
+single call, and the time of loading it back.
+
+Run with `python benchmarks/config_serialization.py`
+"""
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from entropylab_qpudb import QuaConfig
+
+
+def make_config(n_elements=100, samples_per_waveform=5000) -> QuaConfig:
+    config = QuaConfig({"elements": {}, "pulses": {}, "waveforms": {}})
+    for index in range(n_elements):
+        element = f"q{index}"
+        config["elements"][element] = {
+            "mixInputs": {"I": ("con1", 1), "Q": ("con1", 2)},
+            "intermediate_frequency": 100e6,
+            "operations": {},
+        }
+        t = np.linspace(0, 1, samples_per_waveform)
+        config.add_control_operation_iq(
+            element, "x", np.sin(t * index), np.cos(t * index)
+        )
+    return config
+
+
+def list_data(config: QuaConfig) -> dict:
+    # the content of the config as the original implementation held it, with lists of samples
+    data = {key: dict(value) for key, value in config.data.items()}
+    data["waveforms"] = {
+        name: {**waveform, "samples": waveform["samples"].tolist()}
+        if "samples" in waveform
+        else waveform
+        for name, waveform in data["waveforms"].items()
+    }
+    return data
+
+
+def original_dump(data: dict, filename) -> None:
+    # the original implementation
+    with open(filename, "w") as fp:
+        json.dump(data, fp)
+
+
+def load_json(filename) -> QuaConfig:
+    with open(filename) as fp:
+        return QuaConfig(json.load(fp))
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def main():
+    config = make_config()
+    with tempfile.TemporaryDirectory() as directory:
+        original_file = os.path.join(directory, "original.json")
+        data = list_data(config)
+        original_time, _ = timed(lambda: original_dump(data, original_file))
+        original_load_time, _ = timed(lambda: load_json(original_file))
+        print(
+            f"original dump:   {original_time:.3f}s  "
+            f"{os.path.getsize(original_file) / 1e6:.1f}MB  load {original_load_time:.3f}s"
+        )
+        json_file = os.path.join(directory, "config.json")
+        dump_time, _ = timed(lambda: config.dump(json_file))
+        json_load_time, _ = timed(lambda: load_json(json_file))
+        print(
+            f"dump:            {dump_time:.3f}s  "
+            f"{os.path.getsize(json_file) / 1e6:.1f}MB  load {json_load_time:.3f}s"
+        )
+        for compress in (False, True):
+            file = os.path.join(directory, f"config_{compress}.qua")
+            save_time, _ = timed(lambda: config.save(file, compress=compress))
+            load_time, loaded = timed(lambda: QuaConfig.load(file))
+            assert loaded == config
+            print(
+                f"save(compress={compress!s:5}): {save_time:.3f}s  "
+                f"{os.path.getsize(file) / 1e6:.1f}MB  load {load_time:.3f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
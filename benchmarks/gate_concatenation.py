@@ -0,0 +1,95 @@
+"""
+Compares the time of concatenating a randomized-benchmarking-like sequence of moments with `GateConcatenator` and
+with the original implementation, which extended lists of samples moment by moment.
+
+Run with `python benchmarks/gate_concatenation.py`
+"""
+import random
+import time
+
+import numpy as np
+
+from entropylab_qpudb import QuaConfig
+from entropylab_qpudb._gateconcatenator import GateConcatenator, Moment
+
+GATES = ["x", "y", "x2", "y2", "idle"]
+
+
+def make_config(n_elements) -> QuaConfig:
+    config = QuaConfig({"elements": {}, "pulses": {}, "waveforms": {}})
+    for index in range(n_elements):
+        element = f"q{index}"
+        config["elements"][element] = {
+            "mixInputs": {"I": ("con1", 1), "Q": ("con1", 2)},
+            "operations": {},
+        }
+        for gate_index, gate in enumerate(GATES):
+            length = 16 + 4 * gate_index
+            t = np.linspace(-2, 2, length)
+            config.add_control_operation_iq(
+                element, gate, np.exp(-(t**2)), -t * np.exp(-(t**2))
+            )
+    return config
+
+
+def make_moments(n_elements, n_moments):
+    rng = random.Random(0)
+    return [
+        Moment(
+            {
+                f"q{index}": rng.choice(GATES)
+                for index in range(n_elements)
+                if rng.random() < 0.7
+            }
+        )
+        for _ in range(n_moments)
+    ]
+
+
+def list_concatenation(moments, config):
+    # the original algorithm, extending lists of samples moment by moment
+    elements = set()
+    for moment in moments:
+        elements.update(moment.play_statements)
+    samples = {element: ([], []) for element in elements}
+    for moment in moments:
+        duration = max(
+            [
+                config.get_pulse_from_op(element, operation)["length"]
+                for element, operation in moment.play_statements.items()
+            ],
+            default=0,
+        )
+        for element in elements:
+            if element in moment.play_statements:
+                waveforms = config.get_waveforms_from_op(
+                    element, moment.play_statements[element]
+                )
+                waveforms = [list(waveform) for waveform in waveforms]
+            else:
+                waveforms = [[0.0] * duration, [0.0] * duration]
+            for concatenated, waveform in zip(samples[element], waveforms):
+                concatenated += waveform + [0.0] * (duration - len(waveform))
+    return samples
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def main():
+    for n_elements, n_moments in [(2, 1000), (10, 5000), (20, 10000)]:
+        config = make_config(n_elements)
+        moments = make_moments(n_elements, n_moments)
+        list_time, _ = timed(lambda: list_concatenation(moments, config))
+        buffer_time, _ = timed(lambda: GateConcatenator(moments, config))
+        print(
+            f"{n_elements:3} elements x {n_moments:6} moments: "
+            f"lists {list_time:.3f}s, GateConcatenator {buffer_time:.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,34 @@
+from entropylab_qpudb._config_binding import ConfigBinding
+from entropylab_qpudb._config_store import MergedConfigStore
+from entropylab_qpudb._connection_manager import QpuConnectionManager
 from entropylab_qpudb._entropy_cal import QuaCalNode, AncestorRunStrategy
+from entropylab_qpudb._profiling import QuaCalProfile
 from entropylab_qpudb._qpudatabase import (
     create_new_qpu_database,
     QpuDatabaseConnection,
+    QpuDatabaseServer,
     CalState,
 )
-from entropylab_qpudb._quaconfig import QuaConfig
+from entropylab_qpudb._quaconfig import QuaConfig, ConfigDiff, ConfigCheckpoint
 from entropylab_qpudb._resolver import Resolver
+from entropylab_qpudb._scheduler import QuaCalScheduler, NodeStatus, ScheduledAction
 
 __all__ = [
     "QuaConfig",
+    "ConfigDiff",
+    "ConfigCheckpoint",
+    "ConfigBinding",
+    "MergedConfigStore",
     "QuaCalNode",
     "AncestorRunStrategy",
+    "QuaCalProfile",
+    "QuaCalScheduler",
+    "NodeStatus",
+    "ScheduledAction",
     "create_new_qpu_database",
     "QpuDatabaseConnection",
+    "QpuDatabaseServer",
     "CalState",
+    "QpuConnectionManager",
     "Resolver",
 ]
@@ -0,0 +1,190 @@
+import weakref
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from entropylab_qpudb._qpudatabase import QpuDatabaseConnection
+from entropylab_qpudb._quaconfig import QuaConfig, ConfigDiff, _copy_entry
+
+Parameter = Tuple[str, str]
+
+
+@dataclass(frozen=True)
+class _Binding:
+    path: Tuple
+    parameters: Tuple[Parameter, ...]
+    function: Optional[Callable[..., Any]]
+
+    def evaluate(self, db: QpuDatabaseConnection) -> Any:
+        values = [
+            db.get(element, attribute).value for element, attribute in self.parameters
+        ]
+        if self.function is None:
+            return values[0]
+        return self.function(*values)
+
+
+def _set_path(config: QuaConfig, path: Tuple, value: Any) -> None:
+    container = config
+    for key in path[:-1]:
+        container = container[key]
+    container[path[-1]] = value
+
+
+class ConfigBinding:
+    """
+    Declares which values of a QuaConfig are derived from which parameters of a QPU DB, e.g. the intermediate
+    frequency of an element from its frequency and the frequency of its LO.
+
+    :func:`build` sets all the bound values of a config, and :func:`update` recomputes only the values derived from
+    parameters which changed since, so that a DB change does not require rebuilding the whole config. Changes are
+    detected by the versions of the parameters (see :func:`QpuDatabaseConnection.parameter_version`), which are
+    recorded separately for every config, so that several configs can be built and updated independently.
+
+    Example::
+
+        binding = ConfigBinding(db)
+        binding.bind(("elements", "q1", "intermediate_frequency"), [("q1", "f01"), ("lo1", "frequency")],
+                     lambda f01, lo: f01 - lo)
+        binding.bind(("controllers", "con1", "analog_outputs", 1, "offset"), ("q1", "dc_offset_i"))
+        config = binding.build(base_config)
+        ...
+        diff = binding.update(config)
+    """
+
+    def __init__(self, db: QpuDatabaseConnection):
+        """
+        :param db: the QPU DB holding the parameters
+        """
+        self._db = db
+        self._bindings: Dict[Tuple, _Binding] = {}
+        # the bindings using every parameter
+        self._dependents: Dict[Parameter, Set[Tuple]] = {}
+        # for every config, by its id: the version of every parameter when its bound values were last computed
+        self._versions: Dict[int, Dict[Parameter, Optional[int]]] = {}
+
+    def bind(
+        self,
+        path: Iterable,
+        parameters,
+        function: Optional[Callable[..., Any]] = None,
+    ) -> None:
+        """
+        Bind a value of the config to parameters of the DB
+
+        :param path: the keys leading to the value in the config, e.g. `("elements", "q1", "intermediate_frequency")`
+        :param parameters: an (element, attribute) pair, or a list of pairs
+        :param function: (optional) computes the value from the values of the parameters, in the given order.
+            If not given, the value is the value of the single parameter.
+        """
+        path = tuple(path)
+        if len(parameters) == 2 and all(isinstance(key, str) for key in parameters):
+            parameters = [parameters]
+        parameters = tuple(tuple(parameter) for parameter in parameters)
+        if function is None and len(parameters) != 1:
+            raise ValueError(
+                "a function is required for a value bound to several parameters"
+            )
+        if path in self._bindings:
+            self.unbind(path)
+        self._bindings[path] = _Binding(path, parameters, function)
+        for parameter in parameters:
+            self._dependents.setdefault(parameter, set()).add(path)
+
+    def unbind(self, path: Iterable) -> None:
+        """
+        Remove the binding of a value of the config
+        """
+        binding = self._bindings.pop(tuple(path))
+        for parameter in binding.parameters:
+            self._dependents[parameter].discard(binding.path)
+            if not self._dependents[parameter]:
+                del self._dependents[parameter]
+                for versions in self._versions.values():
+                    versions.pop(parameter, None)
+
+    @property
+    def paths(self) -> List[Tuple]:
+        return list(self._bindings)
+
+    def dependents(self, element: str, attribute: str) -> List[Tuple]:
+        """
+        :return: the paths of the values derived from a parameter
+        """
+        return sorted(self._dependents.get((element, attribute), ()), key=repr)
+
+    def _apply(
+        self, config: QuaConfig, paths: Iterable[Tuple], label: str
+    ) -> ConfigDiff:
+        edits = []
+        for path in paths:
+            value = self._bindings[path].evaluate(self._db)
+            _set_path(config, path, value)
+            edits.append(("set", path, _copy_entry(value)))
+        return ConfigDiff(tuple(edits), label)
+
+    def _config_versions(self, config: QuaConfig) -> Dict[Parameter, Optional[int]]:
+        key = id(config)
+        if key not in self._versions:
+            self._versions[key] = {}
+            # the id may be reused once the config is gone
+            weakref.finalize(config, self._versions.pop, key, None)
+        return self._versions[key]
+
+    def _record_versions(
+        self, config: QuaConfig, parameters: Iterable[Parameter]
+    ) -> None:
+        versions = self._config_versions(config)
+        for element, attribute in parameters:
+            versions[(element, attribute)] = self._db.parameter_version(
+                element, attribute
+            )
+
+    def build(self, config: QuaConfig) -> QuaConfig:
+        """
+        :param config: a config with all the entries holding the bound values
+        :return: a copy of the config, with all the bound values set from the DB
+        """
+        config = config.copy()
+        self._record_versions(config, self._dependents)
+        self._apply(config, self._bindings, "build")
+        return config
+
+    def changed_parameters(self, config: QuaConfig) -> List[Parameter]:
+        """
+        :param config: a config built with :func:`build`
+        :return: the parameters which were updated since the bound values of the config were last computed. For a
+            config which was not built with :func:`build`, all the parameters.
+        """
+        versions = self._versions.get(id(config), {})
+        return [
+            parameter
+            for parameter in self._dependents
+            if parameter not in versions
+            or versions[parameter] != self._db.parameter_version(*parameter)
+        ]
+
+    def update(
+        self, config: QuaConfig, parameters: Optional[Iterable[Parameter]] = None
+    ) -> ConfigDiff:
+        """
+        Recompute, in place, only the values of the config derived from parameters which changed.
+
+        :param config: a config built with :func:`build`
+        :param parameters: (optional) the (element, attribute) pairs of the changed parameters. If not given, the
+            parameters updated since the bound values of the config were last computed are found by their versions.
+        :return: the changes made to the config, which can be applied to other copies of it
+        """
+        if parameters is None:
+            parameters = self.changed_parameters(config)
+        parameters = [tuple(parameter) for parameter in parameters]
+        paths = set()
+        for parameter in parameters:
+            paths |= self._dependents.get(parameter, set())
+        self._record_versions(
+            config,
+            (parameter for parameter in parameters if parameter in self._dependents),
+        )
+        # the values are set in the order in which they were bound
+        return self._apply(
+            config, [path for path in self._bindings if path in paths], "update"
+        )
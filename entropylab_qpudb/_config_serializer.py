@@ -0,0 +1,124 @@
+import io
+import json
+import zipfile
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+# the skeleton of the config, with its arrays replaced by references to the array entries of the archive
+_SKELETON = "config.json"
+_ARRAYS = "arrays/"
+_FORMAT_VERSION = 1
+
+_ARRAY_TAG = "__array__"
+_TUPLE_TAG = "__tuple__"
+_DICT_TAG = "__dict__"
+_TAGS = {_ARRAY_TAG, _TUPLE_TAG, _DICT_TAG}
+
+
+class _Encoder:
+    def __init__(self, archive: zipfile.ZipFile):
+        self._archive = archive
+        self._count = 0
+
+    def _write_array(self, array: np.ndarray) -> str:
+        name = f"{_ARRAYS}{self._count}.npy"
+        self._count += 1
+        # the array is streamed into the archive, without building it in memory first
+        with self._archive.open(name, "w", force_zip64=True) as fp:
+            np.lib.format.write_array(fp, np.ascontiguousarray(array))
+        return name
+
+    def encode(self, value):
+        if isinstance(value, dict):
+            if all(isinstance(key, str) and key not in _TAGS for key in value):
+                return {key: self.encode(item) for key, item in value.items()}
+            # keys which are not strings (e.g. port numbers) can not be JSON object keys
+            return {
+                _DICT_TAG: [
+                    [self.encode(key), self.encode(item)] for key, item in value.items()
+                ]
+            }
+        if isinstance(value, tuple):
+            return {_TUPLE_TAG: [self.encode(item) for item in value]}
+        if isinstance(value, list):
+            return [self.encode(item) for item in value]
+        if isinstance(value, np.ndarray):
+            return {_ARRAY_TAG: self._write_array(value)}
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+
+class _Decoder:
+    def __init__(self, archive: zipfile.ZipFile):
+        self._archive = archive
+
+    def _read_array(self, name: str) -> np.ndarray:
+        with self._archive.open(name) as fp:
+            return np.lib.format.read_array(fp)
+
+    def decode(self, value):
+        if isinstance(value, dict):
+            if len(value) == 1:
+                tag, item = next(iter(value.items()))
+                if tag == _ARRAY_TAG:
+                    return self._read_array(item)
+                if tag == _TUPLE_TAG:
+                    return tuple(self.decode(element) for element in item)
+                if tag == _DICT_TAG:
+                    return {
+                        self.decode(key): self.decode(element) for key, element in item
+                    }
+            return {key: self.decode(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.decode(item) for item in value]
+        return value
+
+
+def save_config_data(
+    data: Dict[str, Any],
+    filename,
+    compress: bool = False,
+    options: Optional[Dict[str, Any]] = None,
+) -> None:
+    """
+    Save the content of a config to a zip archive, which holds the structure of the config as JSON and every numpy
+    array of the config as a binary `.npy` entry.
+    Integer keys and tuples are kept, so that the config is loaded back unchanged.
+
+    :param data: the content of the config
+    :param filename: the path of the archive, or a writable binary file
+    :param compress: whether to compress the entries of the archive
+    :param options: (optional) JSON serializable options of the config, e.g. the arguments it was created with
+    """
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with zipfile.ZipFile(filename, "w", compression=compression) as archive:
+        skeleton = _Encoder(archive).encode(data)
+        with archive.open(_SKELETON, "w") as fp:
+            with io.TextIOWrapper(fp, encoding="utf-8") as text:
+                json.dump(
+                    {
+                        "version": _FORMAT_VERSION,
+                        "options": options or {},
+                        "config": skeleton,
+                    },
+                    text,
+                )
+
+
+def load_config_data(filename) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Load the content of a config saved with :func:`save_config_data`
+
+    :param filename: the path of the archive, or a readable binary file
+    :return: the content of the config, and its options (empty for archives saved without options)
+    """
+    with zipfile.ZipFile(filename, "r") as archive:
+        with archive.open(_SKELETON) as fp:
+            content = json.load(fp)
+        if content.get("version") != _FORMAT_VERSION:
+            raise ValueError(
+                f"unsupported config format version {content.get('version')}"
+            )
+        return _Decoder(archive).decode(content["config"]), content.get("options", {})
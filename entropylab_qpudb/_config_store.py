@@ -0,0 +1,81 @@
+import os
+import tempfile
+from typing import Optional
+
+from entropylab_qpudb._quaconfig import QuaConfig
+
+
+class MergedConfigStore:
+    """
+    A content-addressed, on-disk store of merged configs, which persists between processes.
+
+    Configs are stored under a key derived from the content of the base config and of the declarative patches
+    applied to it, so a stored config is valid as long as its key is. Used by QuaCalNodes when a graph is run with
+    the `config_store` run argument, together with `declarative_patches=True`.
+
+    Configs are stored with :func:`QuaConfig.save`, which does not unpickle anything when loading, so that the
+    directory can be shared. The file names include the version of the store format, and a stored config which
+    can not be loaded is treated as missing.
+    """
+
+    # incremented whenever the format of the stored configs changes, so that older entries are not loaded
+    _FORMAT_VERSION = 1
+    _EXTENSION = ".qcfg"
+    _SUFFIX = f".v{_FORMAT_VERSION}{_EXTENSION}"
+
+    def __init__(self, directory: str):
+        """
+        :param directory: the directory of the store. Created if it does not exist.
+        """
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, key + self._SUFFIX)
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def __len__(self) -> int:
+        return len(
+            [
+                name
+                for name in os.listdir(self._directory)
+                if name.endswith(self._SUFFIX)
+            ]
+        )
+
+    def load(self, key: str) -> Optional[QuaConfig]:
+        """
+        :return: the config stored under the key, or None if there is no such config or it can not be loaded
+        """
+        try:
+            return QuaConfig.load(self._path(key))
+        except Exception:
+            # e.g. a missing, truncated or incompatible file. The config is then built and stored again.
+            return None
+
+    def save(self, key: str, config: QuaConfig) -> None:
+        """
+        Store a config under a key. The file is replaced atomically, so concurrent readers never see a partial file.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                config.save(fp)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def clear(self) -> None:
+        """
+        Remove all the stored configs, including configs stored in other formats
+        """
+        for name in os.listdir(self._directory):
+            if name.endswith(self._EXTENSION):
+                os.remove(os.path.join(self._directory, name))
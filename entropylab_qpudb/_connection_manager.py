@@ -0,0 +1,193 @@
+import os
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Tuple, Optional
+
+import pandas as pd
+
+from entropylab_qpudb._qpudatabase import QpuDatabaseConnection
+from entropylab_qpudb._resolver import Resolver
+
+
+class QpuConnectionManager:
+    """
+    Opens and reuses connections to several QPU DBs, identified by their name and path, while keeping the object
+    caches of all the open DBs within a single, global budget.
+
+    The budget is split evenly between the open DBs, and the share of every DB is split between the object caches of
+    its data and history DBs, so that the targets of all the caches add up to the budget. ZODB trims every cache down
+    to its target at transaction boundaries, so the budget can be exceeded in between. In addition, whenever a DB is
+    connected through the manager (or :func:`enforce_budget` is called), the caches of the least recently used DBs are
+    ghosted until the total cache use is back within the budget.
+
+    .. note::
+
+        ghosting a cache never discards uncommitted modifications, it only unloads objects which can be reloaded from
+        the storage when they are next accessed.
+    """
+
+    def __init__(
+        self,
+        cache_size: int = 2000,
+        cache_size_bytes: int = 0,
+        resolver: Optional[Resolver] = None,
+    ):
+        """
+        :param cache_size: the maximal total number of objects held in the object caches of all the open DBs
+        :param cache_size_bytes: the maximal total estimated size in bytes of the objects held in the object caches
+        of all the open DBs. A value of 0 means that the size is not limited.
+        :param resolver: a default resolver for the opened connections
+        """
+        if cache_size <= 0:
+            raise ValueError("cache_size must be a positive number of objects")
+        self._cache_size = cache_size
+        self._cache_size_bytes = cache_size_bytes
+        self._resolver = resolver
+        # ordered from the least recently used to the most recently used
+        self._connections: Dict[Tuple[str, str], QpuDatabaseConnection] = OrderedDict()
+        self._last_used: Dict[Tuple[str, str], datetime] = {}
+
+    @staticmethod
+    def _key(dbname: str, path: Optional[str]) -> Tuple[str, str]:
+        if path is None:
+            path = os.getcwd()
+        return dbname, os.path.abspath(path)
+
+    def connect(
+        self, dbname: str, path: Optional[str] = None, **kwargs
+    ) -> QpuDatabaseConnection:
+        """
+        Get a connection to a QPU DB, opening it if it is not already open in this manager.
+
+        :param dbname: the name of the DB
+        :param path: the path where the DB is stored. Defaults to the working directory.
+        :param kwargs: additional arguments for :class:`~entropylab_qpudb._qpudatabase.QpuDatabaseConnection`,
+        used only when the DB is opened
+        :return: an open connection to the DB
+        """
+        key = self._key(dbname, path)
+        if key in self._connections and self._connections[key].closed:
+            self._forget(key)
+        if key in self._connections:
+            self._connections.move_to_end(key)
+        else:
+            kwargs.setdefault("resolver", self._resolver)
+            self._connections[key] = QpuDatabaseConnection(
+                dbname, path=key[1], **kwargs
+            )
+            self._rebalance()
+        self._last_used[key] = datetime.now()
+        self.enforce_budget()
+        return self._connections[key]
+
+    def __getitem__(self, dbname: str) -> QpuDatabaseConnection:
+        return self.connect(dbname)
+
+    def __contains__(self, dbname: str) -> bool:
+        return self._key(dbname, None) in self._connections
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    def close(self, dbname: str, path: Optional[str] = None) -> None:
+        """
+        Close a connection opened by this manager, and redistribute its share of the budget.
+
+        :param dbname: the name of the DB
+        :param path: the path where the DB is stored. Defaults to the working directory.
+        """
+        key = self._key(dbname, path)
+        if key not in self._connections:
+            raise KeyError(f"QPU DB {dbname} is not open in this manager")
+        connection = self._connections[key]
+        self._forget(key)
+        if not connection.closed:
+            connection.close()
+
+    def close_all(self) -> None:
+        """
+        Close all the connections opened by this manager.
+        """
+        for dbname, path in list(self._connections):
+            self.close(dbname, path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close_all()
+
+    def _forget(self, key: Tuple[str, str]) -> None:
+        del self._connections[key]
+        del self._last_used[key]
+        self._rebalance()
+
+    def _rebalance(self) -> None:
+        if not self._connections:
+            return
+        share = max(self._cache_size // len(self._connections), 1)
+        share_bytes = self._cache_size_bytes // len(self._connections)
+        if self._cache_size_bytes:
+            share_bytes = max(share_bytes, 1)
+        for connection in self._connections.values():
+            connection._set_cache_budget(share, share_bytes)
+
+    def _over_budget(self, objects: int, nbytes: int) -> bool:
+        return objects > self._cache_size or (
+            self._cache_size_bytes and nbytes > self._cache_size_bytes
+        )
+
+    def enforce_budget(self) -> None:
+        """
+        Ghost the object caches of the open DBs, starting from the least recently used one, until the total cache use
+        is within the budget.
+        """
+        usage = {
+            key: connection._cache_usage()
+            for key, connection in self._connections.items()
+        }
+        objects = sum(objects for objects, _ in usage.values())
+        nbytes = sum(nbytes for _, nbytes in usage.values())
+        for key, connection in self._connections.items():
+            if not self._over_budget(objects, nbytes):
+                break
+            connection._minimize_cache()
+            new_objects, new_nbytes = connection._cache_usage()
+            objects -= usage[key][0] - new_objects
+            nbytes -= usage[key][1] - new_nbytes
+
+    def cache_stats(self) -> pd.DataFrame:
+        """
+        :return: a dataframe with the cache configuration and current cache use of every open DB, ordered from the
+        least recently used to the most recently used
+        """
+        rows = []
+        for key, connection in self._connections.items():
+            stats = connection.stats()
+            rows.append(
+                {
+                    "dbname": key[0],
+                    "path": key[1],
+                    "cache_size": connection.cache_size,
+                    "cache_size_bytes": connection.cache_size_bytes,
+                    "cached_objects": stats.cached_objects,
+                    "cached_bytes": stats.cached_bytes,
+                    "cache_hits": stats.cache_hits,
+                    "cache_misses": stats.cache_misses,
+                    "last_used": self._last_used[key],
+                }
+            )
+        return pd.DataFrame(
+            rows,
+            columns=[
+                "dbname",
+                "path",
+                "cache_size",
+                "cache_size_bytes",
+                "cached_objects",
+                "cached_bytes",
+                "cache_hits",
+                "cache_misses",
+                "last_used",
+            ],
+        )
@@ -1,16 +1,42 @@
+import asyncio
 import enum
+import hashlib
+import heapq
 import inspect
+import threading
 from abc import abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
 from copy import deepcopy
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from datetime import timedelta
+from functools import partial
 from itertools import count
-from typing import Callable, List, Optional, Union, Iterable, Set
+from typing import (
+    Any,
+    Callable,
+    List,
+    Optional,
+    Union,
+    Iterable,
+    Set,
+    Dict,
+    Tuple,
+)
 
 from entropylab.api.execution import EntropyContext
 from entropylab.api.graph import Node
 from entropylab.graph_experiment import PyNode
 
-from entropylab_qpudb._quaconfig import QuaConfig
+from entropylab_qpudb._config_store import MergedConfigStore
+from entropylab_qpudb._profiling import (
+    PhaseTiming,
+    QuaCalProfile,
+    _PhaseTimer,
+    _apply_patches,
+)
+from entropylab_qpudb._qpudatabase import _track_parameter_reads, CalState
+from entropylab_qpudb._quaconfig import QuaConfig, ConfigDiff
 
 
 class AncestorRunStrategy(enum.Enum):
@@ -23,21 +49,311 @@ class ConfigPatch:
     id: int
     depth: int
     function: Callable
+    # the creation index of the node which created the patch, patches of the same depth are applied in this order
+    node_index: int = 0
 
     def __hash__(self):
         return self.id
 
 
+def _patch_order_key(patch: ConfigPatch):
+    return patch.depth, patch.node_index, patch.id
+
+
+def _fold_content_key(key: Optional[str], patches: Iterable[ConfigPatch]):
+    # chains the content hashes of declarative patches, None if one of the patches is not declarative
+    for patch in patches:
+        if key is None or not isinstance(patch.function, ConfigDiff):
+            return None
+        key = hashlib.sha256((key + patch.function.content_hash()).encode()).hexdigest()
+    return key
+
+
+_UNSET = object()
+
+
+class PatchLineage:
+    """
+    An immutable node in the DAG of config patches of a graph run: the patches added by a calibration node, on top of
+    the lineages of its dependencies.
+
+    Lineages share their ancestors instead of copying their patches, and the order in which the patches of a lineage
+    are applied is computed only when it is needed, and then cached.
+
+    Creating a lineage takes time proportional to its new patches. Computing its order takes time proportional to
+    the number of its patches, including the patches of all its ancestors: a lineage with a single parent extends
+    the cached order of its parent, and a lineage with several parents (a fan-in node) merges the full orders of its
+    parents, in O(n log p) for n ancestor patches and p parents.
+    """
+
+    __slots__ = ("parents", "new_patches", "_order", "_ids", "_depth", "_content_key")
+
+    def __init__(
+        self,
+        new_patches: Iterable[ConfigPatch] = (),
+        parents: Iterable["PatchLineage"] = (),
+    ):
+        self.parents: Tuple[PatchLineage, ...] = tuple(parents)
+        self.new_patches: Tuple[ConfigPatch, ...] = tuple(new_patches)
+        self._order: Optional[Tuple[ConfigPatch, ...]] = None
+        self._ids: Optional[Tuple[int, ...]] = None
+        self._content_key = _UNSET
+        self._depth = max(
+            [parent.depth for parent in self.parents]
+            + [patch.depth for patch in self.new_patches]
+            + [0]
+        )
+
+    @classmethod
+    def merge(cls, lineages: Iterable["PatchLineage"]) -> "PatchLineage":
+        """
+        :return: a lineage with all the patches of the given lineages
+        """
+        unique = list({id(lineage): lineage for lineage in lineages}.values())
+        if len(unique) == 1:
+            return unique[0]
+        return cls(parents=unique)
+
+    def extend(self, patches: Iterable[ConfigPatch]) -> "PatchLineage":
+        """
+        :return: a lineage with the patches of this lineage, followed by the given patches
+        """
+        return PatchLineage(patches, (self,))
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    @property
+    def order(self) -> Tuple[ConfigPatch, ...]:
+        """
+        The patches of the lineage and of all its ancestors, in the order in which they should be applied.
+        Patches are ordered by depth, and patches of the same depth by the order in which their nodes were created,
+        which does not depend on the order in which parallel branches finish.
+        """
+        if self._order is None:
+            if len(self.parents) == 1:
+                inherited = self.parents[0].order
+            else:
+                seen = set()
+                inherited = []
+                for patch in heapq.merge(
+                    *(parent.order for parent in self.parents), key=_patch_order_key
+                ):
+                    if patch.id not in seen:
+                        seen.add(patch.id)
+                        inherited.append(patch)
+                inherited = tuple(inherited)
+            self._order = inherited + self.new_patches
+        return self._order
+
+    @property
+    def content_key(self) -> Optional[str]:
+        """
+        A key derived from the content of the patches of the lineage, in order, if all of them are declarative
+        (see :class:`~entropylab_qpudb._quaconfig.ConfigDiff`), and None otherwise.
+        """
+        if self._content_key is _UNSET:
+            if len(self.parents) == 1:
+                self._content_key = _fold_content_key(
+                    self.parents[0].content_key, self.new_patches
+                )
+            else:
+                self._content_key = _fold_content_key("", self.order)
+        return self._content_key
+
+    @property
+    def ids(self) -> Tuple[int, ...]:
+        if self._ids is None:
+            self._ids = tuple(patch.id for patch in self.order)
+        return self._ids
+
+    def __len__(self):
+        return len(self.order)
+
+
+def _copy_config(config):
+    # copies of a QuaConfig share its entries until they are accessed
+    if isinstance(config, QuaConfig):
+        return config.copy()
+    return deepcopy(config)
+
+
+# the number of configs kept by a config build cache
+_MAX_BUILT_CONFIGS = 32
+
+
+class _ConfigBuildCache:
+    """
+    Configs built from a base config, keyed by the patch lineage which was applied to it.
+    A config is built by applying only the patches which follow the closest lineage already built,
+    so a node pays only for the patches added by its direct dependencies.
+
+    Only the most recently used configs are kept, so the memory of the cache does not grow with the size of the
+    graph. A config whose lineage was evicted is built from its closest built ancestor, or from the base config.
+    """
+
+    def __init__(self, max_configs: int = _MAX_BUILT_CONFIGS):
+        # ordered from the least recently used to the most recently used
+        self._configs: Dict[PatchLineage, QuaConfig] = OrderedDict()
+        self._max_configs = max_configs
+        # the hash of every base config, along with the config (so that its id is not reused) and the modification
+        # key of the config when it was hashed
+        self._base_hashes: Dict[int, Tuple[Any, tuple, str]] = {}
+        # the cache is shared by nodes which may run in parallel
+        self._lock = threading.Lock()
+
+    def _add(self, lineage: PatchLineage, config) -> None:
+        self._configs[lineage] = config
+        self._configs.move_to_end(lineage)
+        while len(self._configs) > self._max_configs:
+            self._configs.popitem(last=False)
+
+    def _base_hash(self, base_config) -> str:
+        if not isinstance(base_config, QuaConfig):
+            # modifications of a plain dictionary can not be detected
+            return _config_hash(base_config)
+        modification_key = base_config._modification_key()
+        with self._lock:
+            cached = self._base_hashes.get(id(base_config))
+        if cached is not None and cached[1] == modification_key:
+            return cached[2]
+        base_hash = _config_hash(base_config)
+        with self._lock:
+            self._base_hashes[id(base_config)] = (
+                base_config,
+                modification_key,
+                base_hash,
+            )
+        return base_hash
+
+    def _store_key(self, base_config, lineage: PatchLineage) -> Optional[str]:
+        lineage_key = lineage.content_key
+        # only QuaConfigs can be stored
+        if lineage_key is None or not isinstance(base_config, QuaConfig):
+            return None
+        base_hash = self._base_hash(base_config)
+        return hashlib.sha256((base_hash + lineage_key).encode()).hexdigest()
+
+    def _closest_built(self, base_config, lineage: PatchLineage):
+        # walks up the lineage until a built config is found, collecting the patches to apply on top of it
+        segments = []
+        while lineage not in self._configs:
+            if len(lineage.parents) == 1:
+                segments.append(lineage.new_patches)
+                lineage = lineage.parents[0]
+                continue
+            # a merge point, continues from its longest built ancestor which is a prefix of its patches
+            ancestor = self._longest_built_prefix(lineage)
+            if ancestor is None:
+                segments.append(lineage.order)
+                return base_config, self._join(segments)
+            segments.append(lineage.order[len(ancestor) :])
+            lineage = ancestor
+            break
+        return self._configs[lineage], self._join(segments)
+
+    @staticmethod
+    def _join(segments) -> List[ConfigPatch]:
+        return [patch for segment in reversed(segments) for patch in segment]
+
+    def _longest_built_prefix(self, lineage: PatchLineage) -> Optional[PatchLineage]:
+        best = None
+        visited = set()
+        stack = list(lineage.parents)
+        while stack:
+            ancestor = stack.pop()
+            if id(ancestor) in visited:
+                continue
+            visited.add(id(ancestor))
+            if ancestor not in self._configs:
+                stack.extend(ancestor.parents)
+            elif (best is None or len(ancestor) > len(best)) and lineage.ids[
+                : len(ancestor)
+            ] == ancestor.ids:
+                best = ancestor
+        return best
+
+    def build(
+        self,
+        base_config,
+        lineage: PatchLineage,
+        context,
+        timer: Optional[_PhaseTimer] = None,
+        store: Optional[MergedConfigStore] = None,
+    ) -> QuaConfig:
+        with self._lock:
+            built = self._configs.get(lineage)
+            if built is not None:
+                self._configs.move_to_end(lineage)
+                return _copy_config(built)
+        key = None if store is None else self._store_key(base_config, lineage)
+        config = None if key is None else store.load(key)
+        if config is None:
+            with self._lock:
+                config, patches = self._closest_built(base_config, lineage)
+                config = _copy_config(config)
+            _apply_patches(patches, config, context, timer)
+            if key is not None:
+                store.save(key, config)
+        # the cached config is kept unmodified, and the caller gets its own copy
+        with self._lock:
+            self._add(lineage, config)
+            return _copy_config(config)
+
+    def update(self, other: "_ConfigBuildCache") -> None:
+        if other is not self:
+            with other._lock:
+                configs = list(other._configs.items())
+            with self._lock:
+                for lineage, config in configs:
+                    self._add(lineage, config)
+
+
+def _describe_patch_function(function) -> str:
+    if isinstance(function, ConfigDiff):
+        return str(function) + "\n"
+    try:
+        return inspect.getsource(function)
+    except (OSError, TypeError):
+        return repr(function) + "\n"
+
+
 @dataclass
 class QuaCalNodeOutput:
     base_config: QuaConfig
-    patches: List[ConfigPatch]
+    lineage: PatchLineage = field(default_factory=PatchLineage)
     merged_config = None
+    cache: _ConfigBuildCache = field(
+        default_factory=_ConfigBuildCache, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        if not isinstance(self.lineage, PatchLineage):
+            # a list of patches
+            self.lineage = PatchLineage(self.lineage)
 
-    def build_config(self, context):
-        config_copy = deepcopy(self.base_config)
-        for patch in self.patches:
-            patch.function(config_copy, context)
+    @property
+    def patches(self) -> List[ConfigPatch]:
+        """
+        The patches to apply on the base config, in order
+        """
+        return list(self.lineage.order)
+
+    def build_config(
+        self,
+        context,
+        memoize: bool = False,
+        timer: Optional[_PhaseTimer] = None,
+        store: Optional[MergedConfigStore] = None,
+    ):
+        if memoize:
+            config_copy = self.cache.build(
+                self.base_config, self.lineage, context, timer, store
+            )
+        else:
+            config_copy = _copy_config(self.base_config)
+            _apply_patches(self.lineage.order, config_copy, context, timer)
         self.merged_config = config_copy
         return config_copy
 
@@ -51,24 +367,160 @@ Base:
 {self.base_config}
 
 Patches:
-{nl.join([(f"{patch.id} depth {patch.depth}:{nl}" + inspect.getsource(patch.function)) for patch in self.patches])}
+{nl.join([(f"{patch.id} depth {patch.depth}:{nl}" + _describe_patch_function(patch.function)) for patch in self.patches])}
 
 Merged:
 {merged}
 """
 
 
+@dataclass(frozen=True)
+class _NodeFingerprint:
+    """
+    The inputs of a node run: the hash of the config built for the node, and the versions of the DB
+    parameters read while running it, as of the end of the run.
+    """
+
+    config_hash: str
+    parameter_versions: Dict[Tuple[Any, str, str], Any]
+
+    @classmethod
+    def record(cls, config_hash: str, reads: Iterable[Tuple[Any, str, str]]):
+        return cls(
+            config_hash,
+            {
+                (connection, element, attribute): connection.parameter_version(
+                    element, attribute
+                )
+                for connection, element, attribute in reads
+            },
+        )
+
+    def matches(self, config_hash: str) -> bool:
+        return config_hash == self.config_hash and all(
+            connection.parameter_version(element, attribute) == version
+            for (
+                connection,
+                element,
+                attribute,
+            ), version in self.parameter_versions.items()
+        )
+
+    def __deepcopy__(self, memo):
+        # nodes are copied when a graph is created, and the fingerprint refers to open DB connections
+        return self
+
+
+def _config_hash(config) -> str:
+    if not isinstance(config, QuaConfig):
+        config = QuaConfig(config)
+    return config.content_hash()
+
+
+class _PatchRecorder:
+    """
+    Records the changes made by the `prepare_config` and `update_config` of a node as declarative patches, from the
+    config of a run of the node: the prepare patch from the config which was prepared for the run, and the update
+    patch after the run, since `update_config` may depend on the results of `run_program`.
+    """
+
+    def __init__(self, node: "QuaCalNode", config):
+        self._node = node
+        self._built = _copy_config(config)
+        self._prepared = None
+
+    def prepared(self, config) -> None:
+        # called when `prepare_config` was applied to the config of the run, before `run_program`
+        self._prepared = _copy_config(config)
+
+    def patches(self, context) -> Tuple[ConfigDiff, ConfigDiff]:
+        if self._prepared is None:
+            # the node did not prepare its config in this run, e.g. it was skipped
+            self._prepared = _copy_config(self._built)
+            self._node.prepare_config(self._prepared, context)
+        updated = _copy_config(self._prepared)
+        self._node.update_config(updated, context)
+        label = self._node.label
+        return (
+            ConfigDiff.between(self._built, self._prepared, f"{label}.prepare_config"),
+            ConfigDiff.between(self._prepared, updated, f"{label}.update_config"),
+        )
+
+
 id_iter = count(start=0, step=1)
+_id_lock = threading.Lock()
+_node_index_iter = count(start=0, step=1)
+
+
+def _next_patch_id() -> int:
+    with _id_lock:
+        return next(id_iter)
 
 
 class QuaCalNode(PyNode):
+    """
+    A calibration node which builds its config from the config patches of its dependencies.
+
+    When a graph of QuaCalNodes is run with `GraphExecutionType.Async` and the `parallel` run argument,
+    independent branches of the graph run concurrently on a thread pool. `parallel` is either `True`, to use the
+    default thread pool of the event loop, or a `concurrent.futures.ThreadPoolExecutor`.
+    The configs built at merge points do not depend on the order in which the branches finish, since patches of
+    the same depth are applied in the order in which their nodes were created.
+
+    When a graph is run with the `skip_unchanged` run argument, a node whose config and DB parameters did not
+    change since its previous run does not call `prepare_config` and `run_program` again, and its previous
+    `update_config` patch is reused. The DB parameters taken into account are the ones read with
+    :func:`~entropylab_qpudb._qpudatabase.QpuDatabaseConnection.get` while running the node.
+
+    When a graph is run with `declarative_patches=True`, the changes made by `prepare_config` and `update_config`
+    are recorded once, from the config of the node, as :class:`~entropylab_qpudb._quaconfig.ConfigDiff` patches which
+    its dependents replay instead of calling the methods again. The changes of `update_config` are recorded after
+    `run_program` returns, so they may depend on its results. This requires the changes to depend only on the node
+    and not on the config they are applied to (e.g. setting a calibrated value, rather than incrementing one).
+    Declarative patches are hashable and serializable, so the configs built from them can be persisted across
+    processes in a :class:`~entropylab_qpudb._config_store.MergedConfigStore`, passed as the `config_store` run
+    argument.
+
+    The wall and CPU time of every phase of the last execution of a node are available from :attr:`timings`.
+    To collect the timings of all the nodes of a graph run, pass a
+    :class:`~entropylab_qpudb._profiling.QuaCalProfile` as the `profile` run argument.
+
+    A node may declare the QPU DB parameters it calibrates and when they are considered within spec, so that a
+    :class:`~entropylab_qpudb._scheduler.QuaCalScheduler` can run only the calibrations which are needed.
+
+    .. note::
+
+        in parallel mode, the `prepare_config`, `run_program` and `update_config` methods of nodes in independent
+        branches may be called concurrently, and should not modify shared state without synchronization.
+    """
+
     def __init__(
         self,
         dependency: Optional[Union[Node, Iterable[Node]]] = None,
         must_run_after: Set[Node] = None,
         name: Optional[str] = None,
         save_results: bool = True,
+        calibrated_parameters: Iterable[Tuple[str, str]] = (),
+        calibration_timeout: Optional[timedelta] = None,
+        required_state: CalState = CalState.UNCAL,
+        max_error: Optional[float] = None,
+        check_data: Optional[Callable[[QuaConfig, EntropyContext], bool]] = None,
     ):
+        """
+        :param dependency: the nodes whose configs this node depends on
+        :param must_run_after: nodes which must run before this node, without a config dependency
+        :param name: the node label. Defaults to the class name.
+        :param save_results: whether to save the node results
+        :param calibrated_parameters: the (element, attribute) pairs of the QPU DB parameters calibrated by the node
+        :param calibration_timeout: (optional) the time after which the calibrated parameters become stale
+        :param required_state: the minimal calibration state of the calibrated parameters
+        :param max_error: (optional) the maximal confidence interval error of the calibrated parameters
+        :param check_data: (optional) a function `check_data(config, context) -> bool`, which runs a quick measurement
+            checking whether the calibrated parameters are still within spec, without calibrating them, and returns
+            True if they are. Called with the config of the node, after `prepare_config`. Used by
+            :class:`~entropylab_qpudb._scheduler.QuaCalScheduler` for stale nodes, and to diagnose the dependencies
+            of nodes whose check failed. Stale nodes without it are calibrated.
+        """
         if dependency:
             if isinstance(dependency, Iterable):
                 input_vars = {}
@@ -83,31 +535,84 @@ class QuaCalNode(PyNode):
         else:
             input_vars = None
         output_vars = {"config"}
+        self._node_index = next(_node_index_iter)
+        self._fingerprint: Optional[_NodeFingerprint] = None
+        self._timings: List[PhaseTiming] = []
+        self.calibrated_parameters: List[Tuple[str, str]] = list(calibrated_parameters)
+        self.calibration_timeout = calibration_timeout
+        self.required_state = required_state
+        self.max_error = max_error
+        self.check_data = check_data
 
         def program(
             *configs,
             strategy: AncestorRunStrategy = AncestorRunStrategy.RunAll,
+            memoize_configs: bool = True,
+            skip_unchanged: bool = False,
+            profile: Optional[QuaCalProfile] = None,
+            scheduler=None,
+            declarative_patches: bool = False,
+            config_store: Optional[MergedConfigStore] = None,
             is_last: bool,
             context: EntropyContext,
         ):
+            timer = _PhaseTimer(self.label, profile)
+            self._timings = timer.timings
+
             # sync config
-            merged_config: QuaCalNodeOutput = self._merge_configs(configs)
-            config_copy = merged_config.build_config(context)
+            with timer.phase("merge"):
+                merged_config: QuaCalNodeOutput = self._merge_configs(configs)
+            # under RunOnlyLast, an ancestor node only passes its patches along, and its config is never built.
+            # declarative patches are recorded from the config of the node, so it is built in that case.
+            lazy = (
+                scheduler is None
+                and strategy == AncestorRunStrategy.RunOnlyLast
+                and not is_last
+                and not declarative_patches
+            )
+            prepare_patch, update_patch = self.prepare_config, self.update_config
+            recorder = None
+            if not lazy:
+                with timer.phase("build") as phase:
+                    config_copy = merged_config.build_config(
+                        context, memoize_configs, timer, config_store
+                    )
+                    phase.config = config_copy
+                if declarative_patches:
+                    recorder = _PatchRecorder(self, config_copy)
 
             # run the actual code
-            self.prepare_config(config_copy, context)
-            if strategy == AncestorRunStrategy.RunAll or is_last:
-                self.run_program(config_copy, context)
+            if scheduler is not None:
+                self._run_scheduled(config_copy, context, scheduler, timer, recorder)
+            elif strategy == AncestorRunStrategy.RunAll or is_last:
+                self._prepare_and_run(
+                    config_copy, context, skip_unchanged, timer, recorder
+                )
+            elif not lazy:
+                self._timed_prepare(config_copy, context, timer, recorder)
+
+            if recorder is not None:
+                # the update is recorded after the program ran, since it may depend on its results
+                with timer.phase("record_patches"):
+                    prepare_patch, update_patch = recorder.patches(context)
 
             # prepare the output
-            patch_depth = (
-                max([config.depth for config in merged_config.patches] + [0]) + 1
-            )
-            merged_config.patches.append(
-                ConfigPatch(next(id_iter), patch_depth, self.prepare_config)
-            )
-            merged_config.patches.append(
-                ConfigPatch(next(id_iter), patch_depth, self.update_config)
+            patch_depth = merged_config.lineage.depth + 1
+            merged_config.lineage = merged_config.lineage.extend(
+                [
+                    ConfigPatch(
+                        _next_patch_id(),
+                        patch_depth,
+                        prepare_patch,
+                        self._node_index,
+                    ),
+                    ConfigPatch(
+                        _next_patch_id(),
+                        patch_depth,
+                        update_patch,
+                        self._node_index,
+                    ),
+                ]
             )
             return {"config": merged_config}
 
@@ -117,6 +622,106 @@ class QuaCalNode(PyNode):
             name, program, input_vars, output_vars, must_run_after, save_results
         )
 
+    @property
+    def timings(self) -> List[PhaseTiming]:
+        """
+        The timings of the phases of the last execution of the node
+        """
+        return list(self._timings)
+
+    def _prepare_and_run(
+        self,
+        config,
+        context: EntropyContext,
+        skip_unchanged: bool,
+        timer: _PhaseTimer,
+        recorder: Optional["_PatchRecorder"] = None,
+    ):
+        if not skip_unchanged:
+            self._fingerprint = None
+            self._timed_prepare_and_run(config, context, timer, recorder)
+            return
+        with timer.phase("fingerprint"):
+            config_hash = _config_hash(config)
+            unchanged = self._fingerprint is not None and self._fingerprint.matches(
+                config_hash
+            )
+        if unchanged:
+            print(f"skipping node {self.label}, its inputs did not change")
+            return
+        self._fingerprint = None
+        with _track_parameter_reads() as reads:
+            self._timed_prepare_and_run(config, context, timer, recorder)
+        self._fingerprint = _NodeFingerprint.record(config_hash, reads)
+
+    def _run_scheduled(
+        self,
+        config,
+        context: EntropyContext,
+        scheduler,
+        timer: _PhaseTimer,
+        recorder: Optional["_PatchRecorder"] = None,
+    ):
+        # scheduler is a QuaCalScheduler, which decides whether the node should be calibrated. The scheduler module
+        # depends on this module, so it is imported here.
+        from entropylab_qpudb._scheduler import ScheduledAction
+
+        action = scheduler.decide(self)
+        if action == ScheduledAction.SKIP:
+            return
+        self._timed_prepare(config, context, timer, recorder)
+        if action == ScheduledAction.CHECK:
+            with timer.phase("check"):
+                passed = bool(self.check_data(config, context))
+            # a node whose check failed may wait for its dependencies to be diagnosed before it is calibrated
+            if not scheduler.record_check(self, passed):
+                return
+        with timer.phase("run") as phase:
+            self.run_program(config, context)
+            phase.config = config
+
+    def _timed_prepare(
+        self,
+        config,
+        context,
+        timer: _PhaseTimer,
+        recorder: Optional["_PatchRecorder"] = None,
+    ):
+        with timer.phase("prepare") as phase:
+            self.prepare_config(config, context)
+            phase.config = config
+        if recorder is not None:
+            recorder.prepared(config)
+
+    def _timed_prepare_and_run(
+        self,
+        config,
+        context,
+        timer: _PhaseTimer,
+        recorder: Optional["_PatchRecorder"] = None,
+    ):
+        self._timed_prepare(config, context, timer, recorder)
+        with timer.phase("run") as phase:
+            self.run_program(config, context)
+            phase.config = config
+
+    async def _execute_async(self, input_values, context, is_last, **kwargs):
+        parallel = kwargs.get("parallel", False)
+        if not parallel:
+            return await super()._execute_async(
+                input_values, context, is_last, **kwargs
+            )
+        if isinstance(parallel, ProcessPoolExecutor):
+            raise ValueError(
+                "QuaCalNodes can only run in parallel on a thread pool, "
+                "since config patches can not be passed between processes"
+            )
+        executor = parallel if isinstance(parallel, Executor) else None
+        return await asyncio.get_running_loop().run_in_executor(
+            executor,
+            partial(self._execute, input_values, context, is_last, **kwargs),
+        )
+
     def add_config_dependency(self, node):
         super().add_input(f"config_{node.label}", node.outputs["config"])
 
@@ -127,19 +732,22 @@ class QuaCalNode(PyNode):
             else:
                 return config
 
-        def get_patches(config):
-            if isinstance(config, QuaCalNodeOutput):
-                return config.patches
-            else:
-                return []
-
         base_configs = [get_base(config) for config in configs]
         if len(set([id(config) for config in base_configs])) > 1:
             raise RuntimeError("trying to merge different configs")
-        all_patches = [item for sublist in configs for item in get_patches(sublist)]
-        unique_patches = list(set(all_patches))
-        unique_patches.sort(key=lambda patch: patch.depth)
-        return QuaCalNodeOutput(base_configs[0], unique_patches)
+        lineages = [
+            config.lineage for config in configs if isinstance(config, QuaCalNodeOutput)
+        ]
+        merged = QuaCalNodeOutput(base_configs[0], PatchLineage.merge(lineages))
+        # all the dependencies share the cache of the first one
+        caches = [
+            config.cache for config in configs if isinstance(config, QuaCalNodeOutput)
+        ]
+        if caches:
+            merged.cache = caches[0]
+            for cache in caches[1:]:
+                merged.cache.update(cache)
+        return merged
 
     @abstractmethod
     def prepare_config(self, config: QuaConfig, context: EntropyContext):
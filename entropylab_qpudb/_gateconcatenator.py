@@ -1,8 +1,15 @@
+import os
 from copy import deepcopy
 from dataclasses import dataclass
-from typing import Dict, List
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
 
-from entropylab_qpudb._quaconfig import QuaConfig
+import numpy as np
+
+from entropylab_qpudb._quaconfig import QuaConfig, _compact_waveform
+
+# pulse lengths accepted by the OPX: at least 16 samples, in multiples of 4
+_MIN_PULSE_LENGTH = 16
+_PULSE_LENGTH_STEP = 4
 
 
 @dataclass(frozen=True)
@@ -10,11 +17,71 @@ class Moment:
     play_statements: Dict[str, str]  # quantum element  # operation
 
 
-class GateConcatenator:
+class _Concatenator:
+    """
+    Looks up the samples and lengths of the operations played by moments, once per operation
+    """
+
+    def __init__(self, config: QuaConfig):
+        self._config = config
+        # the samples played by every operation, which are looked up once for all the moments playing it
+        self._operation_waveforms: Dict[Tuple[str, str], Tuple[np.ndarray, ...]] = {}
+        self._operation_lengths: Dict[Tuple[str, str], int] = {}
+
+    def _get_operation_waveforms(self, element, operation) -> Tuple[np.ndarray, ...]:
+        key = (element, operation)
+        if key not in self._operation_waveforms:
+            waveforms = self._config.get_waveform_arrays_from_op(element, operation)
+            if isinstance(waveforms, np.ndarray):
+                waveforms = (waveforms,)
+            self._operation_waveforms[key] = waveforms
+        return self._operation_waveforms[key]
+
+    def _get_operation_length(self, element, operation) -> int:
+        key = (element, operation)
+        if key not in self._operation_lengths:
+            pulse = self._config._peek_pulse_from_op(element, operation)
+            self._operation_lengths[key] = pulse["length"]
+        return self._operation_lengths[key]
+
+    def _get_moment_duration(self, moment):
+        duration = 0
+        for element, operation in moment.play_statements.items():
+            op_duration = self._get_operation_length(element, operation)
+            duration = max(duration, op_duration)
+        return duration
+
+    @property
+    def config(self):
+        return self._config
+
+    @staticmethod
+    def concat_op_name():
+        return "concat_waveform"
+
+    @staticmethod
+    def concat_pulse_name(element):
+        return f"{element}_concat_pulse_in"
+
+    def concat_waveform_names(self, element) -> Tuple[str, ...]:
+        """
+        :return: the names of the concatenated waveforms of an element, (I, Q) for mixInputs elements
+        """
+        names = self.concat_waveform_name(element)
+        return names if isinstance(names, tuple) else (names,)
+
+    def concat_waveform_name(self, element):
+        if "mixInputs" in self._config["elements"][element]:
+            return f"{element}_concat_waveform_i", f"{element}_concat_waveform_q"
+        else:
+            return f"{element}_concat_waveform"
+
+
+class GateConcatenator(_Concatenator):
     def __init__(self, moment_sequence: List[Moment], config: QuaConfig, name=None):
         # todo: add the ability to add more than one moment sequence
+        super().__init__(deepcopy(config))
         self._moment_sequence = moment_sequence
-        self._config = deepcopy(config)
         # collect all elements
         self._elements = set()
         for gate in moment_sequence:
@@ -65,81 +132,227 @@ class GateConcatenator:
                 }
 
     def _add_gates_to_config(self):
-        for moment in self._moment_sequence:
-            duration = self._get_moment_duration(moment)
-            for element in self._elements:
-                concat_pulse = self._config["pulses"][f"{element}_concat_pulse_in"]
-                concat_pulse["length"] += duration
-
-                # add to concatenated waveforms the waveforms from this operation, add zeros to others
-                if element in moment.play_statements.keys():
-                    operation = moment.play_statements[element]
-                    if "mixInputs" in self._config["elements"][element]:
-                        waveform_i, waveform_q = self._config.get_waveforms_from_op(
-                            element, operation
-                        )
-                        self._append_waveform(
-                            f"{element}_concat_waveform_i", waveform_i, duration
-                        )
-                        self._append_waveform(
-                            f"{element}_concat_waveform_q", waveform_q, duration
-                        )
-                    else:
-                        waveform = self._config.get_waveforms_from_op(
-                            element, operation
-                        )
-                        self._append_waveform(
-                            f"{element}_concat_waveform", waveform, duration
-                        )
-                else:
-                    if "mixInputs" in self._config["elements"][element]:
-                        waveform_i = self._get_empty_waveform(duration)
-                        waveform_q = self._get_empty_waveform(duration)
-                        self._append_waveform(
-                            f"{element}_concat_waveform_i", waveform_i, duration
-                        )
-                        self._append_waveform(
-                            f"{element}_concat_waveform_q", waveform_q, duration
-                        )
-                    else:
-                        waveform = self._get_empty_waveform(duration)
-                        self._append_waveform(
-                            f"{element}_concat_waveform", waveform, duration
-                        )
+        # the durations of all the moments are computed first, so that the samples are written to buffers of the
+        # final length. Elements which do not play in a moment, and shorter waveforms, are left as zeros.
+        durations = [
+            self._get_moment_duration(moment) for moment in self._moment_sequence
+        ]
+        starts = np.concatenate([[0], np.cumsum(durations, dtype=int)])
+        length = int(starts[-1])
+        buffers = {
+            element: tuple(
+                np.zeros(length) for _ in self.concat_waveform_names(element)
+            )
+            for element in self._elements
+        }
+        # the start times of every operation, so that its waveforms are looked up once
+        operation_starts = {}
+        for moment, start in zip(self._moment_sequence, starts):
+            for element, operation in moment.play_statements.items():
+                operation_starts.setdefault((element, operation), []).append(start)
+        for (element, operation), op_starts in operation_starts.items():
+            for buffer, waveform in zip(
+                buffers[element], self._get_operation_waveforms(element, operation)
+            ):
+                # slice assignments copy the samples without building an index array of all the occurrences
+                for start in op_starts:
+                    buffer[start : start + len(waveform)] = waveform
 
-    def _get_moment_duration(self, moment):
-        duration = 0
-        for element, operation in moment.play_statements.items():
-            op_duration = self._config.get_pulse_from_op(element, operation)["length"]
-            # op_duration = self._config['pulses'][self._config[element]['operations'][operation]]['length']
-            duration = max(duration, op_duration)
-        return duration
+        for element in self._elements:
+            self._config["pulses"][self.concat_pulse_name(element)]["length"] = length
+            for name, samples in zip(
+                self.concat_waveform_names(element), buffers[element]
+            ):
+                waveform = {"type": "arbitrary", "samples": samples}
+                if self._config.compact_waveforms:
+                    waveform = _compact_waveform(waveform)
+                self._config["waveforms"][name] = waveform
 
-    def _append_waveform(self, name, waveform, duration):
-        waveform_to_append = (
-            waveform + [0.0] * (len(waveform) - duration)
-            if duration > len(waveform)
-            else waveform
-        )
-        self._config["waveforms"][name]["samples"] += waveform_to_append
 
-    def _get_empty_waveform(self, duration):
-        return [0.0] * duration
+class StreamingGateConcatenator(_Concatenator):
+    """
+    Concatenates a stream of moments into chunks of samples of a bounded length, so that the memory used does not
+    depend on the length of the sequence.
+
+    The chunks of all the elements are aligned: chunk `n` of every element holds the samples played from time
+    `n * chunk_length`. The chunks can be iterated with :func:`chunks`, written to memory-mapped files with
+    :func:`to_files`, or added to the config as a sequence of memory-mapped pulses played one after the other with
+    :func:`to_pulses`.
+    """
+
+    def __init__(
+        self, config: QuaConfig, elements: Sequence[str], chunk_length: int = 2**16
+    ):
+        """
+        :param config: the config with the operations played by the moments
+        :param elements: all the elements played by the moments, which must be known before they are streamed
+        :param chunk_length: the number of samples of every chunk, except for the last one which may be shorter.
+            Since the chunks can be played as pulses, it must be a valid pulse length: a multiple of 4, of at least 16.
+        """
+        if chunk_length < _MIN_PULSE_LENGTH or chunk_length % _PULSE_LENGTH_STEP:
+            raise ValueError(
+                f"the chunk length must be a multiple of {_PULSE_LENGTH_STEP} of at least {_MIN_PULSE_LENGTH} "
+                f"samples, got {chunk_length}"
+            )
+        super().__init__(deepcopy(config))
+        self._elements = list(elements)
+        self._chunk_length = chunk_length
 
     @property
-    def config(self):
-        return self._config
+    def chunk_length(self) -> int:
+        return self._chunk_length
 
-    @staticmethod
-    def concat_op_name():
-        return "concat_waveform"
+    def chunks(
+        self, moments: Iterable[Moment]
+    ) -> Iterator[Dict[str, Tuple[np.ndarray, ...]]]:
+        """
+        :param moments: the moments, which are consumed one at a time
+        :return: an iterator over the chunks. Every chunk maps each element to its samples, (I, Q) for mixInputs
+            elements.
+        """
+        capacity = 2 * self._chunk_length
+        buffers = {
+            element: [np.zeros(capacity) for _ in self.concat_waveform_names(element)]
+            for element in self._elements
+        }
+        # the number of samples written to the buffers. Samples beyond it are always zero.
+        filled = 0
+        for moment in moments:
+            duration = self._get_moment_duration(moment)
+            if filled + duration > capacity:
+                capacity = max(2 * capacity, filled + duration)
+                for element_buffers in buffers.values():
+                    for index, buffer in enumerate(element_buffers):
+                        element_buffers[index] = np.zeros(capacity)
+                        element_buffers[index][:filled] = buffer[:filled]
+            for element, operation in moment.play_statements.items():
+                if element not in buffers:
+                    raise ValueError(
+                        f"element {element} was not given to the concatenator"
+                    )
+                for buffer, waveform in zip(
+                    buffers[element], self._get_operation_waveforms(element, operation)
+                ):
+                    buffer[filled : filled + len(waveform)] = waveform
+            filled += duration
+            while filled >= self._chunk_length:
+                yield self._take_chunk(buffers, self._chunk_length, filled)
+                filled -= self._chunk_length
+        if filled:
+            yield self._take_chunk(buffers, filled, filled)
 
     @staticmethod
-    def concat_pulse_name(element):
-        return f"{element}_concat_pulse_in"
+    def _take_chunk(
+        buffers, length: int, filled: int
+    ) -> Dict[str, Tuple[np.ndarray, ...]]:
+        chunk = {}
+        for element, element_buffers in buffers.items():
+            chunk[element] = tuple(buffer[:length].copy() for buffer in element_buffers)
+            # the remaining samples are moved to the start of the buffers
+            for buffer in element_buffers:
+                buffer[: filled - length] = buffer[length:filled]
+                buffer[filled - length : filled] = 0.0
+        return chunk
 
-    def concat_waveform_name(self, element):
-        if "mixInputs" in self._config["elements"][element]:
-            return f"{element}_concat_waveform_i", f"{element}_concat_waveform_q"
-        else:
-            return f"{element}_concat_waveform"
+    def to_files(self, moments: Iterable[Moment], directory) -> Dict[str, np.ndarray]:
+        """
+        Write the concatenated samples of every waveform to a file of 64 bit floats, one chunk at a time.
+
+        :param moments: the moments, which are consumed one at a time
+        :param directory: the directory to write the files to, named by the concatenated waveforms
+        :return: read-only memory-mapped arrays of the samples of every concatenated waveform
+        """
+        os.makedirs(directory, exist_ok=True)
+        filenames = {
+            name: os.path.join(directory, f"{name}.f64")
+            for element in self._elements
+            for name in self.concat_waveform_names(element)
+        }
+        files = {name: open(filename, "wb") for name, filename in filenames.items()}
+        try:
+            for chunk in self.chunks(moments):
+                for element, samples in chunk.items():
+                    for name, element_samples in zip(
+                        self.concat_waveform_names(element), samples
+                    ):
+                        files[name].write(element_samples.tobytes())
+        finally:
+            for file in files.values():
+                file.close()
+        return {name: _map_samples(filename) for name, filename in filenames.items()}
+
+    def to_pulses(self, moments: Iterable[Moment], directory) -> int:
+        """
+        Add the concatenated samples to the config as a sequence of pulses, of at most `chunk_length` samples each.
+        The pulse of chunk `n` is played by the operation `concat_pulse_op_name(n)` of every element. The last pulse is
+        padded with zeros to a valid pulse length.
+
+        The samples are written to files with :func:`to_files`, and the waveforms of the pulses are read-only
+        memory-mapped arrays of these files, so that the memory used does not grow with the length of the sequence.
+
+        :param moments: the moments, which are consumed one at a time
+        :param directory: the directory to write the samples to. It must be kept as long as the config is used.
+        :return: the number of pulses of every element
+        """
+        samples = self.to_files(moments, directory)
+        total = len(next(iter(samples.values()), ()))
+        chunks = (
+            {
+                element: tuple(
+                    samples[name][start : start + self._chunk_length]
+                    for name in self.concat_waveform_names(element)
+                )
+                for element in self._elements
+            }
+            for start in range(0, total, self._chunk_length)
+        )
+        n_pulses = 0
+        for index, chunk in enumerate(chunks):
+            for element, element_samples in chunk.items():
+                self._add_chunk_pulse(element, index, element_samples)
+            n_pulses = index + 1
+        return n_pulses
+
+    def _add_chunk_pulse(self, element, index, samples) -> None:
+        pulse_name = f"{self.concat_pulse_name(element)}_{index}"
+        length = _valid_pulse_length(len(samples[0]))
+        if length != len(samples[0]):
+            samples = tuple(
+                np.pad(port_samples, (0, length - len(port_samples)))
+                for port_samples in samples
+            )
+        waveforms = {}
+        for port, name, port_samples in zip(
+            ("I", "Q") if len(samples) == 2 else ("single",),
+            self.concat_waveform_names(element),
+            samples,
+        ):
+            waveform_name = f"{name}_{index}"
+            waveform = {"type": "arbitrary", "samples": port_samples}
+            if self._config.compact_waveforms:
+                waveform = _compact_waveform(waveform)
+            self._config["waveforms"][waveform_name] = waveform
+            waveforms[port] = waveform_name
+        self._config["pulses"][pulse_name] = {
+            "operation": "control",
+            "length": length,
+            "waveforms": waveforms,
+        }
+        self._config["elements"][element]["operations"][
+            self.concat_pulse_op_name(index)
+        ] = pulse_name
+
+    @classmethod
+    def concat_pulse_op_name(cls, index: int) -> str:
+        return f"{cls.concat_op_name()}_{index}"
+
+
+def _valid_pulse_length(length: int) -> int:
+    length = max(length, _MIN_PULSE_LENGTH)
+    return -(-length // _PULSE_LENGTH_STEP) * _PULSE_LENGTH_STEP
+
+
+def _map_samples(filename) -> np.ndarray:
+    if os.path.getsize(filename) == 0:
+        return np.zeros(0)
+    return np.memmap(filename, dtype=np.float64, mode="r")
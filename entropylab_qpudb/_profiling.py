@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import List, Optional, Iterator
+
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class PhaseTiming:
+    """
+    The time spent by a calibration node in one phase of its execution.
+    """
+
+    node: str
+    phase: str
+    # the value of time.perf_counter() when the phase started
+    start: float
+    wall_time: float
+    cpu_time: float
+    thread_id: int
+    # the number of entries in the config sections, including waveform samples, at the end of the phase
+    config_size: Optional[int] = None
+    # for patches applied while building a config, the node which created the patch and its function
+    detail: str = ""
+
+
+_COLUMNS = [
+    "node",
+    "phase",
+    "start",
+    "wall_time",
+    "cpu_time",
+    "thread_id",
+    "config_size",
+    "detail",
+]
+
+
+def timings_to_dataframe(timings: List[PhaseTiming]) -> pd.DataFrame:
+    """
+    :return: a dataframe with a row for every phase timing
+    """
+    return pd.DataFrame([asdict(timing) for timing in timings], columns=_COLUMNS)
+
+
+def _config_size(config) -> int:
+    size = 0
+    for section in config.values():
+        if isinstance(section, dict):
+            size += len(section)
+    waveforms = config.get("waveforms", {})
+    # the waveforms are read without taking ownership of them
+    for waveform in dict.values(waveforms):
+        samples = waveform.get("samples")
+        if samples is not None:
+            size += len(samples)
+    return size
+
+
+class QuaCalProfile:
+    """
+    Collects the phase timings of the QuaCalNodes of one or more graph runs.
+
+    Pass an instance as the `profile` run argument of a graph, e.g. `Graph(...).run(profile=profile)`.
+    The phases of a node are `merge` (merging the outputs of its dependencies), `build` (building its config),
+    `apply_patch` (applying a single patch of a dependency while building the config, nested in `build`),
+    `fingerprint` (when run with `skip_unchanged`), `record_patches` (when run with `declarative_patches`),
+    `prepare`, `check` (when run with a scheduler) and `run`.
+    """
+
+    def __init__(self):
+        self._timings: List[PhaseTiming] = []
+        # nodes may run in parallel
+        self._lock = threading.Lock()
+
+    def add(self, timing: PhaseTiming) -> None:
+        with self._lock:
+            self._timings.append(timing)
+
+    @property
+    def timings(self) -> List[PhaseTiming]:
+        with self._lock:
+            return list(self._timings)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._timings.clear()
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        :return: a dataframe with a row for every recorded phase
+        """
+        return timings_to_dataframe(self.timings)
+
+    def to_chrome_trace(self, filename: Optional[str] = None) -> dict:
+        """
+        Export the timings in the Chrome trace event format, which can be opened in chrome://tracing or Perfetto.
+
+        :param filename: (optional) a file to write the trace to, as JSON
+        :return: the trace
+        """
+        timings = self.timings
+        origin = min([timing.start for timing in timings], default=0.0)
+        events = [
+            {
+                "name": timing.phase,
+                "cat": timing.node,
+                "ph": "X",
+                "ts": (timing.start - origin) * 1e6,
+                "dur": timing.wall_time * 1e6,
+                "pid": os.getpid(),
+                "tid": timing.thread_id,
+                "args": {
+                    "node": timing.node,
+                    "cpu_time": timing.cpu_time,
+                    "config_size": timing.config_size,
+                    "detail": timing.detail,
+                },
+            }
+            for timing in timings
+        ]
+        trace = {"traceEvents": events, "displayTimeUnit": "ms"}
+        if filename is not None:
+            with open(filename, "w") as fp:
+                json.dump(trace, fp)
+        return trace
+
+
+class _Phase:
+    def __init__(self):
+        self.config = None
+        self.detail = ""
+
+
+class _PhaseTimer:
+    """
+    Records the phases of a single node execution, and reports them to a profile.
+    """
+
+    def __init__(self, node: str, profile: Optional[QuaCalProfile] = None):
+        self._node = node
+        self._profile = profile
+        self.timings: List[PhaseTiming] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[_Phase]:
+        phase = _Phase()
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield phase
+        finally:
+            wall_time = time.perf_counter() - start
+            cpu_time = time.thread_time() - cpu_start
+            timing = PhaseTiming(
+                self._node,
+                name,
+                start,
+                wall_time,
+                cpu_time,
+                threading.get_ident(),
+                None if phase.config is None else _config_size(phase.config),
+                phase.detail,
+            )
+            self.timings.append(timing)
+            if self._profile is not None:
+                self._profile.add(timing)
+
+    def apply_patch(self, patch, config, context) -> None:
+        with self.phase("apply_patch") as phase:
+            function = patch.function
+            # declarative patches are labeled with their origin
+            phase.detail = getattr(function, "label", "")
+            if not phase.detail:
+                owner = getattr(getattr(function, "__self__", None), "label", "")
+                phase.detail = f"{owner}.{getattr(function, '__name__', '')}"
+            function(config, context)
+
+
+def _apply_patches(patches, config, context, timer: Optional[_PhaseTimer]) -> None:
+    for patch in patches:
+        if timer is None:
+            patch.function(config, context)
+        else:
+            timer.apply_patch(patch, config, context)
@@ -1,10 +1,14 @@
 import json
 import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
 from copy import deepcopy
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum, auto
-from typing import Any, Type, Optional, Dict
+from typing import Any, Type, Optional, Dict, Tuple, Set, Iterator
 
 import ZODB
 import ZODB.FileStorage
@@ -15,6 +19,7 @@ from persistent import Persistent
 from persistent.list import PersistentList
 from persistent.mapping import PersistentMapping
 from zc.lockfile import LockError
+from ZODB.POSException import ConflictError
 
 from entropylab_qpudb._resolver import DefaultResolver
 
@@ -45,11 +50,25 @@ class QpuParameter(Persistent):
     last_updated: datetime = None
     cal_state: CalState = CalState.UNCAL
     confidence_interval: ConfidenceInterval = ConfidenceInterval(-1)
+    # incremented whenever the parameter is set. Parameters stored before it was added use the default.
+    version: int = 0
 
     def __post_init__(self):
         if self.last_updated is None:
             self.last_updated = datetime.now()
 
+    def _p_resolveConflict(self, old_state, saved_state, new_state):
+        # called by ZODB when two connections modify the same parameter concurrently. The most recent update wins.
+        if new_state["last_updated"] >= saved_state["last_updated"]:
+            resolved = dict(new_state)
+        else:
+            resolved = dict(saved_state)
+        # both updates may have reached the same version, which must not identify the value of the other one
+        resolved["version"] = (
+            max(new_state.get("version", 0), saved_state.get("version", 0)) + 1
+        )
+        return resolved
+
     def __repr__(self):
         if self.value is None:
             return "QpuParameter(None)"
@@ -85,6 +104,32 @@ class FrozenQpuParameter:
             )
 
 
+@dataclass(frozen=True)
+class QpuDatabaseStats:
+    """
+    Cache and IO statistics of a QPU DB connection, accumulated since it was opened or since the statistics were
+    last reset
+    """
+
+    loads: int
+    stores: int
+    cache_hits: int
+    cache_misses: int
+    cached_objects: int
+    ghost_objects: int
+    cached_bytes: int
+    commits: int
+    commit_time: float
+    last_commit_time: float
+    data_bytes_written: int
+    history_bytes_written: int
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        accesses = self.cache_hits + self.cache_misses
+        return self.cache_hits / accesses if accesses else 0.0
+
+
 def _db_file_from_path(path, dbname):
     return os.path.join(path, dbname + ".fs")
 
@@ -93,6 +138,82 @@ def _hist_file_from_path(path, dbname):
     return os.path.join(path, dbname + "_history.fs")
 
 
+def _socket_file_from_path(path, dbname):
+    return os.path.join(os.path.abspath(path), dbname + ".sock")
+
+
+_DATA_STORAGE = "data"
+_HISTORY_STORAGE = "history"
+
+# the share of the cache budget of a connection given to the history DB, which holds few objects
+_HISTORY_CACHE_SHARE = 0.1
+
+# the number of attempts to append an entry to the history when other processes append entries concurrently
+_HISTORY_COMMIT_ATTEMPTS = 10
+
+# the number of revisions of a committed object searched for the transaction which committed it
+_COMMIT_LOOKUP_DEPTH = 100
+# the key of the transaction metadata identifying the commits of a connection
+_COMMIT_MARKER = "qpudb_commit"
+
+
+def _split_cache_budget(budget: int) -> Tuple[int, int]:
+    """
+    :return: the shares of a cache budget of the data and the history DBs, each of at least 1
+    """
+    history = max(int(budget * _HISTORY_CACHE_SHARE), 1)
+    return max(budget - history, 1), history
+
+
+def _latest_hist_index(hist_entries) -> int:
+    """
+    :return: the index of the history entry connected to the latest transaction. Entries are appended in the order in
+    which they are committed to the history, which may differ from the order of their transactions when several
+    processes share the DB.
+    """
+    return max(
+        range(len(hist_entries)),
+        key=lambda index: hist_entries[index]["connected_tx"] or b"",
+    )
+
+
+_read_tracking = threading.local()
+
+
+@contextmanager
+def _track_parameter_reads() -> Iterator[Set[Tuple[Any, str, str]]]:
+    """
+    Records the parameters read through :func:`~_QpuDatabaseConnectionBase.get` in the current thread while the context
+    is active, as (connection, element, attribute) tuples. Contexts may be nested.
+    """
+    reads = set()
+    stack = getattr(_read_tracking, "stack", None)
+    if stack is None:
+        stack = _read_tracking.stack = []
+    stack.append(reads)
+    try:
+        yield reads
+    finally:
+        stack.pop()
+
+
+def _record_parameter_read(connection, element: str, attribute: str) -> None:
+    for reads in getattr(_read_tracking, "stack", ()):
+        reads.add((connection, element, attribute))
+
+
+def _import_zeo():
+    try:
+        import ZEO
+        import ZEO.StorageServer
+    except ImportError:
+        raise ImportError(
+            "sharing a QPU DB between processes requires ZEO. "
+            "Install it with `pip install entropylab-qpudb[shared]`."
+        )
+    return ZEO
+
+
 def create_new_qpu_database(
     dbname: str,
     initial_data_dict: Dict = None,
@@ -163,6 +284,76 @@ def create_new_qpu_database(
     db_hist.close()
 
 
+class QpuDatabaseServer:
+    """
+    Serves a QPU DB to several processes, so that all of them can open it with `shared=True` and write to it
+    concurrently.
+
+    The server owns the DB files and listens on a unix socket next to them, so a process opening the DB only needs
+    to know its name and path. Concurrent writes to different parameters are merged, and concurrent writes to the same
+    parameter are resolved in favor of the most recent one. Adding or removing elements and attributes concurrently
+    still raises a `ConflictError` on commit, after which the DB should be aborted and the changes redone.
+
+    .. note::
+
+        requires ZEO to be installed. Unix socket paths are limited to about 100 characters, so the DB should be
+        stored in a path which is short enough.
+    """
+
+    def __init__(self, dbname: str, path: str = None):
+        """
+        :param dbname: The name of the database to serve.
+        :param path: The path where the DB is stored. Defaults to the working directory.
+        """
+        ZEO = _import_zeo()
+        if path is None:
+            path = os.getcwd()
+        self._dbname = dbname
+        dbfilename = _db_file_from_path(path, dbname)
+        if not os.path.exists(dbfilename):
+            raise FileNotFoundError(f"QPU DB {dbname} does not exist")
+        self._address = _socket_file_from_path(path, dbname)
+        storages = {}
+        try:
+            for storage_name, filename in (
+                (_DATA_STORAGE, dbfilename),
+                (_HISTORY_STORAGE, _hist_file_from_path(path, dbname)),
+            ):
+                storages[storage_name] = ZODB.FileStorage.FileStorage(filename)
+        except LockError:
+            for storage in storages.values():
+                storage.close()
+            raise ConnectionError(
+                f"attempting to serve {dbname} but a connection already exists."
+                f"Try closing existing python sessions."
+            )
+        if os.path.exists(self._address):
+            # left over from a server which was not closed
+            os.remove(self._address)
+        self._server = ZEO.StorageServer.StorageServer(self._address, storages)
+        self._server.start_thread()
+        print(f"serving qpu database {dbname} at {self._address}")
+
+    @property
+    def address(self) -> str:
+        return self._address
+
+    def close(self) -> None:
+        """
+        Stops serving the DB and closes its files. Connected processes will lose their connection.
+        """
+        print(f"stopping qpu database server {self._dbname}")
+        self._server.close()
+        if os.path.exists(self._address):
+            os.remove(self._address)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 class ReadOnlyError(Exception):
     pass
 
@@ -178,12 +369,13 @@ class _QpuDatabaseConnectionBase(Resource):
         pass
 
     def snapshot(self, update: bool) -> str:
-        hist_root = self._con_hist.root()
+        hist_entries = self._con_hist.root()["entries"]
+        index = _latest_hist_index(hist_entries)
         return json.dumps(
             {
                 "qpu_name": self._dbname,
-                "index": len(hist_root["entries"]) - 1,
-                "message": hist_root["entries"][-1]["message"],
+                "index": index,
+                "message": hist_entries[index]["message"],
             }
         )
 
@@ -192,7 +384,34 @@ class _QpuDatabaseConnectionBase(Resource):
         data = json.loads(snapshot)
         return class_object(data["qpu_name"])
 
-    def __init__(self, dbname, history_index=None, path=None):
+    def __init__(
+        self,
+        dbname,
+        history_index=None,
+        path=None,
+        cache_size: Optional[int] = None,
+        cache_size_bytes: int = 0,
+        warm_up: bool = False,
+        shared: bool = False,
+        readonly: bool = False,
+    ):
+        """
+        :param dbname: the name of the DB to open
+        :param history_index: (optional) open the DB in a read only state, as it was at this history index
+        :param path: the path where the DB is stored. Defaults to the working directory.
+        :param cache_size: (optional) the target number of objects held in the object caches of the connection, in
+        total over the data and the history DBs. Defaults to the ZODB default for each DB.
+        :param cache_size_bytes: (optional) the target estimated size in bytes of the objects held in the object
+        caches of the connection, in total over the data and the history DBs. A value of 0 means that the size is not
+        limited.
+        :param warm_up: if set to true, all the parameters are loaded when the DB is opened.
+        See :func:`~entropylab_qpudb._qpudatabase.QpuDatabaseConnectionBase.warm_up`.
+        :param shared: if set to true, connect to the :class:`~entropylab_qpudb._qpudatabase.QpuDatabaseServer`
+        serving the DB instead of opening its files, so that several processes can write to the DB concurrently.
+        :param readonly: if set to true, open the DB for reading only, without locking it. Any number of read only
+        connections can be opened alongside a single connection which writes to the DB. A read only connection sees
+        the DB as it was committed when it was opened, until :func:`refresh` is called.
+        """
         if path is None:
             path = os.getcwd()
         self._path = path
@@ -201,26 +420,33 @@ class _QpuDatabaseConnectionBase(Resource):
         if not os.path.exists(dbfilename):
             raise FileNotFoundError(f"QPU DB {self._dbname} does not exist")
         self._db = None
+        self._configured_cache_budget = None
+        self._shared = shared
+        self._open_readonly = readonly
+        self._history_index = history_index
         super().__init__()
         self._con_hist = self._open_hist_db()
         self._con = self._open_data_db(history_index)
+        if cache_size is not None or cache_size_bytes:
+            self._set_cache_budget(
+                self.cache_size if cache_size is None else cache_size,
+                cache_size_bytes,
+            )
+        self.reset_stats()
+        if warm_up:
+            self.warm_up()
 
     def _open_data_db(self, history_index):
         dbfilename = _db_file_from_path(self._path, self._dbname)
         hist_entries = self._con_hist.root()["entries"]
         if history_index is not None:
             message_index = history_index
-            at = self._con_hist.root()["entries"][history_index]["connected_tx"]
+            at = hist_entries[history_index]["connected_tx"]
         else:
-            message_index = len(hist_entries) - 1
+            message_index = _latest_hist_index(hist_entries)
             at = None
-        try:
-            self._db = ZODB.DB(dbfilename) if self._db is None else self._db
-        except LockError:
-            raise ConnectionError(
-                f"attempting to open a connection to {self._dbname} but a connection already exists."
-                f"Try closing existing python sessions."
-            )
+        if self._db is None:
+            self._db = self._open_zodb(dbfilename, _DATA_STORAGE)
 
         con = self._db.open(transaction_manager=transaction.TransactionManager(), at=at)
         con.transaction_manager.begin()
@@ -232,16 +458,69 @@ class _QpuDatabaseConnectionBase(Resource):
 
     def _open_hist_db(self):
         histfilename = _hist_file_from_path(self._path, self._dbname)
+        db_hist = self._open_zodb(histfilename, _HISTORY_STORAGE)
+        con_hist = db_hist.open(transaction_manager=transaction.TransactionManager())
+        con_hist.transaction_manager.begin()
+        return con_hist
+
+    def _open_zodb(self, filename, storage_name):
+        if self._shared:
+            ZEO = _import_zeo()
+            address = _socket_file_from_path(self._path, self._dbname)
+            if not os.path.exists(address):
+                raise ConnectionError(
+                    f"attempting to open a shared connection to {self._dbname} but it is not served. "
+                    f"Start a QpuDatabaseServer for it first."
+                )
+            return ZEO.DB(
+                address,
+                storage=storage_name,
+                wait_timeout=30,
+                read_only=self._open_readonly,
+                # a read only connection waits for the invalidations of all the commits made before it is refreshed
+                server_sync=self._open_readonly,
+            )
+        if self._open_readonly:
+            # read only file storages do not take the lock
+            return ZODB.DB(filename, read_only=True)
         try:
-            db_hist = ZODB.DB(histfilename)
+            return ZODB.DB(filename)
         except LockError:
             raise ConnectionError(
                 f"attempting to open a connection to {self._dbname} but a connection already exists."
                 f"Try closing existing python sessions."
             )
-        con_hist = db_hist.open(transaction_manager=transaction.TransactionManager())
-        con_hist.transaction_manager.begin()
-        return con_hist
+
+    def refresh(self) -> None:
+        """
+        Move a connection opened with `readonly=True` to the latest state committed to the DB.
+
+        A shared connection is notified of new commits by the server, so only the objects which they modified are
+        dropped from its object cache. Otherwise, the DB files are reopened, which empties the object cache.
+        """
+        if not self._open_readonly:
+            raise ValueError(
+                "only connections opened with readonly=True can be refreshed"
+            )
+        if self._history_index is not None:
+            raise ValueError("cannot refresh a connection to a history index")
+        if self._shared:
+            for con in (self._con_hist, self._con):
+                # beginning a transaction syncs the connection with the server, so it sees all the new commits
+                con.transaction_manager.abort()
+                con.transaction_manager.begin()
+            return
+        # a read only file storage does not see the transactions appended to the file by other processes
+        for con in (self._con, self._con_hist):
+            loads, stores = con.getTransferCounts()
+            self._loads += loads
+            self._stores += stores
+            con.db().close()
+        self._db = None
+        self._con_hist = self._open_hist_db()
+        self._con = self._open_data_db(None)
+        if self._configured_cache_budget is not None:
+            self._set_cache_budget(*self._configured_cache_budget)
 
     def __enter__(self):
         return self
@@ -250,6 +529,11 @@ class _QpuDatabaseConnectionBase(Resource):
     def readonly(self):
         return self._con.isReadOnly()
 
+    @property
+    def closed(self) -> bool:
+        # closing the ZODB database releases the resources of its connections
+        return self._con.opened is None
+
     def close(self) -> None:
         """
         Closes QPU DB connection to allow for other connections.
@@ -258,6 +542,184 @@ class _QpuDatabaseConnectionBase(Resource):
         self._con._db.close()
         self._con_hist._db.close()
 
+    def _set_cache_budget(self, cache_size: int, cache_size_bytes: int = 0) -> None:
+        self._configured_cache_budget = (cache_size, cache_size_bytes)
+        # the budget of the connection is split between the object caches of the data and the history DBs, so that
+        # their total stays within it. The history DB only holds the list of history entries, so it gets a small
+        # share. Each DB has a regular and a historical cache, of which the connection uses only one: the data
+        # connection is historical when opened with a `history_index`.
+        for db, size, size_bytes in zip(
+            (self._con._db, self._con_hist._db),
+            _split_cache_budget(cache_size),
+            _split_cache_budget(cache_size_bytes) if cache_size_bytes else (0, 0),
+        ):
+            db.setCacheSize(size)
+            db.setCacheSizeBytes(size_bytes)
+            db.setHistoricalCacheSize(size)
+            db.setHistoricalCacheSizeBytes(size_bytes)
+
+    def _cache_usage(self) -> Tuple[int, int]:
+        """
+        :return: the number of non-ghost objects and their estimated size in bytes, summed over the object caches
+        of the data and history connections
+        """
+        caches = (self._con._cache, self._con_hist._cache)
+        return (
+            sum(cache.cache_non_ghost_count for cache in caches),
+            sum(cache.total_estimated_size for cache in caches),
+        )
+
+    def _minimize_cache(self) -> None:
+        # only ghosts objects which are up to date, so uncommitted modifications are kept
+        self._con.cacheMinimize()
+        self._con_hist.cacheMinimize()
+
+    @staticmethod
+    def _db_cache_size(db, historical: bool) -> Tuple[int, int]:
+        if historical:
+            return db.getHistoricalCacheSize(), db.getHistoricalCacheSizeBytes()
+        return db.getCacheSize(), db.getCacheSizeBytes()
+
+    def _cache_budget(self) -> Tuple[int, int]:
+        data_size, data_bytes = self._db_cache_size(
+            self._con._db, self._con.before is not None
+        )
+        hist_size, hist_bytes = self._db_cache_size(self._con_hist._db, False)
+        return data_size + hist_size, data_bytes + hist_bytes
+
+    @property
+    def cache_size(self) -> int:
+        """
+        The target number of objects held in the object caches of the connection, in total over the data and the
+        history DBs
+        """
+        return self._cache_budget()[0]
+
+    @cache_size.setter
+    def cache_size(self, value: int) -> None:
+        self._set_cache_budget(value, self.cache_size_bytes)
+
+    @property
+    def cache_size_bytes(self) -> int:
+        """
+        The target estimated size in bytes of the objects held in the object caches of the connection, in total over
+        the data and the history DBs, where 0 means that the size is not limited
+        """
+        return self._cache_budget()[1]
+
+    @cache_size_bytes.setter
+    def cache_size_bytes(self, value: int) -> None:
+        self._set_cache_budget(self.cache_size, value)
+
+    def stats(self) -> QpuDatabaseStats:
+        """
+        Get the cache and IO statistics of this connection.
+
+        Cache hits and misses are counted for every access to a parameter, where a miss means that the parameter had
+        to be loaded from the storage. Commit times and the bytes written include both the data and the history DBs.
+
+        :return: a :class:`entropylab_qpudb._qpudatabase.QpuDatabaseStats` instance
+        """
+        loads, stores = 0, 0
+        for con in (self._con, self._con_hist):
+            con_loads, con_stores = con.getTransferCounts()
+            loads += con_loads
+            stores += con_stores
+        cached_objects, cached_bytes = self._cache_usage()
+        cache_len = len(self._con._cache) + len(self._con_hist._cache)
+        return QpuDatabaseStats(
+            loads=self._loads + loads,
+            stores=self._stores + stores,
+            cache_hits=self._cache_hits,
+            cache_misses=self._cache_misses,
+            cached_objects=cached_objects,
+            ghost_objects=cache_len - cached_objects,
+            cached_bytes=cached_bytes,
+            commits=self._commits,
+            commit_time=self._commit_time,
+            last_commit_time=self._last_commit_time,
+            data_bytes_written=self._data_bytes_written,
+            history_bytes_written=self._history_bytes_written,
+        )
+
+    def reset_stats(self) -> None:
+        """
+        Reset the accumulated statistics returned by :func:`stats`.
+        """
+        self._con.getTransferCounts(clear=True)
+        self._con_hist.getTransferCounts(clear=True)
+        # transfer counts of connections opened temporarily, e.g. when restoring from history
+        self._loads, self._stores = 0, 0
+        self._cache_hits, self._cache_misses = 0, 0
+        self._commits = 0
+        self._commit_time, self._last_commit_time = 0.0, 0.0
+        self._data_bytes_written, self._history_bytes_written = 0, 0
+
+    def warm_up(self) -> int:
+        """
+        Load all the elements and parameters of the DB into the object cache of the connection.
+
+        Every parameter is stored as a separate record, so accessing all of them for the first time, e.g. when
+        printing the DB, results in many small reads scattered over the DB file. Instead, the records are loaded here
+        in the order in which they are located in the storage, so the file is read in a single forward pass. Storages
+        which support prefetching, such as ZEO, are also asked to prefetch all the records in one batch.
+
+        .. note::
+
+            the cache is trimmed back to `cache_size` objects at the next transaction boundary, so the cache size
+            should be large enough to hold all the parameters for the warm up to be effective.
+
+        :return: the number of parameters which were loaded
+        """
+        elements = self._con.root()["elements"]
+        parameters = [
+            parameter
+            for attributes in elements.values()
+            for parameter in attributes.values()
+            if isinstance(parameter, Persistent)
+            and parameter._p_oid is not None
+            and parameter._p_changed is None
+        ]
+        self._con.prefetch(parameters)
+        index = getattr(self._con._db.storage, "_index", None)
+        if index is not None:
+            # file storages map every object id to the position of its current record in the file
+            parameters.sort(key=lambda parameter: index.get(parameter._p_oid, 0))
+        for parameter in parameters:
+            parameter._p_activate()
+        return len(parameters)
+
+    def _get_parameter(self, element: str, attribute: str) -> QpuParameter:
+        root = self._con.root()
+        if element not in root["elements"]:
+            raise AttributeError(
+                f"element {element} does not exist for element {element}"
+            )
+        if attribute not in root["elements"][element]:
+            raise AttributeError(
+                f"attribute {attribute} does not exist for element {element}"
+            )
+        parameter = root["elements"][element][attribute]
+        # a ghost is a persistent object whose state has not been loaded from the storage
+        if parameter._p_changed is None:
+            self._cache_misses += 1
+        else:
+            self._cache_hits += 1
+        return parameter
+
+    def parameter_version(self, element: str, attribute: str) -> Optional[int]:
+        """
+        :return: a counter which is incremented whenever a parameter is set, so that a change is detected even if it
+            was made within the resolution of the clock. None if the parameter does not exist or the connection is
+            closed. Unlike :func:`get`, this does not count as a read of the parameter.
+        """
+        if self.closed:
+            return None
+        elements = self._con.root()["elements"]
+        if element not in elements or attribute not in elements[element]:
+            return None
+        return elements[element][attribute].version
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
@@ -282,28 +744,16 @@ class _QpuDatabaseConnectionBase(Resource):
         :param new_cal_state: (optional) new calibration state specification
         :param new_confidence_interval: (optional) a ConfidenceInterval object which holds the error in this parameter
         """
-        root = self._con.root()
-
-        if element not in root["elements"]:
-            raise AttributeError(
-                f"element {element} does not exist for element {element}"
-            )
-        if attribute not in root["elements"][element]:
-            raise AttributeError(
-                f"attribute {attribute} does not exist for element {element}"
-            )
+        parameter = self._get_parameter(element, attribute)
         if new_cal_state is None:
-            new_cal_state = root["elements"][element][attribute].cal_state
+            new_cal_state = parameter.cal_state
         if new_confidence_interval is None:
-            new_confidence_interval = root["elements"][element][
-                attribute
-            ].confidence_interval
-        root["elements"][element][attribute].value = value
-        root["elements"][element][attribute].last_updated = datetime.now()
-        root["elements"][element][attribute].cal_state = new_cal_state
-        root["elements"][element][
-            attribute
-        ].confidence_interval = new_confidence_interval
+            new_confidence_interval = parameter.confidence_interval
+        parameter.value = value
+        parameter.last_updated = datetime.now()
+        parameter.cal_state = new_cal_state
+        parameter.confidence_interval = new_confidence_interval
+        parameter.version += 1
 
     def add_attribute(
         self,
@@ -386,20 +836,13 @@ class _QpuDatabaseConnectionBase(Resource):
         :return: a :class:`entropylab_qpudb._qpudatabase.FrozenQpuParameter` instance from which values and modification
         data can be obtained
         """
-        root = self._con.root()
-        if element not in root["elements"]:
-            raise AttributeError(
-                f"element {element} does not exist for element {element}"
-            )
-        if attribute not in root["elements"][element]:
-            raise AttributeError(
-                f"attribute {attribute} does not exist for element {element}"
-            )
+        parameter = self._get_parameter(element, attribute)
+        _record_parameter_read(self, element, attribute)
         return FrozenQpuParameter(
-            deepcopy(root["elements"][element][attribute].value),
-            deepcopy(root["elements"][element][attribute].last_updated),
-            deepcopy(root["elements"][element][attribute].cal_state),
-            deepcopy(root["elements"][element][attribute].confidence_interval),
+            deepcopy(parameter.value),
+            deepcopy(parameter.last_updated),
+            deepcopy(parameter.cal_state),
+            deepcopy(parameter.confidence_interval),
         )
 
     def commit(self, message: Optional[str] = None) -> None:
@@ -409,24 +852,59 @@ class _QpuDatabaseConnectionBase(Resource):
         """
         if self.readonly:
             raise ReadOnlyError("Attempting to commit to a DB in a readonly state")
-        lt_before = self._con._db.lastTransaction()
+        start = time.perf_counter()
+        data_size = self._con._db.storage.getSize()
+        hist_size = self._con_hist._db.storage.getSize()
+        # the objects modified by this connection. The last transaction of the DB can not be used to detect a commit,
+        # since other processes sharing the DB may commit concurrently.
+        modified = list(self._con._registered_objects)
+        marker = uuid.uuid4().hex
+        self._con.transaction_manager.get().setExtendedInfo(_COMMIT_MARKER, marker)
         self._con.transaction_manager.commit()
-        lt_after = self._con._db.lastTransaction()
-        if lt_before != lt_after:  # this means a commit actually took place
-            hist_root = self._con_hist.root()
-            hist_entries = hist_root["entries"]
-            now = datetime.utcnow()
-            hist_entries.append(
-                {"timestamp": now, "connected_tx": lt_after, "message": message}
+        if modified:  # this means a commit actually took place
+            tx = self._committed_transaction(modified[0], marker)
+            entry = {
+                "timestamp": datetime.utcnow(),
+                "connected_tx": tx,
+                "message": message,
+            }
+            index = self._append_history_entry(entry)
+            self._last_commit_time = time.perf_counter() - start
+            self._commit_time += self._last_commit_time
+            self._commits += 1
+            self._data_bytes_written += self._con._db.storage.getSize() - data_size
+            self._history_bytes_written += (
+                self._con_hist._db.storage.getSize() - hist_size
             )
-            self._con_hist.transaction_manager.commit()
             print(
                 f"commiting qpu database {self._dbname} "
-                f"with commit {self._str_hist_entry(hist_entries[-1])} at index {len(hist_entries) - 1}"
+                f"with commit {self._str_hist_entry(entry)} at index {index}"
             )
         else:
             print("did not commit")
 
+    def _committed_transaction(self, obj: Persistent, marker: str) -> bytes:
+        # the serial of an object is not updated when the object is invalidated by the commit, e.g. when a conflict
+        # with another process was resolved, so the transaction is found among the revisions of the object
+        for revision in self._con.db().history(obj._p_oid, _COMMIT_LOOKUP_DEPTH):
+            if revision.get(_COMMIT_MARKER) == marker:
+                return revision["tid"]
+        return obj._p_serial
+
+    def _append_history_entry(self, entry) -> int:
+        # other processes sharing the DB may append entries concurrently, in which case the entries are re-read and
+        # the append is retried. Entries are only ever appended, so that their indices do not change.
+        for attempt in range(_HISTORY_COMMIT_ATTEMPTS):
+            hist_entries = self._con_hist.root()["entries"]
+            hist_entries.append(entry)
+            try:
+                self._con_hist.transaction_manager.commit()
+                return len(hist_entries) - 1
+            except ConflictError:
+                self._con_hist.transaction_manager.abort()
+                if attempt == _HISTORY_COMMIT_ATTEMPTS - 1:
+                    raise
+
     def abort(self):
         self._con.transaction_manager.abort()
 
@@ -464,6 +942,9 @@ class _QpuDatabaseConnectionBase(Resource):
         """
         con = self._open_data_db(history_index)
         self._con.root()["elements"] = deepcopy(con.root()["elements"])
+        loads, stores = con.getTransferCounts()
+        self._loads += loads
+        self._stores += stores
         con.close()
 
 
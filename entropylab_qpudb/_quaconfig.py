@@ -1,64 +1,805 @@
 from collections import UserDict as _UserDict
+from collections.abc import ItemsView as _ItemsView, ValuesView as _ValuesView
 from copy import deepcopy as _deepcopy
+import hashlib as _hashlib
 import json as _json
-from typing import Union, Tuple, List
+import pickle as _pickle
+from contextlib import contextmanager as _contextmanager
+from dataclasses import dataclass as _dataclass, field as _field
+from typing import Union, Tuple, List, Any, Optional, Sequence
+
+import numpy as _np
+
+from entropylab_qpudb._config_serializer import (
+    save_config_data as _save_config_data,
+    load_config_data as _load_config_data,
+)
+
+
+def _to_samples(samples) -> _np.ndarray:
+    """
+    :return: a new array of floats holding the samples
+    """
+    return _np.array(samples, dtype=_np.float64)
+
+
+def _read_only(samples) -> _np.ndarray:
+    """
+    :return: a read-only view of the samples, which does not copy them
+    """
+    view = _np.asarray(samples, dtype=_np.float64).view()
+    view.setflags(write=False)
+    return view
+
+
+def _drag_waveforms(amplitude, sigma, drag_coefficient, detuning, length: int):
+    """
+    :return: the I and Q samples of DRAG pulses of the given length, one row for every set of parameters
+    """
+    t = _np.arange(length) - (length - 1) / 2
+    gaussian = amplitude[:, None] * _np.exp(-(t**2) / (2 * sigma[:, None] ** 2))
+    derivative = -t / sigma[:, None] ** 2 * gaussian
+    # the detuning is in Hz, and the time is in ns
+    rotation = _np.exp(-2j * _np.pi * 1e-9 * detuning[:, None] * t)
+    samples = (gaussian + 1j * drag_coefficient[:, None] * derivative) * rotation
+    return samples.real, samples.imag
+
+
+def _constant_view(sample: float, length: int) -> _np.ndarray:
+    """
+    :return: a read-only array of constant samples, which does not allocate them
+    """
+    return _np.broadcast_to(_np.float64(sample), (length,))
+
+
+def _compact_waveform(waveform: dict) -> dict:
+    """
+    :return: a constant waveform if the waveform is an arbitrary waveform whose samples are all equal, or the
+        waveform otherwise
+    """
+    if waveform.get("type") != "arbitrary" or waveform.keys() != {"type", "samples"}:
+        return waveform
+    samples = _np.asarray(waveform["samples"], dtype=_np.float64)
+    if samples.size == 0 or samples.min() != samples.max():
+        return waveform
+    return {"type": "constant", "sample": float(samples[0])}
+
+
+def _waveform_key(waveform: dict) -> str:
+    """
+    :return: a hash of the content of a waveform entry. Waveforms with the same key play the same samples.
+    """
+    digest = _hashlib.sha256()
+    for key in sorted(waveform):
+        value = waveform[key]
+        digest.update(repr(key).encode())
+        if key == "samples":
+            digest.update(_np.ascontiguousarray(value, dtype=_np.float64).tobytes())
+        else:
+            digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+
+def _canonical_chunks(value):
+    """
+    :return: the chunks of an encoding of a value which only depends on its content: dictionary keys are sorted, and
+        arrays are encoded by their dtype, shape and bytes, so that equal values have the same encoding
+    """
+    if isinstance(value, dict):
+        items = sorted(
+            (b"".join(_canonical_chunks(key)), item) for key, item in value.items()
+        )
+        yield b"d%d:" % len(items)
+        for key, item in items:
+            yield key
+            yield from _canonical_chunks(item)
+    elif isinstance(value, (list, tuple)):
+        yield b"%s%d:" % (b"l" if isinstance(value, list) else b"t", len(value))
+        for item in value:
+            yield from _canonical_chunks(item)
+    elif isinstance(value, (_np.ndarray, _np.generic)):
+        array = _np.ascontiguousarray(value)
+        yield f"a{array.dtype.str}{array.shape}:".encode()
+        yield array.tobytes()
+    elif isinstance(value, str):
+        encoded = value.encode()
+        yield b"s%d:" % len(encoded)
+        yield encoded
+    elif value is None or isinstance(value, (bool, int, float)):
+        yield f"{type(value).__name__}:{value!r};".encode()
+    else:
+        encoded = _pickle.dumps(value, protocol=4)
+        yield b"p%d:" % len(encoded)
+        yield encoded
+
+
+def _content_hash(value) -> str:
+    digest = _hashlib.sha256()
+    for chunk in _canonical_chunks(value):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _copy_entry(value):
+    # arrays are copied with a single memcpy, and read-only arrays are not copied at all
+    if type(value) is dict:
+        return {key: _copy_entry(item) for key, item in value.items()}
+    if isinstance(value, _np.ndarray):
+        return value if not value.flags.writeable else value.copy()
+    return _deepcopy(value)
+
+
+def _json_default(value):
+    if isinstance(value, _np.ndarray):
+        return value.tolist()
+    if isinstance(value, _np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+# marks entries which did not exist when a change was recorded
+_MISSING = object()
+
+
+class _CowSection(dict):
+    """
+    A top level section of a QuaConfig, e.g. its elements, pulses or waveforms.
+
+    The sections of a config and of its copies share their entries (an element, a pulse, a waveform...), and an
+    entry is copied into a section the first time it is accessed through it, unless the section already owns it.
+    Entries are therefore only duplicated when they are accessed, and accessing an entry through a section
+    always returns an entry which can be modified in place. Since an owned entry may still be modified through a
+    reference to it, a copy of the section gets its own copies of the owned entries. `values()` and `items()` are views, which access every
+    entry only when it is iterated over. Code which only reads entries should use :func:`peek`, or iterate over
+    `dict.items(section)`, to avoid copying them.
+
+    The version of a section is incremented whenever an entry is set, deleted, or accessed (and may therefore be
+    modified), so that indexes of the section know when they must be rebuilt.
+
+    While the config has checkpoints, the section keeps a journal for every checkpoint, holding the original of
+    every entry set, deleted or accessed since the checkpoint. The originals are not modified, since an entry is
+    copied when it is first accessed after being recorded.
+    """
+
+    __slots__ = ("_owned", "_version", "_journals")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._owned = set()
+        self._version = 0
+        self._journals = []
+
+    def _record(self, key) -> None:
+        journal = self._journals[-1]
+        if key not in journal:
+            journal[key] = dict.get(self, key, _MISSING)
+            self._owned.discard(key)
+
+    def _undo(self, journal: dict) -> None:
+        for key, value in journal.items():
+            if value is _MISSING:
+                dict.pop(self, key, None)
+            else:
+                dict.__setitem__(self, key, value)
+            self._owned.discard(key)
+        self._version += 1
+
+    def _release(self) -> None:
+        journal = self._journals.pop()
+        if self._journals:
+            outer = self._journals[-1]
+            for key, value in journal.items():
+                outer.setdefault(key, value)
+
+    def _originals(self, level: int) -> dict:
+        """
+        :return: the original of every entry changed since the checkpoint of the given level
+        """
+        originals = {}
+        for journal in self._journals[level:]:
+            for key, value in journal.items():
+                originals.setdefault(key, value)
+        return originals
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    def peek(self, key):
+        """
+        Get an entry without taking ownership of it. The returned entry must not be modified.
+        """
+        return dict.__getitem__(self, key)
+
+    def share_entry(self, key, value) -> None:
+        """
+        Set an entry which is shared with other objects, so that it is copied before it is modified.
+        """
+        if self._journals:
+            self._record(key)
+        dict.__setitem__(self, key, value)
+        self._owned.discard(key)
+        self._version += 1
+
+    def share(self) -> "_CowSection":
+        """
+        :return: a new section which shares the entries of this section which it does not own. The owned entries
+            may have been returned by this section and be modified in place later, so the new section gets copies
+            of them.
+        """
+        section = _CowSection(self)
+        for key in self._owned:
+            dict.__setitem__(section, key, _copy_entry(dict.__getitem__(self, key)))
+        section._owned.update(self._owned)
+        return section
+
+    def __getitem__(self, key):
+        if self._journals:
+            self._record(key)
+        value = dict.__getitem__(self, key)
+        if key not in self._owned:
+            value = _copy_entry(value)
+            dict.__setitem__(self, key, value)
+            self._owned.add(key)
+        self._version += 1
+        return value
+
+    def __setitem__(self, key, value):
+        if self._journals:
+            self._record(key)
+        dict.__setitem__(self, key, value)
+        self._owned.add(key)
+        self._version += 1
+
+    def __delitem__(self, key):
+        if self._journals:
+            self._record(key)
+        dict.__delitem__(self, key)
+        self._owned.discard(key)
+        self._version += 1
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key not in self:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self):
+        key = next(reversed(self.keys()))
+        return key, self.pop(key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def values(self):
+        return _ValuesView(self)
+
+    def items(self):
+        return _ItemsView(self)
+
+    def copy(self):
+        return self.share()
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        return self.share()
+
+
+def _values_equal(a, b) -> bool:
+    if a is b:
+        return True
+    if isinstance(a, _np.ndarray) or isinstance(b, _np.ndarray):
+        return _np.shape(a) == _np.shape(b) and bool(_np.array_equal(a, b))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(
+            _values_equal(dict.__getitem__(a, key), dict.__getitem__(b, key))
+            for key in a
+        )
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return (
+            type(a) is type(b)
+            and len(a) == len(b)
+            and all(_values_equal(x, y) for x, y in zip(a, b))
+        )
+    try:
+        return bool(a == b)
+    except ValueError:
+        return False
+
+
+def _raw_data(config) -> dict:
+    return config.data if isinstance(config, QuaConfig) else config
+
+
+def _raw_items(section):
+    # iterates over a section without taking ownership of its entries
+    return dict.items(section)
+
+
+# edit operations
+_SET = "set"
+_DELETE = "delete"
+
+
+def _raw_get(container, key):
+    # gets a value from a section without taking ownership of it
+    if isinstance(container, _CowSection):
+        return container.peek(key)
+    return container[key]
+
+
+def _diff_entry(path, before, after, edits) -> None:
+    # an entry which may not exist before or after the change
+    if before is _MISSING:
+        if after is not _MISSING:
+            edits.append((_SET, path, _copy_entry(after)))
+    elif after is _MISSING:
+        edits.append((_DELETE, path, None))
+    else:
+        _diff_values(path, before, after, edits)
+
+
+def _section_state(section: "_CowSection", level: int) -> dict:
+    """
+    :return: the entries of a section at the checkpoint of the given level
+    """
+    state = dict(section)
+    for key, value in section._originals(level).items():
+        if value is _MISSING:
+            state.pop(key, None)
+        else:
+            state[key] = value
+    return state
+
+
+def _diff_values(path, before, after, edits) -> None:
+    if before is after:
+        return
+    if not (isinstance(before, dict) and isinstance(after, dict)):
+        if not _values_equal(before, after):
+            edits.append((_SET, path, _copy_entry(after)))
+        return
+    for key, value in _raw_items(after):
+        if key in before:
+            _diff_values(path + (key,), _raw_get(before, key), value, edits)
+        else:
+            edits.append((_SET, path + (key,), _copy_entry(value)))
+    for key in before:
+        if key not in after:
+            edits.append((_DELETE, path + (key,), None))
+
+
+@_dataclass(frozen=True)
+class ConfigDiff:
+    """
+    A declarative record of the changes made to a config: the values set at, and the keys deleted from, paths of
+    nested dictionaries in the config. Lists and other values are recorded as a whole.
+
+    Diffs can be applied to other configs, compared, hashed, and pickled, unlike arbitrary functions.
+    A diff can also be used as the function of a config patch, since calling it applies it.
+    """
+
+    # (operation, path, value) tuples
+    edits: Tuple[Tuple[str, Tuple, Any], ...] = ()
+    # a description of the origin of the diff, which is not part of its content
+    label: str = _field(default="", compare=False)
+
+    @classmethod
+    def between(cls, before, after, label: str = "") -> "ConfigDiff":
+        """
+        :param before: a config, or a config dictionary
+        :param after: a config, or a config dictionary
+        :param label: an optional description of the diff
+        :return: the diff which turns `before` into `after`. Entries which are shared by the two configs, e.g.
+        unmodified entries of a copied QuaConfig, are not compared.
+        """
+        edits = []
+        _diff_values((), _raw_data(before), _raw_data(after), edits)
+        return cls(tuple(edits), label)
+
+    def apply(self, config) -> None:
+        """
+        Apply the changes to a config, in place.
+        """
+        for operation, path, value in self.edits:
+            container = config
+            for key in path[:-1]:
+                container = container[key]
+            key = path[-1]
+            if operation == _DELETE:
+                del container[key]
+            elif isinstance(container, _CowSection):
+                # the value is kept by the diff, and is copied by the section before it is modified
+                container.share_entry(key, value)
+            elif isinstance(container, QuaConfig) and isinstance(value, dict):
+                # becomes a section, which shares the entries of the value
+                container[key] = value
+            else:
+                container[key] = _copy_entry(value)
+
+    def __call__(self, config, context=None) -> None:
+        self.apply(config)
+
+    def __eq__(self, other):
+        if not isinstance(other, ConfigDiff):
+            return NotImplemented
+        return _values_equal(self.edits, other.edits)
+
+    def content_hash(self) -> str:
+        """
+        :return: a hash of the changes. Diffs with the same hash make the same changes.
+        """
+        return _content_hash(self.edits)
+
+    def __str__(self):
+        lines = [self.label] if self.label else []
+        for operation, path, _ in self.edits:
+            lines.append(f"{operation} {'.'.join(str(key) for key in path)}")
+        return "\n".join(lines)
+
+
+def _index_mixer_entries(mixers) -> dict:
+    return {
+        (mixer, entry["intermediate_frequency"], entry["lo_frequency"]): position
+        for mixer, entries in _raw_items(mixers)
+        for position, entry in enumerate(entries)
+    }
+
+
+def _element_ports(element: dict):
+    if "singleInput" in element:
+        yield element["singleInput"]["port"]
+    if "mixInputs" in element:
+        yield element["mixInputs"]["I"]
+        yield element["mixInputs"]["Q"]
+
+
+def _index_port_elements(elements) -> dict:
+    index = {}
+    for name, element in _raw_items(elements):
+        for port in _element_ports(element):
+            index.setdefault(tuple(port), []).append(name)
+    return index
+
+
+def _index_pulse_elements(elements) -> dict:
+    index = {}
+    for name, element in _raw_items(elements):
+        for pulse in set(element.get("operations", {}).values()):
+            index.setdefault(pulse, []).append(name)
+    return index
+
+
+def _index_waveform_pulses(pulses) -> dict:
+    index = {}
+    for name, pulse in _raw_items(pulses):
+        for waveform in set(pulse.get("waveforms", {}).values()):
+            index.setdefault(waveform, []).append(name)
+    return index
+
+
+# the section and builder of every index
+_INDEXES = {
+    "mixer_entries": ("mixers", _index_mixer_entries),
+    "port_elements": ("elements", _index_port_elements),
+    "pulse_elements": ("elements", _index_pulse_elements),
+    "waveform_pulses": ("pulses", _index_waveform_pulses),
+}
+
+
+class ConfigCheckpoint:
+    """
+    A checkpoint of a :class:`QuaConfig`, returned by :func:`QuaConfig.checkpoint`
+    """
+
+    __slots__ = ("_config", "_level", "_changes")
+
+    def __init__(self, config: "QuaConfig", level: int):
+        self._config = config
+        self._level = level
+        # the original of every top level value of the config set or deleted since the checkpoint
+        self._changes = {}
+
+    @property
+    def active(self) -> bool:
+        return self._config is not None
+
+    def __repr__(self):
+        return f"ConfigCheckpoint(level={self._level}, active={self.active})"
 
 
 class QuaConfig(_UserDict):
-    def __init__(self, data):
+    """
+    A QUA config dictionary with helper methods for modifying it.
+
+    Copying a QuaConfig (using :func:`copy`, `copy.copy` or `copy.deepcopy`) is cheap, since the copies share all the
+    elements, pulses, waveforms and other entries of the config, and an entry is only duplicated when it is accessed
+    through one of the copies.
+
+    The samples of arbitrary waveforms are kept as numpy arrays of floats, and are converted to lists only when the
+    config is serialized. Read-only arrays are shared by the copies of a config, and are never copied.
+
+    When compact waveforms are enabled, the `add_control_operation_*` and `update_measurement_waveforms` methods
+    add a constant waveform instead of an arbitrary waveform whose samples are all equal, e.g. all zero. The samples
+    of constant waveforms are returned by :func:`get_waveform_arrays_from_op` as read-only views, which are not
+    allocated.
+
+    When waveform interning is enabled, the `add_control_operation_*` and `update_measurement_waveforms` methods
+    add a single waveform entry for identical samples, which is shared by all the pulses playing them. Interned
+    waveforms are named by their content, and their samples are read-only. Use :func:`compact` to merge the
+    identical waveforms of an existing config.
+
+    Lookups of mixer entries, and of the elements and pulses using a port, pulse or waveform, use indexes which are
+    built on the first lookup, and rebuilt after the section they index was modified or accessed. The mutation
+    helpers of the config keep the indexes they do not affect.
+
+    .. note::
+
+        nested objects obtained from a config, e.g. an element dictionary, should not be modified after the config
+        is copied, since they may be shared with the copy.
+    """
+
+    def __init__(
+        self, data, intern_waveforms: bool = False, compact_waveforms: bool = False
+    ):
+        """
+        :param data: the config dictionary
+        :param intern_waveforms: whether to share a single waveform entry between all the pulses with identical
+            samples
+        :param compact_waveforms: whether to add constant waveforms instead of arbitrary waveforms with constant
+            samples
+        """
+        # the active checkpoints, innermost last
+        self._checkpoints: List[ConfigCheckpoint] = []
         super().__init__(data)
-        self._data_orig = _deepcopy(data)
+        self.intern_waveforms = intern_waveforms
+        self.compact_waveforms = compact_waveforms
+        # the name of the interned waveform of every waveform key, built when the first waveform is interned
+        self._interned = None
+        # the section, section version and content of every index built
+        self._indexes = {}
+        self._convert_samples()
+        self._data_orig = self._share_data(self.data)
+
+    def _convert_samples(self):
+        waveforms = self.data.get("waveforms")
+        if not isinstance(waveforms, _CowSection):
+            return
+        for name, waveform in _raw_items(waveforms):
+            samples = waveform.get("samples") if isinstance(waveform, dict) else None
+            if samples is not None and not isinstance(samples, _np.ndarray):
+                waveforms.share_entry(
+                    name, {**waveform, "samples": _to_samples(samples)}
+                )
+
+    def __eq__(self, other):
+        if isinstance(other, QuaConfig):
+            other = other.data
+        if not isinstance(other, dict):
+            return NotImplemented
+        return _values_equal(self.data, other)
+
+    def __setitem__(self, key, value):
+        current = self.data.get(key, _MISSING)
+        if value is current:
+            return
+        if self._checkpoints:
+            if isinstance(current, _CowSection) and isinstance(value, dict):
+                # the section is replaced in place, so that the changes to its entries are recorded
+                for entry in [entry for entry in current if entry not in value]:
+                    del current[entry]
+                for entry, entry_value in _raw_items(value):
+                    current.share_entry(entry, entry_value)
+                return
+            self._checkpoints[-1]._changes.setdefault(key, current)
+        if isinstance(value, _CowSection):
+            value = value.share()
+        elif isinstance(value, dict):
+            value = _CowSection(value)
+        if isinstance(value, _CowSection):
+            value._journals = [{} for _ in self._checkpoints]
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        if self._checkpoints:
+            self._checkpoints[-1]._changes.setdefault(key, self.data.get(key, _MISSING))
+        del self.data[key]
+
+    @staticmethod
+    def _share_data(data):
+        return {
+            key: value.share() if isinstance(value, _CowSection) else _deepcopy(value)
+            for key, value in data.items()
+        }
+
+    def copy(self) -> "QuaConfig":
+        """
+        :return: a copy of the config, which shares the entries of this config until they are accessed. The entries
+            already accessed through this config are copied, since they may still be modified in place.
+        """
+        config = self.__class__.__new__(self.__class__)
+        config.__dict__.update(self.__dict__)
+        config.data = self._share_data(self.data)
+        if self._interned is not None:
+            config._interned = dict(self._interned)
+        config._indexes = {}
+        config._checkpoints = []
+        return config
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __getstate__(self):
+        # the indexes refer to the sections of the config, and are rebuilt when needed
+        state = dict(self.__dict__)
+        state["_indexes"] = {}
+        state["_checkpoints"] = []
+        return state
+
+    def _add_waveform(self, name, samples) -> str:
+        """
+        Add an arbitrary waveform, or a constant waveform if compact waveforms are enabled and the samples are
+        constant, or find an identical interned waveform if waveform interning is enabled
+
+        :return: the name of the waveform entry
+        """
+        waveform = {"type": "arbitrary", "samples": _to_samples(samples)}
+        if self.compact_waveforms:
+            waveform = _compact_waveform(waveform)
+        if not self.intern_waveforms:
+            self.data["waveforms"][name] = waveform
+            return name
+        if "samples" in waveform:
+            waveform["samples"].setflags(write=False)
+        key = _waveform_key(waveform)
+        if self._interned is None:
+            self._interned = {
+                _waveform_key(entry): entry_name
+                for entry_name, entry in _raw_items(self.data["waveforms"])
+            }
+        interned_name = self._interned.get(key)
+        # the interned waveform may have been removed or replaced since it was added
+        if (
+            interned_name not in self.data["waveforms"]
+            or _waveform_key(self.data["waveforms"].peek(interned_name)) != key
+        ):
+            interned_name = f"wf_{key[:16]}"
+            self.data["waveforms"][interned_name] = waveform
+            self._interned[key] = interned_name
+        return interned_name
 
     def add_control_operation_iq(self, element, operation_name, wf_i, wf_q):
         pulse_name = element + "_" + operation_name + "_in"
-        self.data["waveforms"][pulse_name + "_i"] = {
-            "type": "arbitrary",
-            "samples": list(wf_i),
-        }
-        self.data["waveforms"][pulse_name + "_q"] = {
-            "type": "arbitrary",
-            "samples": list(wf_q),
-        }
+        waveform_i = self._add_waveform(pulse_name + "_i", wf_i)
+        waveform_q = self._add_waveform(pulse_name + "_q", wf_q)
         self.data["pulses"][pulse_name] = {
             "operation": "control",
             "length": len(wf_i),
-            "waveforms": {"I": pulse_name + "_i", "Q": pulse_name + "_q"},
+            "waveforms": {"I": waveform_i, "Q": waveform_q},
         }
-        self.data["elements"][element]["operations"][operation_name] = pulse_name
+        with self._keeping_indexes("port_elements"):
+            self.data["elements"][element]["operations"][operation_name] = pulse_name
 
     def add_control_operation_single(self, element, operation_name, wf):
         pulse_name = element + "_" + operation_name + "_in"
-        self.data["waveforms"][pulse_name + "_single"] = {
-            "type": "arbitrary",
-            "samples": list(wf),
-        }
+        waveform = self._add_waveform(pulse_name + "_single", wf)
         self.data["pulses"][pulse_name] = {
             "operation": "control",
             "length": len(wf),
-            "waveforms": {"single": pulse_name + "_single"},
+            "waveforms": {"single": waveform},
         }
-        self.data["elements"][element]["operations"][operation_name] = pulse_name
+        with self._keeping_indexes("port_elements"):
+            self.data["elements"][element]["operations"][operation_name] = pulse_name
+
+    def add_control_operations_iq(
+        self, elements: Sequence[str], operation_name: str, wfs_i, wfs_q
+    ) -> None:
+        """
+        Add the same operation to several mixInputs elements, with different waveforms
+
+        :param elements: the names of the elements
+        :param operation_name: the name of the operation
+        :param wfs_i: the I samples of every element, one row for every element
+        :param wfs_q: the Q samples of every element, one row for every element
+        """
+        wfs_i = _np.asarray(wfs_i, dtype=_np.float64)
+        wfs_q = _np.asarray(wfs_q, dtype=_np.float64)
+        if not (wfs_i.shape == wfs_q.shape and wfs_i.shape[:1] == (len(elements),)):
+            raise ValueError(
+                "there must be a row of I and Q samples of the same length for every element"
+            )
+        pulses = self.data["pulses"]
+        with self._keeping_indexes("port_elements"):
+            config_elements = self.data["elements"]
+            for element, wf_i, wf_q in zip(elements, wfs_i, wfs_q):
+                pulse_name = element + "_" + operation_name + "_in"
+                # the rows are copied, so that they do not keep the whole batch alive
+                waveform_i = self._add_waveform(pulse_name + "_i", wf_i)
+                waveform_q = self._add_waveform(pulse_name + "_q", wf_q)
+                pulses[pulse_name] = {
+                    "operation": "control",
+                    "length": len(wf_i),
+                    "waveforms": {"I": waveform_i, "Q": waveform_q},
+                }
+                config_elements[element]["operations"][operation_name] = pulse_name
+
+    def add_drag_operations(
+        self,
+        elements: Sequence[str],
+        operation_name: str,
+        amplitude,
+        sigma,
+        length,
+        drag_coefficient=0.0,
+        detuning=0.0,
+    ) -> None:
+        """
+        Add a DRAG operation to several mixInputs elements. The waveforms of all the elements are computed together.
+        Every parameter can be either a single value, shared by all the elements, or a value for every element.
+
+        The I samples are a gaussian `amplitude * exp(-t^2 / (2 * sigma^2))`, with t in ns relative to the center of
+        the pulse, and the Q samples are its derivative times `drag_coefficient`. The pulse is then rotated by
+        `exp(-2 pi i * detuning * t)`.
+
+        :param elements: the names of the elements
+        :param operation_name: the name of the operation
+        :param amplitude: the amplitude of the gaussian
+        :param sigma: the standard deviation of the gaussian, in ns
+        :param length: the length of the pulse, in ns
+        :param drag_coefficient: the DRAG coefficient, in ns
+        :param detuning: the detuning of the pulse, in Hz
+        """
+        elements = list(elements)
+        shape = (len(elements),)
+        amplitude, sigma, drag_coefficient, detuning = (
+            _np.broadcast_to(_np.asarray(value, dtype=_np.float64), shape)
+            for value in (amplitude, sigma, drag_coefficient, detuning)
+        )
+        length = _np.broadcast_to(_np.asarray(length, dtype=int), shape)
+        # the elements with the same pulse length are computed together
+        for pulse_length in _np.unique(length):
+            rows = _np.flatnonzero(length == pulse_length)
+            wfs_i, wfs_q = _drag_waveforms(
+                amplitude[rows],
+                sigma[rows],
+                drag_coefficient[rows],
+                detuning[rows],
+                int(pulse_length),
+            )
+            self.add_control_operations_iq(
+                [elements[row] for row in rows], operation_name, wfs_i, wfs_q
+            )
 
     def copy_measurement_operation(self, element, operation_name, new_name):
         pulse_name = self.data["elements"][element]["operations"][operation_name]
         self.data["pulses"][new_name + "in"] = _deepcopy(
-            self.data["pulses"][pulse_name]
+            self.data["pulses"].peek(pulse_name)
         )
         self.data["elements"][element]["operations"][new_name] = new_name + "in"
 
     def update_measurement_waveforms(self, element, operation_name, wf_i, wf_q):
-        pulse_name = self.data["elements"][element]["operations"][operation_name]
-        self.data["waveforms"][pulse_name + "_i"] = {
-            "type": "arbitrary",
-            "samples": list(wf_i),
-        }
-        self.data["waveforms"][pulse_name + "_q"] = {
-            "type": "arbitrary",
-            "samples": list(wf_q),
-        }
+        pulse_name = self.data["elements"].peek(element)["operations"][operation_name]
         self.data["pulses"][pulse_name]["waveforms"] = {
-            "I": pulse_name + "_i",
-            "Q": pulse_name + "_q",
+            "I": self._add_waveform(pulse_name + "_i", wf_i),
+            "Q": self._add_waveform(pulse_name + "_q", wf_q),
         }
         self.data["pulses"][pulse_name]["length"] = len(wf_i)
 
@@ -69,12 +810,255 @@ class QuaConfig(_UserDict):
         iw_name = self.data["pulses"][pulse_name]["integration_weights"][iw_op_name]
         self.data["integration_weights"][iw_name] = {"cosine": iw_cos, "sine": iw_sin}
 
+    def _modification_key(self) -> tuple:
+        """
+        :return: a key which changes whenever a top level value of the config is replaced, or an entry of a section
+        is set, deleted or accessed (and may therefore have been modified)
+        """
+        return tuple(
+            (key, id(value), value._version if isinstance(value, _CowSection) else None)
+            for key, value in self.data.items()
+        )
+
+    def _sections(self) -> List[_CowSection]:
+        return [value for value in self.data.values() if isinstance(value, _CowSection)]
+
+    def checkpoint(self) -> "ConfigCheckpoint":
+        """
+        Start recording the changes made to the config, so that they can be listed with :func:`changes_since` or
+        undone with :func:`rollback`. Checkpoints are nested, and the changes are recorded until the checkpoint is
+        released with :func:`release` or rolled back. Only the original of every changed entry is recorded, and no
+        entries are copied.
+
+        :return: the checkpoint
+        """
+        checkpoint = ConfigCheckpoint(self, len(self._checkpoints))
+        self._checkpoints.append(checkpoint)
+        for section in self._sections():
+            section._journals.append({})
+        return checkpoint
+
+    def _checkpoint_level(self, checkpoint: "ConfigCheckpoint") -> int:
+        if (
+            checkpoint._config is not self
+            or self._checkpoints[checkpoint._level] is not checkpoint
+        ):
+            raise ValueError("the checkpoint is not an active checkpoint of the config")
+        return checkpoint._level
+
+    def release(self, checkpoint: Optional["ConfigCheckpoint"] = None) -> None:
+        """
+        Stop recording the changes made since the innermost checkpoint. The changes are kept by the outer
+        checkpoints.
+
+        :param checkpoint: (optional) the checkpoint to release, which must be the innermost checkpoint
+        """
+        if not self._checkpoints:
+            raise ValueError("the config has no checkpoints")
+        if checkpoint is not None and checkpoint is not self._checkpoints[-1]:
+            raise ValueError("only the innermost checkpoint can be released")
+        checkpoint = self._checkpoints.pop()
+        for section in self._sections():
+            if len(section._journals) > checkpoint._level:
+                section._release()
+        if self._checkpoints:
+            outer = self._checkpoints[-1]._changes
+            for key, value in checkpoint._changes.items():
+                outer.setdefault(key, value)
+        checkpoint._config = None
+
+    def rollback(self, checkpoint: Optional["ConfigCheckpoint"] = None) -> None:
+        """
+        Undo the changes made to the config since the innermost checkpoint, and release it.
+        This restores the original of every changed entry, and takes time proportional to the number of changed
+        entries, regardless of the size of the config.
+
+        :param checkpoint: (optional) the checkpoint to roll back to, which must be the innermost checkpoint
+        """
+        if not self._checkpoints:
+            raise ValueError("the config has no checkpoints")
+        if checkpoint is not None and checkpoint is not self._checkpoints[-1]:
+            raise ValueError("only the innermost checkpoint can be rolled back")
+        checkpoint = self._checkpoints.pop()
+        for key, value in checkpoint._changes.items():
+            if value is _MISSING:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = value
+        # a restored section may have been changed at this checkpoint before it was replaced
+        for section in self._sections():
+            while len(section._journals) > checkpoint._level:
+                section._undo(section._journals.pop())
+        checkpoint._config = None
+
+    def changes_since(
+        self, checkpoint: Optional["ConfigCheckpoint"] = None, label: str = ""
+    ) -> ConfigDiff:
+        """
+        The changes made to the config since a checkpoint, down to the changed values of nested dictionaries.
+        Only the entries which were set, deleted or accessed since the checkpoint are compared.
+
+        :param checkpoint: an active checkpoint of the config. If not given, the changes since the config was
+            created (or reset) are returned.
+        :param label: an optional description of the diff
+        :return: the diff which turns the config at the checkpoint into the config
+        """
+        if checkpoint is None:
+            return ConfigDiff.between(self._data_orig, self, label)
+        level = self._checkpoint_level(checkpoint)
+        originals = {}
+        for outer in self._checkpoints[level:]:
+            for key, value in outer._changes.items():
+                originals.setdefault(key, value)
+        edits = []
+        for key, original in originals.items():
+            if isinstance(original, _CowSection):
+                original = _section_state(original, level)
+            _diff_entry((key,), original, self.data.get(key, _MISSING), edits)
+        for key, section in self.data.items():
+            if key in originals or not isinstance(section, _CowSection):
+                continue
+            for entry, original in section._originals(level).items():
+                current = dict.get(section, entry, _MISSING)
+                _diff_entry((key, entry), original, current, edits)
+        return ConfigDiff(tuple(edits), label)
+
+    def diff(self, other, label: str = "") -> ConfigDiff:
+        """
+        :param other: a config, or a config dictionary
+        :param label: an optional description of the diff
+        :return: the diff which turns this config into `other`. Entries shared by the two configs, e.g. the
+            unmodified entries of a copy of the config, are not compared.
+        """
+        return ConfigDiff.between(self, other, label)
+
+    def compact(
+        self, remove_unused: bool = True, constant_waveforms: bool = True
+    ) -> int:
+        """
+        Merge identical waveforms into a single waveform entry, and update the pulses playing them.
+
+        :param remove_unused: whether to also remove the waveforms which are not played by any pulse
+        :param constant_waveforms: whether to also replace arbitrary waveforms whose samples are all equal with
+            constant waveforms
+        :return: the number of removed waveform entries
+        """
+        waveforms = self.data["waveforms"]
+        pulses = self.data["pulses"]
+        if constant_waveforms:
+            for name, waveform in list(_raw_items(waveforms)):
+                compacted = _compact_waveform(waveform)
+                if compacted is not waveform:
+                    waveforms[name] = compacted
+        # the first waveform with every content is kept
+        kept = {}
+        renamed = {}
+        for name, waveform in _raw_items(waveforms):
+            renamed[name] = kept.setdefault(_waveform_key(waveform), name)
+        used = set()
+        for pulse_name, pulse in _raw_items(pulses):
+            pulse_waveforms = pulse.get("waveforms", {})
+            updated = {
+                port: renamed.get(waveform, waveform)
+                for port, waveform in pulse_waveforms.items()
+            }
+            used.update(updated.values())
+            if updated != pulse_waveforms:
+                pulses[pulse_name]["waveforms"] = updated
+        removed = [
+            name
+            for name, kept_name in renamed.items()
+            if name != kept_name or (remove_unused and name not in used)
+        ]
+        for name in removed:
+            del waveforms[name]
+        if self._interned is not None:
+            self._interned = {
+                key: name for key, name in kept.items() if name in waveforms
+            }
+        return len(removed)
+
     def reset(self):
-        self.data = _deepcopy(self._data_orig)
+        """
+        Return the config to the state it was created in, discarding all its checkpoints.
+        """
+        for checkpoint in self._checkpoints:
+            checkpoint._config = None
+        self._checkpoints = []
+        self.data = self._share_data(self._data_orig)
+        self._interned = None
+
+    def _plain_data(self) -> dict:
+        # sections are converted to plain dictionaries, so that serializing them does not copy their entries
+        return {
+            key: dict(value) if isinstance(value, _CowSection) else value
+            for key, value in self.data.items()
+        }
 
     def dump(self, filename):
-        with open("config.json", "w") as fp:
-            _json.dump(self.data, fp)
+        """
+        Write the config as JSON, in the format expected by QUA. Samples arrays are written as lists.
+        To save a config and load it back, use :func:`save` and :func:`load` instead.
+
+        :param filename: the path of the JSON file
+        """
+        with open(filename, "w") as fp:
+            # the sections are encoded one at a time, which is much faster than encoding the config in small chunks
+            fp.write("{")
+            for index, (key, value) in enumerate(self._plain_data().items()):
+                if index:
+                    fp.write(", ")
+                fp.write(f"{_json.dumps(str(key))}: ")
+                fp.write(_json.dumps(value, default=_json_default))
+            fp.write("}")
+
+    def save(self, filename, compress: bool = False) -> None:
+        """
+        Save the config to a file, which can be loaded back with :func:`load`.
+        The samples arrays of the config are written in binary form, and are not converted to lists.
+        The `intern_waveforms` and `compact_waveforms` options of the config are saved with it.
+
+        :param filename: the path of the file, or a writable binary file
+        :param compress: whether to compress the file
+        """
+        _save_config_data(
+            self._plain_data(),
+            filename,
+            compress,
+            {
+                "intern_waveforms": self.intern_waveforms,
+                "compact_waveforms": self.compact_waveforms,
+            },
+        )
+
+    @classmethod
+    def load(
+        cls,
+        filename,
+        intern_waveforms: Optional[bool] = None,
+        compact_waveforms: Optional[bool] = None,
+    ) -> "QuaConfig":
+        """
+        Load a config saved with :func:`save`
+
+        :param filename: the path of the file, or a readable binary file
+        :param intern_waveforms: (optional) overrides the `intern_waveforms` option the config was saved with
+        :param compact_waveforms: (optional) overrides the `compact_waveforms` option the config was saved with
+        :return: the loaded config
+        """
+        data, options = _load_config_data(filename)
+        if intern_waveforms is None:
+            intern_waveforms = options.get("intern_waveforms", False)
+        if compact_waveforms is None:
+            compact_waveforms = options.get("compact_waveforms", False)
+        return cls(data, intern_waveforms, compact_waveforms)
+
+    def content_hash(self) -> str:
+        """
+        :return: a hash of the content of the config. Configs with the same hash have the same content, and equal
+            configs have the same hash, regardless of the order in which their entries were added.
+        """
+        return _content_hash(self._plain_data())
 
     def get_waveforms_from_op(
         self, element: str, operation: str
@@ -83,36 +1067,118 @@ class QuaConfig(_UserDict):
         Get output waveforms associated with an operation on a quantum element.
         For both arbitrary and constant pulses, the waveform returned will be the actual values played.
 
+        The samples are converted to new lists. To get the samples without converting them, use
+        :func:`get_waveform_arrays_from_op`.
+
         :param element: Name of the element
         :param operation: Name of the operation
         :return: Either a waveform entries list if element is of type singleInput, or a tuple of waveform entries list if element is of type mixedInputs.
         """
-        pulse = self.get_pulse_from_op(element, operation)
-        if "mixInputs" in self.data["elements"][element]:
-            waveform_i = self.data["waveforms"][pulse["waveforms"]["I"]]
+        waveforms = self.get_waveform_arrays_from_op(element, operation)
+        if isinstance(waveforms, tuple):
+            return waveforms[0].tolist(), waveforms[1].tolist()
+        return waveforms.tolist()
+
+    def get_waveform_arrays_from_op(
+        self, element: str, operation: str
+    ) -> Union[Tuple[_np.ndarray, _np.ndarray], _np.ndarray]:
+        """
+        Get output waveforms associated with an operation on a quantum element, as numpy arrays.
+        For both arbitrary and constant pulses, the waveform returned will be the actual values played.
+
+        The returned arrays are not copied, and may be shared with copies of the config, so they are read-only.
+        The arrays of constant waveforms are views, which are not allocated.
+
+        :param element: Name of the element
+        :param operation: Name of the operation
+        :return: Either a read-only samples array if element is of type singleInput, or a tuple of read-only samples arrays if element is of type mixedInputs.
+        """
+        pulse = self._peek_pulse_from_op(element, operation)
+        if "mixInputs" in self.data["elements"].peek(element):
+            waveform_i = self.data["waveforms"].peek(pulse["waveforms"]["I"])
             if waveform_i["type"] == "arbitrary":
-                waveform_i = waveform_i["samples"]
+                waveform_i = _read_only(waveform_i["samples"])
             else:
-                waveform_i = [waveform_i["sample"]] * pulse["length"]
+                waveform_i = _constant_view(waveform_i["sample"], pulse["length"])
 
-            waveform_q = self.data["waveforms"][pulse["waveforms"]["Q"]]
+            waveform_q = self.data["waveforms"].peek(pulse["waveforms"]["Q"])
             if waveform_q["type"] == "arbitrary":
-                waveform_q = waveform_q["samples"]
+                waveform_q = _read_only(waveform_q["samples"])
             else:
-                waveform_q = [waveform_q["sample"]] * pulse["length"]
+                waveform_q = _constant_view(waveform_q["sample"], pulse["length"])
             return waveform_i, waveform_q
         else:
-            waveform = self.data["waveforms"][pulse["waveforms"]["single"]]
+            waveform = self.data["waveforms"].peek(pulse["waveforms"]["single"])
             if waveform["type"] == "arbitrary":
-                waveform = waveform["samples"]
+                waveform = _read_only(waveform["samples"])
             else:
-                waveform = [waveform["sample"]] * pulse["length"]
+                waveform = _constant_view(waveform["sample"], pulse["length"])
             return waveform
 
     def get_pulse_from_op(self, element, operation):
         return self.data["pulses"][
-            self.data["elements"][element]["operations"][operation]
+            self.data["elements"].peek(element)["operations"][operation]
+        ]
+
+    def _peek_pulse_from_op(self, element, operation):
+        return self.data["pulses"].peek(
+            self.data["elements"].peek(element)["operations"][operation]
+        )
+
+    def _index(self, name: str) -> dict:
+        section_name, build = _INDEXES[name]
+        section = self.data.get(section_name, {})
+        if not isinstance(section, _CowSection):
+            return build(section)
+        cached = self._indexes.get(name)
+        if (
+            cached is not None
+            and cached[0] is section
+            and cached[1] == section._version
+        ):
+            return cached[2]
+        index = build(section)
+        self._indexes[name] = (section, section._version, index)
+        return index
+
+    @_contextmanager
+    def _keeping_indexes(self, *names: str):
+        """
+        Keep the given indexes, which must not be affected by the changes made to the config within the context
+        (or be updated by them), if they are up to date when entering it.
+        """
+        kept = [
+            name
+            for name in names
+            if name in self._indexes
+            and self._indexes[name][0] is self.data.get(_INDEXES[name][0])
+            and self._indexes[name][1] == self._indexes[name][0]._version
         ]
+        yield
+        for name in kept:
+            section, _, index = self._indexes[name]
+            self._indexes[name] = (section, section._version, index)
+
+    def get_elements_by_port(self, port: Tuple[str, int]) -> List[str]:
+        """
+        :param port: an analog output port, of the form (con_name, port number)
+        :return: the elements whose inputs are connected to the port
+        """
+        return list(self._index("port_elements").get(tuple(port), ()))
+
+    def get_elements_by_pulse(self, pulse: str) -> List[str]:
+        """
+        :param pulse: the name of a pulse
+        :return: the elements with an operation playing the pulse
+        """
+        return list(self._index("pulse_elements").get(pulse, ()))
+
+    def get_pulses_by_waveform(self, waveform: str) -> List[str]:
+        """
+        :param waveform: the name of a waveform
+        :return: the pulses playing the waveform
+        """
+        return list(self._index("waveform_pulses").get(waveform, ()))
 
     def update_intermediate_frequency(
         self, element: str, new_if: float, strict=True
@@ -126,21 +1192,24 @@ class QuaConfig(_UserDict):
         :param strict: if `True`, will not update correction matrix. If false, will also replace the entry
         in the corresponding correction matrix
         """
-        old_if = self.data["elements"][element]["intermediate_frequency"]
+        element_data = self.data["elements"].peek(element)
+        old_if = element_data["intermediate_frequency"]
+        position = None
         if not strict:
+            mixer = element_data["mixInputs"]["mixer"]
+            lo_freq = element_data["mixInputs"]["lo_frequency"]
+            entries = self._index("mixer_entries")
+            position = entries.get((mixer, old_if, lo_freq))
+            if position is None:
+                raise KeyError(
+                    f"mixer {mixer} has no entry for IF {old_if} and LO {lo_freq}"
+                )
+        with self._keeping_indexes("mixer_entries", "port_elements", "pulse_elements"):
             self.data["elements"][element]["intermediate_frequency"] = new_if
-            mixer = self.data["elements"][element]["mixInputs"]["mixer"]
-            lo_freq = self.data["elements"][element]["mixInputs"]["lo_frequency"]
-            found_entry_index = None
-            for entry in self.data["mixers"][mixer]:
-                if (
-                    entry["intermediate_frequency"] == old_if
-                    and entry["lo_frequency"] == lo_freq
-                ):
-                    found_entry_index = entry
-            self.data["mixers"][mixer][found_entry_index][
-                "intermediate_frequency"
-            ] = new_if
+            if position is not None:
+                self.data["mixers"][mixer][position]["intermediate_frequency"] = new_if
+                del entries[(mixer, old_if, lo_freq)]
+                entries[(mixer, new_if, lo_freq)] = position
 
     def update_op_amp(self, element, operation, amp):
         pulse = self.get_pulse_from_op(element, operation)
@@ -175,7 +1244,7 @@ class QuaConfig(_UserDict):
             or 'I', 'Q' if element has mixed inputs.
         :return: a tuple of the form (con_name, port number)
         """
-        element_data = self.data["elements"][element]
+        element_data = self.data["elements"].peek(element)
         if element_input == "single":
             if "singleInput" in element_data:
                 return element_data["singleInput"]["port"]
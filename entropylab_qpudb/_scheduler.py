@@ -0,0 +1,372 @@
+import threading
+from dataclasses import dataclass, asdict, replace
+from datetime import datetime
+from enum import Enum, auto
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+import pandas as pd
+from entropylab import Graph
+from entropylab.api.graph import Node
+from entropylab.instruments.lab_topology import ExperimentResources
+
+from entropylab_qpudb._entropy_cal import QuaCalNode
+from entropylab_qpudb._qpudatabase import QpuDatabaseConnection
+
+
+class NodeStatus(Enum):
+    IN_SPEC = auto()
+    STALE = auto()
+    OUT_OF_SPEC = auto()
+
+    def __str__(self):
+        return self.name
+
+
+class ScheduledAction(Enum):
+    SKIP = auto()
+    CHECK = auto()
+    CALIBRATE = auto()
+
+    def __str__(self):
+        return self.name
+
+
+@dataclass(frozen=True)
+class SchedulerDecision:
+    """
+    The decision taken by a :class:`QuaCalScheduler` for a single calibration node
+    """
+
+    node: str
+    status: NodeStatus
+    action: ScheduledAction
+    reason: str
+    # whether the data check passed, for nodes whose data was checked
+    check_passed: Optional[bool] = None
+    # the graph run of :func:`QuaCalScheduler.maintain` in which the decision was taken
+    iteration: int = 0
+
+
+_DECISION_COLUMNS = ["node", "status", "action", "reason", "check_passed", "iteration"]
+
+
+class QuaCalScheduler:
+    """
+    Runs only the calibrations needed to bring a set of calibration nodes within spec, in the spirit of the
+    maintain / diagnose algorithm of Optimus (https://arxiv.org/abs/1803.03226).
+
+    The status of a :class:`~entropylab_qpudb._entropy_cal.QuaCalNode` is determined by the QPU DB parameters it
+    calibrates (its `calibrated_parameters`):
+
+    - out of spec, if a parameter is missing, its calibration state is below the node's `required_state`, or its
+      confidence interval error is unknown or larger than the node's `max_error`
+    - stale, if a parameter was last updated longer than the node's `calibration_timeout` ago, or before a parameter of
+      one of its dependencies was updated
+    - in spec otherwise
+
+    When a graph is run with the scheduler as the `scheduler` run argument (see :func:`maintain`), nodes in spec are
+    skipped, out of spec nodes are calibrated (their `prepare_config` and `run_program` are called), and stale nodes
+    first check their data with their `check_data` function, and are calibrated only if the check fails. Stale
+    nodes without a `check_data` function are calibrated. A node is also calibrated whenever one of its
+    dependencies was calibrated in the same run. The configs of skipped nodes are still patched with their
+    `update_config`, so calibrated nodes always get a complete config.
+
+    When the check of a node fails, its dependencies which were not calibrated are diagnosed before it is
+    calibrated: :func:`maintain` runs the graph again, checking the data of these dependencies even if they are in
+    spec. A dependency whose check fails is diagnosed in the same way, recursively, and calibrated after its own
+    dependencies. The node is calibrated once all its dependencies were diagnosed, and its descendants are then
+    calibrated as well. Dependencies without a `check_data` function are diagnosed by their status only.
+
+    .. note::
+
+        `run_program` is expected to update the calibrated parameters in the DB, including their calibration state
+        and confidence interval. Committing the DB is left to the caller.
+    """
+
+    def __init__(self, db: QpuDatabaseConnection):
+        """
+        :param db: the QPU DB holding the calibrated parameters
+        """
+        self._db = db
+        self._decisions: List[SchedulerDecision] = []
+        self._decision_index: Dict[QuaCalNode, int] = {}
+        self._calibrated: Set[QuaCalNode] = set()
+        # the nodes whose data check passed in the current run, which do not need to be diagnosed again
+        self._passed: Set[QuaCalNode] = set()
+        # the graph run of maintain()
+        self._iteration = 0
+        # nodes are copied when a graph is created, so the nodes are identified across graph runs by their keys.
+        # the nodes whose check failed and which wait for their dependencies to be diagnosed, and the nodes to
+        # diagnose, in the current run and in the next one
+        self._waiting: Set[int] = set()
+        self._diagnosed: Set[int] = set()
+        self._next_waiting: Set[int] = set()
+        self._next_diagnosed: Set[int] = set()
+        # nodes may run in parallel
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(node: QuaCalNode) -> int:
+        return node._node_index
+
+    @staticmethod
+    def _dependencies(node: QuaCalNode) -> List[QuaCalNode]:
+        return [
+            parent for parent in node.get_parents() if isinstance(parent, QuaCalNode)
+        ]
+
+    def _last_updated(self, node: QuaCalNode) -> List[datetime]:
+        times = []
+        for element, attribute in node.calibrated_parameters:
+            try:
+                times.append(self._db.get(element, attribute).last_updated)
+            except AttributeError:
+                pass
+        return times
+
+    def status(self, node: QuaCalNode) -> Tuple[NodeStatus, str]:
+        """
+        :param node: a calibration node
+        :return: the status of the node according to the DB, and the reason for it
+        """
+        now = datetime.now()
+        stale_reason = ""
+        for element, attribute in node.calibrated_parameters:
+            name = f"{element}.{attribute}"
+            try:
+                parameter = self._db.get(element, attribute)
+            except AttributeError:
+                return NodeStatus.OUT_OF_SPEC, f"{name} does not exist"
+            if parameter.cal_state.value < node.required_state.value:
+                return (
+                    NodeStatus.OUT_OF_SPEC,
+                    f"{name} is {parameter.cal_state}, {node.required_state} is required",
+                )
+            if node.max_error is not None:
+                error = parameter.confidence_interval.error
+                if error < 0:
+                    return NodeStatus.OUT_OF_SPEC, f"the error of {name} is unknown"
+                if error > node.max_error:
+                    return (
+                        NodeStatus.OUT_OF_SPEC,
+                        f"the error of {name} is {error}, larger than {node.max_error}",
+                    )
+            if (
+                not stale_reason
+                and node.calibration_timeout is not None
+                and now - parameter.last_updated > node.calibration_timeout
+            ):
+                stale_reason = f"{name} was last updated at {parameter.last_updated}"
+        if stale_reason:
+            return NodeStatus.STALE, stale_reason
+        updated = self._last_updated(node)
+        for dependency in self._dependencies(node):
+            dependency_updated = self._last_updated(dependency)
+            if (
+                updated
+                and dependency_updated
+                and max(dependency_updated) > min(updated)
+            ):
+                return (
+                    NodeStatus.STALE,
+                    f"dependency {dependency.label} was calibrated after it",
+                )
+        return NodeStatus.IN_SPEC, ""
+
+    def _action(
+        self,
+        node: QuaCalNode,
+        calibrated: Set[QuaCalNode],
+        waiting: Set[int] = frozenset(),
+        diagnosed: Set[int] = frozenset(),
+        next_waiting: Set[int] = frozenset(),
+    ) -> SchedulerDecision:
+        status, reason = self.status(node)
+        if self._key(node) in waiting:
+            for dependency in self._dependencies(node):
+                if self._key(dependency) in next_waiting:
+                    return SchedulerDecision(
+                        node.label,
+                        status,
+                        ScheduledAction.SKIP,
+                        f"waiting for the diagnosis of dependency {dependency.label}",
+                    )
+            return SchedulerDecision(
+                node.label,
+                status,
+                ScheduledAction.CALIBRATE,
+                "its data check failed, and its dependencies were diagnosed",
+            )
+        for dependency in self._dependencies(node):
+            if dependency in calibrated:
+                return SchedulerDecision(
+                    node.label,
+                    status,
+                    ScheduledAction.CALIBRATE,
+                    f"dependency {dependency.label} is calibrated",
+                )
+        if status == NodeStatus.IN_SPEC:
+            if self._key(node) in diagnosed and node.check_data is not None:
+                return SchedulerDecision(
+                    node.label,
+                    status,
+                    ScheduledAction.CHECK,
+                    "diagnosing the failed data check of a dependent node",
+                )
+            action = ScheduledAction.SKIP
+        elif status == NodeStatus.STALE and node.check_data is not None:
+            action = ScheduledAction.CHECK
+        else:
+            action = ScheduledAction.CALIBRATE
+        return SchedulerDecision(node.label, status, action, reason)
+
+    def plan(self, nodes: Union[QuaCalNode, Iterable[QuaCalNode]]) -> pd.DataFrame:
+        """
+        The actions which will be taken to maintain the given nodes, assuming that all data checks pass.
+
+        :param nodes: the nodes to maintain, along with their ancestors
+        :return: a dataframe with the status and action of every node, in execution order
+        """
+        calibrated = set()
+        decisions = []
+        for node in self._graph_nodes(nodes):
+            decision = self._action(node, calibrated)
+            if decision.action == ScheduledAction.CALIBRATE:
+                calibrated.add(node)
+            decisions.append(decision)
+        return self._to_dataframe(decisions)
+
+    @staticmethod
+    def _ancestors(nodes) -> Set[Node]:
+        if isinstance(nodes, QuaCalNode):
+            nodes = [nodes]
+        all_nodes = set()
+        for node in nodes:
+            all_nodes |= node.ancestors()
+        return all_nodes
+
+    def _graph_nodes(self, nodes) -> List[QuaCalNode]:
+        # dependencies are created before the nodes which depend on them
+        return sorted(
+            [node for node in self._ancestors(nodes) if isinstance(node, QuaCalNode)],
+            key=lambda node: node._node_index,
+        )
+
+    def maintain(
+        self,
+        nodes: Union[QuaCalNode, Iterable[QuaCalNode]],
+        resources: Optional[ExperimentResources] = None,
+        **kwargs,
+    ):
+        """
+        Run the calibrations needed to bring the given nodes and their ancestors within spec.
+
+        The graph is run again as long as nodes whose data check failed wait for their dependencies to be
+        diagnosed.
+
+        :param nodes: the nodes to maintain
+        :param resources: the resources for the graph experiment
+        :param kwargs: additional run arguments of the graph
+        :return: the handle of the last graph experiment
+        """
+        self.reset()
+        while True:
+            handle = Graph(resources, self._ancestors(nodes), "maintain").run(
+                scheduler=self, **kwargs
+            )
+            with self._lock:
+                if not self._next_waiting:
+                    return handle
+                self._iteration += 1
+                self._waiting, self._next_waiting = self._next_waiting, set()
+                self._diagnosed, self._next_diagnosed = self._next_diagnosed, set()
+                self._decision_index = {}
+                self._calibrated = set()
+                self._passed = set()
+
+    def reset(self) -> None:
+        """
+        Forget the decisions of previous runs
+        """
+        with self._lock:
+            self._decisions = []
+            self._decision_index = {}
+            self._calibrated = set()
+            self._passed = set()
+            self._iteration = 0
+            self._waiting = set()
+            self._diagnosed = set()
+            self._next_waiting = set()
+            self._next_diagnosed = set()
+
+    def decide(self, node: QuaCalNode) -> ScheduledAction:
+        """
+        Decide the action to take for a node during a run, and record the decision in the report of the run.
+        Called by the node when the graph is run with the scheduler.
+
+        :param node: the node about to run, after all its dependencies ran
+        :return: the action which the node should take
+        """
+        with self._lock:
+            calibrated = set(self._calibrated)
+            next_waiting = set(self._next_waiting)
+        decision = self._action(
+            node, calibrated, self._waiting, self._diagnosed, next_waiting
+        )
+        decision = replace(decision, iteration=self._iteration)
+        with self._lock:
+            if decision.action == ScheduledAction.CALIBRATE:
+                self._calibrated.add(node)
+            elif self._key(node) in self._waiting:
+                # still waiting for the diagnosis of a dependency
+                self._next_waiting.add(self._key(node))
+            self._decision_index[node] = len(self._decisions)
+            self._decisions.append(decision)
+        return decision.action
+
+    def record_check(self, node: QuaCalNode, passed: bool) -> bool:
+        """
+        Record the result of the data check of a node for which :func:`decide` returned `ScheduledAction.CHECK`.
+        A node whose check failed is calibrated, unless it has dependencies which were neither calibrated nor
+        checked in this run.
+        These dependencies are then diagnosed in the next run of :func:`maintain`, and the node is calibrated after
+        them.
+
+        :param node: the checked node
+        :param passed: whether the data check passed
+        :return: whether the node should be calibrated now
+        """
+        with self._lock:
+            index = self._decision_index[node]
+            self._decisions[index] = replace(
+                self._decisions[index], check_passed=passed
+            )
+            if passed:
+                self._passed.add(node)
+                return False
+            undiagnosed = [
+                dependency
+                for dependency in self._dependencies(node)
+                if dependency not in self._calibrated and dependency not in self._passed
+            ]
+            if not undiagnosed:
+                self._calibrated.add(node)
+                return True
+            self._next_waiting.add(self._key(node))
+            self._next_diagnosed.update(
+                self._key(dependency) for dependency in undiagnosed
+            )
+            return False
+
+    def report(self) -> pd.DataFrame:
+        """
+        :return: a dataframe with the status and action taken for every node of the last run, in execution order
+        """
+        with self._lock:
+            return self._to_dataframe(self._decisions)
+
+    @staticmethod
+    def _to_dataframe(decisions: List[SchedulerDecision]) -> pd.DataFrame:
+        return pd.DataFrame(
+            [asdict(decision) for decision in decisions], columns=_DECISION_COLUMNS
+        )
@@ -0,0 +1,101 @@
+import pytest
+
+from entropylab_qpudb import QuaConfig, QpuDatabaseConnection, ConfigBinding
+from entropylab_qpudb._qpudatabase import create_new_qpu_database
+
+
+@pytest.fixture
+def db(tmp_path):
+    create_new_qpu_database(
+        "bindingdb",
+        {
+            "q1": {"f01": 5.1e9, "dc_offset": 0.1},
+            "q2": {"f01": 5.2e9, "dc_offset": 0.2},
+            "lo": {"frequency": 5e9},
+        },
+        path=tmp_path,
+    )
+    with QpuDatabaseConnection("bindingdb", path=tmp_path) as connection:
+        yield connection
+
+
+def test_binding(db):
+    base_config = QuaConfig(
+        {
+            "controllers": {
+                "con1": {"analog_outputs": {1: {"offset": 0.0}, 2: {"offset": 0.0}}}
+            },
+            "elements": {
+                "q1": {"intermediate_frequency": 0.0},
+                "q2": {"intermediate_frequency": 0.0},
+            },
+        }
+    )
+    calls = []
+
+    def intermediate_frequency(f01, lo):
+        calls.append(f01)
+        return f01 - lo
+
+    binding = ConfigBinding(db)
+    for port, qubit in enumerate(["q1", "q2"], 1):
+        binding.bind(
+            ("elements", qubit, "intermediate_frequency"),
+            [(qubit, "f01"), ("lo", "frequency")],
+            intermediate_frequency,
+        )
+        binding.bind(
+            ("controllers", "con1", "analog_outputs", port, "offset"),
+            (qubit, "dc_offset"),
+        )
+    config = binding.build(base_config)
+    assert config["elements"]["q2"]["intermediate_frequency"] == pytest.approx(2e8)
+    assert config["controllers"]["con1"]["analog_outputs"][2]["offset"] == 0.2
+    assert base_config["elements"]["q1"]["intermediate_frequency"] == 0.0
+    assert binding.update(config).edits == ()
+
+    # only the values derived from the changed parameters are recomputed
+    calls.clear()
+    db.set("q1", "f01", 5.15e9)
+    db.set("q2", "dc_offset", 0.25)
+    assert binding.changed_parameters(config) == [("q1", "f01"), ("q2", "dc_offset")]
+    diff = binding.update(config)
+    assert [path for _, path, _ in diff.edits] == [
+        ("elements", "q1", "intermediate_frequency"),
+        ("controllers", "con1", "analog_outputs", 2, "offset"),
+    ]
+    assert calls == [5.15e9]
+    assert config["elements"]["q1"]["intermediate_frequency"] == pytest.approx(1.5e8)
+    assert config["controllers"]["con1"]["analog_outputs"][2]["offset"] == 0.25
+
+    # a change of a shared parameter affects all the values derived from it
+    db.set("lo", "frequency", 4.9e9)
+    assert len(binding.update(config).edits) == 2
+    assert binding.dependents("lo", "frequency") == [
+        ("elements", "q1", "intermediate_frequency"),
+        ("elements", "q2", "intermediate_frequency"),
+    ]
+
+
+def test_versions_are_kept_per_config(db):
+    base_config = QuaConfig({"elements": {"q1": {"intermediate_frequency": 0.0}}})
+    binding = ConfigBinding(db)
+    binding.bind(("elements", "q1", "intermediate_frequency"), ("q1", "f01"))
+    config_a = binding.build(base_config)
+    config_b = binding.build(base_config)
+
+    # two sets made within the resolution of the clock are both detected
+    db.set("q1", "f01", 5.15e9)
+    assert len(binding.update(config_a).edits) == 1
+    db.set("q1", "f01", 5.16e9)
+    assert len(binding.update(config_a).edits) == 1
+    assert binding.update(config_a).edits == ()
+    assert config_a["elements"]["q1"]["intermediate_frequency"] == 5.16e9
+
+    # updating one config does not hide the change from another config built earlier
+    assert binding.changed_parameters(config_b) == [("q1", "f01")]
+    binding.update(config_b)
+    assert config_b["elements"]["q1"]["intermediate_frequency"] == 5.16e9
+
+    # a config which was not built by the binding is updated entirely
+    assert binding.changed_parameters(base_config.copy()) == [("q1", "f01")]
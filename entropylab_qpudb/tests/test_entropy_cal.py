@@ -0,0 +1,399 @@
+import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import pytest
+from entropylab import EntropyContext, pynode, Graph
+from entropylab.graph_experiment import GraphExecutionType
+
+from entropylab_qpudb import (
+    QuaConfig,
+    QuaCalNode,
+    AncestorRunStrategy,
+    QpuDatabaseConnection,
+    QuaCalProfile,
+    MergedConfigStore,
+    ConfigDiff,
+)
+from entropylab_qpudb._entropy_cal import (
+    ConfigPatch,
+    PatchLineage,
+    QuaCalNodeOutput,
+    _ConfigBuildCache,
+)
+from entropylab_qpudb._qpudatabase import create_new_qpu_database
+
+
+@pytest.fixture
+def root():
+    @pynode("root", output_vars={"config"})
+    def root_node(context: EntropyContext):
+        return {"config": QuaConfig({"elements": {"qe1": {"counter": 0}}})}
+
+    return root_node
+
+
+class CountingNode(QuaCalNode):
+    calls = Counter()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.seen_counter = None
+
+    def prepare_config(self, config: QuaConfig, context: EntropyContext):
+        self.calls[("prepare", self.label)] += 1
+
+    def run_program(self, config, context: EntropyContext):
+        self.calls[("run", self.label)] += 1
+        self.seen_counter = config["elements"]["qe1"]["counter"]
+
+    def update_config(self, config: QuaConfig, context: EntropyContext):
+        self.calls[("update", self.label)] += 1
+        config["elements"]["qe1"]["counter"] += 1
+
+
+@pytest.fixture
+def chain(root):
+    CountingNode.calls.clear()
+    nodes = [CountingNode(root, name="n0")]
+    for i in range(1, 5):
+        nodes.append(CountingNode(nodes[-1], name=f"n{i}"))
+    return nodes
+
+
+def test_graph_run(chain):
+    Graph(None, chain[-1].ancestors()).run()
+    assert [node.seen_counter for node in chain] == [0, 1, 2, 3, 4]
+
+
+def test_memoized_configs_apply_each_patch_once(chain):
+    Graph(None, chain[-1].ancestors()).run()
+    # each update is applied once, when building the config of the next node
+    for node in chain[:-1]:
+        assert CountingNode.calls[("update", node.label)] == 1
+    assert CountingNode.calls[("update", chain[-1].label)] == 0
+
+
+def test_configs_without_memoization(chain):
+    Graph(None, chain[-1].ancestors()).run(memoize_configs=False)
+    assert [node.seen_counter for node in chain] == [0, 1, 2, 3, 4]
+    assert CountingNode.calls[("update", chain[0].label)] == len(chain) - 1
+
+
+def test_memoized_configs_merge(root):
+    CountingNode.calls.clear()
+    a = CountingNode(root, name="a")
+    b = CountingNode(a, name="b")
+    c = CountingNode(a, name="c")
+    d = CountingNode([b, c], name="d")
+    Graph(None, d.ancestors()).run(strategy=AncestorRunStrategy.RunOnlyLast)
+    assert d.seen_counter == 3
+    assert CountingNode.calls[("run", "a")] == 0
+    assert CountingNode.calls[("update", "a")] == 1
+
+
+class BranchNode(QuaCalNode):
+    # nodes are copied when a graph is run, so the barrier is not held by the nodes
+    barrier = None
+
+    def __init__(self, *args, wait=False, delay=0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait = wait
+        self.delay = delay
+        self.seen_updates = None
+
+    def prepare_config(self, config: QuaConfig, context: EntropyContext):
+        pass
+
+    def run_program(self, config, context: EntropyContext):
+        if self.wait:
+            # both branches must be running at the same time to pass the barrier
+            self.barrier.wait()
+        time.sleep(self.delay)
+        self.seen_updates = list(config["elements"]["qe1"].get("updates", []))
+
+    def update_config(self, config: QuaConfig, context: EntropyContext):
+        config["elements"]["qe1"].setdefault("updates", []).append(self.label)
+
+
+@pytest.mark.parametrize("parallel", [True, ThreadPoolExecutor(max_workers=2)])
+def test_parallel_branches(root, parallel):
+    barrier = BranchNode.barrier = threading.Barrier(2, timeout=5)
+    a = BranchNode(root, name="a")
+    b = BranchNode(a, name="b", wait=True, delay=0.1)
+    c = BranchNode(a, name="c", wait=True)
+    d = BranchNode([b, c], name="d")
+    Graph(None, d.ancestors(), execution_type=GraphExecutionType.Async).run(
+        parallel=parallel
+    )
+    assert not barrier.broken
+    # c finishes first, but its patches are applied in the order in which the nodes were created
+    assert d.seen_updates == ["a", "b", "c"]
+
+
+def test_parallel_rejects_process_pool(root):
+    a = BranchNode(root, name="a")
+    graph = Graph(None, a.ancestors(), execution_type=GraphExecutionType.Async)
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        with pytest.raises(RuntimeError):
+            graph.run(parallel=executor)
+
+
+class DbNode(QuaCalNode):
+    # nodes are copied when a graph is run, so the connection is not held by the nodes
+    db = None
+    runs = 0
+
+    def prepare_config(self, config: QuaConfig, context: EntropyContext):
+        pass
+
+    def run_program(self, config, context: EntropyContext):
+        DbNode.runs += 1
+        frequency = self.db.get("q1", "frequency").value
+        # calibrating a parameter which was read does not invalidate the node
+        self.db.set("q1", "frequency", frequency + 1)
+
+    def update_config(self, config: QuaConfig, context: EntropyContext):
+        config["elements"]["qe1"]["frequency"] = self.db.get("q1", "frequency").value
+
+
+def test_skip_unchanged(tmp_path):
+    create_new_qpu_database(
+        "skipdb", {"q1": {"frequency": 0}, "q2": {"frequency": 0}}, path=tmp_path
+    )
+    root_config = {"elements": {"qe1": {"counter": 0}}}
+
+    @pynode("root", output_vars={"config"})
+    def root(context: EntropyContext):
+        return {"config": QuaConfig(root_config)}
+
+    DbNode.runs = 0
+    with QpuDatabaseConnection("skipdb", path=tmp_path) as DbNode.db:
+        node = DbNode(root)
+        for _ in range(2):
+            Graph(None, node.ancestors()).run(skip_unchanged=True)
+        assert DbNode.runs == 1
+        # parameters which were not read do not matter
+        DbNode.db.set("q2", "frequency", 1)
+        Graph(None, node.ancestors()).run(skip_unchanged=True)
+        assert DbNode.runs == 1
+        DbNode.db.set("q1", "frequency", 10)
+        Graph(None, node.ancestors()).run(skip_unchanged=True)
+        assert DbNode.runs == 2
+        root_config["elements"]["qe1"]["counter"] = 1
+        Graph(None, node.ancestors()).run(skip_unchanged=True)
+        assert DbNode.runs == 3
+        Graph(None, node.ancestors()).run()
+        assert DbNode.runs == 4
+
+
+def _patches(node_index, depth, ids):
+    return [
+        ConfigPatch(i, depth, lambda config, context: None, node_index) for i in ids
+    ]
+
+
+def test_patch_lineage_merge():
+    root = PatchLineage(_patches(0, 1, [0, 1]))
+    b = root.extend(_patches(2, 2, [4, 5]))
+    c = root.extend(_patches(1, 2, [2, 3]))
+    merged = PatchLineage.merge([b, c])
+    assert merged.parents == (b, c)
+    assert merged.depth == 2
+    # patches of the same depth are ordered by the creation index of their nodes
+    assert merged.ids == (0, 1, 2, 3, 4, 5)
+    assert PatchLineage.merge([merged, b]).ids == (0, 1, 2, 3, 4, 5)
+    assert PatchLineage.merge([b, b]) is b
+    # ancestors are shared rather than copied
+    assert b.parents[0] is c.parents[0]
+
+
+def test_config_build_cache_is_bounded():
+    def increment(config, context):
+        config["elements"]["qe1"]["counter"] += 1
+
+    base = QuaConfig({"elements": {"qe1": {"counter": 0}}})
+    cache = _ConfigBuildCache(max_configs=3)
+    lineage = PatchLineage()
+    for i in range(10):
+        lineage = lineage.extend([ConfigPatch(i, i + 1, increment)])
+        config = cache.build(base, lineage, None)
+        assert config["elements"]["qe1"]["counter"] == i + 1
+        # the caller gets its own copy
+        config["elements"]["qe1"]["counter"] = -1
+    assert len(cache._configs) == 3
+    assert cache.build(base, lineage, None)["elements"]["qe1"]["counter"] == 10
+    assert base["elements"]["qe1"]["counter"] == 0
+
+
+def test_node_output_from_patch_list():
+    output = QuaCalNodeOutput(QuaConfig({}), _patches(0, 1, [0, 1]))
+    assert [patch.id for patch in output.patches] == [0, 1]
+
+
+def test_profile(chain, tmp_path):
+    profile = QuaCalProfile()
+    Graph(None, chain[-1].ancestors()).run(profile=profile)
+    df = profile.to_dataframe()
+    assert set(df["node"]) == {node.label for node in chain}
+    assert [timing.phase for timing in chain[0].timings] == [
+        "merge",
+        "build",
+        "prepare",
+        "run",
+    ]
+    # the patches of the previous node are applied while building the config of n1
+    patches = df[(df["node"] == "n1") & (df["phase"] == "apply_patch")]
+    assert list(patches["detail"]) == ["n0.prepare_config", "n0.update_config"]
+    assert (df["wall_time"] >= 0).all() and (df["cpu_time"] >= 0).all()
+    assert df[df["phase"] == "run"]["config_size"].notna().all()
+
+    profile.to_chrome_trace(tmp_path / "trace.json")
+    with open(tmp_path / "trace.json") as fp:
+        trace = json.load(fp)
+    assert len(trace["traceEvents"]) == len(df)
+    assert {event["ph"] for event in trace["traceEvents"]} == {"X"}
+
+
+class SetNode(QuaCalNode):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.seen = None
+
+    def prepare_config(self, config: QuaConfig, context: EntropyContext):
+        config["elements"]["qe1"]["prepared"] = self.label
+
+    def run_program(self, config, context: EntropyContext):
+        self.seen = dict(config["elements"]["qe1"])
+
+    def update_config(self, config: QuaConfig, context: EntropyContext):
+        config["elements"]["qe1"][self.label] = len(self.label)
+
+
+@pytest.fixture
+def set_graph(root):
+    a = SetNode(root, name="a")
+    b = SetNode(a, name="bb")
+    c = SetNode(a, name="ccc")
+    return [a, b, c, SetNode([b, c], name="d")]
+
+
+def test_declarative_patches(set_graph):
+    Graph(None, set_graph[-1].ancestors()).run()
+    expected = [node.seen for node in set_graph]
+    Graph(None, set_graph[-1].ancestors()).run(declarative_patches=True)
+    assert [node.seen for node in set_graph] == expected
+    assert set_graph[-1].seen == {
+        "counter": 0,
+        "a": 1,
+        "bb": 2,
+        "ccc": 3,
+        "prepared": "d",
+    }
+
+
+class MeasuringNode(SetNode):
+    prepare_calls = Counter()
+
+    def prepare_config(self, config: QuaConfig, context: EntropyContext):
+        super().prepare_config(config, context)
+        self.prepare_calls[self.label] += 1
+
+    def run_program(self, config, context: EntropyContext):
+        super().run_program(config, context)
+        self.measured = 10 * len(self.label)
+
+    def update_config(self, config: QuaConfig, context: EntropyContext):
+        # the update depends on the result of the program
+        config["elements"]["qe1"][self.label] = self.measured
+
+
+def test_declarative_patches_record_update_after_run(root):
+    MeasuringNode.prepare_calls.clear()
+    a = MeasuringNode(root, name="a")
+    b = SetNode(a, name="bb")
+    Graph(None, b.ancestors()).run(declarative_patches=True)
+    assert b.seen == {"counter": 0, "a": 10, "prepared": "bb"}
+    # the prepare patch is recorded from the config prepared for the run
+    assert MeasuringNode.prepare_calls["a"] == 1
+
+
+def test_merged_config_store(set_graph, tmp_path):
+    store = MergedConfigStore(str(tmp_path / "configs"))
+    Graph(None, set_graph[-1].ancestors()).run(
+        declarative_patches=True, config_store=store
+    )
+    # the configs of the root, of a (shared by bb and ccc) and of the merge of bb and ccc
+    assert len(store) == 3
+    expected = [node.seen for node in set_graph]
+
+    profile = QuaCalProfile()
+    Graph(None, set_graph[-1].ancestors()).run(
+        declarative_patches=True, config_store=store, profile=profile
+    )
+    # all the configs are loaded from the store rather than built
+    assert "apply_patch" not in set(profile.to_dataframe()["phase"])
+    assert [node.seen for node in set_graph] == expected
+    assert len(store) == 3
+
+
+def test_merged_config_store_key_follows_base_config(tmp_path):
+    store = MergedConfigStore(str(tmp_path / "configs"))
+    patch = ConfigDiff.between(
+        QuaConfig({"elements": {}}), QuaConfig({"elements": {"qe2": {}}})
+    )
+    lineage = PatchLineage([ConfigPatch(0, 1, patch)])
+    base = QuaConfig({"elements": {"qe1": {"counter": 0}}})
+    cache = _ConfigBuildCache()
+    key = cache._store_key(base, lineage)
+    assert cache.build(base, lineage, None, store=store)["elements"]["qe1"] == {
+        "counter": 0
+    }
+    base["elements"]["qe1"]["counter"] = 1
+    assert cache._store_key(base, lineage) != key
+    # a new cache finds the config built from the modified base config in the store
+    cache = _ConfigBuildCache()
+    assert cache.build(base, lineage, None, store=store)["elements"]["qe1"] == {
+        "counter": 1
+    }
+    assert len(store) == 2
+
+
+def test_merged_config_store_treats_unreadable_entries_as_missing(tmp_path):
+    store = MergedConfigStore(str(tmp_path / "configs"))
+    config = QuaConfig({"elements": {"qe1": {"intermediate_frequency": 1e8}}})
+    store.save("key", config)
+    assert store.load("key") == config
+    assert "key" in store
+
+    # an entry left by an older version of the store is ignored
+    with open(tmp_path / "configs" / "old.qcfg", "wb") as fp:
+        fp.write(b"not a config")
+    assert "old" not in store
+    assert len(store) == 1
+
+    # a corrupted entry is a miss
+    with open(store._path("key"), "wb") as fp:
+        fp.write(b"not a config")
+    assert store.load("key") is None
+
+    store.clear()
+    assert len(store) == 0
+    assert not list((tmp_path / "configs").iterdir())
+
+
+def test_run_only_last_builds_a_single_config(chain):
+    profile = QuaCalProfile()
+    Graph(None, chain[-1].ancestors()).run(
+        strategy=AncestorRunStrategy.RunOnlyLast, profile=profile
+    )
+    assert chain[-1].seen_counter == 4
+    df = profile.to_dataframe()
+    assert list(df[df["phase"] == "build"]["node"]) == [chain[-1].label]
+    # the patches of the ancestors are applied once, when building the config of the last node
+    for node in chain[:-1]:
+        assert CountingNode.calls[("prepare", node.label)] == 1
+        assert CountingNode.calls[("update", node.label)] == 1
+        assert CountingNode.calls[("run", node.label)] == 0
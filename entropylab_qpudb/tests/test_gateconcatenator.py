@@ -0,0 +1,173 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from entropylab_qpudb import QuaConfig
+from entropylab_qpudb._gateconcatenator import (
+    GateConcatenator,
+    Moment,
+    StreamingGateConcatenator,
+)
+
+
+def test_concatenate_moments():
+    config = QuaConfig(
+        {
+            "elements": {
+                "qe1": {"singleInput": {"port": ("con1", 1)}, "operations": {}},
+                "qe2": {
+                    "mixInputs": {"I": ("con1", 2), "Q": ("con1", 3)},
+                    "operations": {},
+                },
+            },
+            "pulses": {},
+            "waveforms": {},
+        }
+    )
+    config.add_control_operation_single("qe1", "x", [0.1] * 8)
+    config.add_control_operation_iq("qe2", "y", [0.2] * 4, [0.3] * 4)
+    concatenator = GateConcatenator(
+        [Moment({"qe1": "x", "qe2": "y"}), Moment({"qe2": "y"})], config
+    )
+    concat_config = concatenator.config
+    assert concat_config["pulses"]["qe1_concat_pulse_in"]["length"] == 12
+    np.testing.assert_array_equal(
+        concat_config.get_waveforms_from_op("qe1", "concat_waveform"),
+        [0.1] * 8 + [0.0] * 4,
+    )
+    # the shorter waveform is padded with zeros to the duration of the moment
+    waveform_i, waveform_q = concat_config.get_waveforms_from_op(
+        "qe2", "concat_waveform"
+    )
+    np.testing.assert_array_equal(waveform_i, [0.2] * 4 + [0.0] * 4 + [0.2] * 4)
+    np.testing.assert_array_equal(waveform_q, [0.3] * 4 + [0.0] * 4 + [0.3] * 4)
+    assert "concat_waveform" not in config["elements"]["qe1"]["operations"]
+
+
+def test_compact_idle_waveforms():
+    config = QuaConfig(
+        {
+            "elements": {
+                "qe1": {"singleInput": {"port": ("con1", 1)}, "operations": {}},
+                "qe2": {"singleInput": {"port": ("con1", 2)}, "operations": {}},
+            },
+            "pulses": {},
+            "waveforms": {},
+        },
+        compact_waveforms=True,
+    )
+    config.add_control_operation_single("qe1", "x", np.linspace(0, 1, 8))
+    config.add_control_operation_single("qe2", "idle", [0.0] * 8)
+    concat_config = GateConcatenator(
+        [Moment({"qe1": "x", "qe2": "idle"}), Moment({"qe1": "x"})], config
+    ).config
+    assert concat_config["waveforms"]["qe2_concat_waveform"] == {
+        "type": "constant",
+        "sample": 0.0,
+    }
+    assert len(concat_config.get_waveforms_from_op("qe2", "concat_waveform")) == 16
+
+
+def test_streaming_concatenation(tmp_path):
+    config = QuaConfig(
+        {
+            "elements": {
+                "qe1": {"singleInput": {"port": ("con1", 1)}, "operations": {}},
+                "qe2": {
+                    "mixInputs": {"I": ("con1", 2), "Q": ("con1", 3)},
+                    "operations": {},
+                },
+            },
+            "pulses": {},
+            "waveforms": {},
+        }
+    )
+    config.add_control_operation_single("qe1", "x", np.linspace(0, 1, 12))
+    config.add_control_operation_iq("qe2", "y", np.linspace(0, 1, 8), [0.3] * 8)
+    moments = [
+        Moment({"qe1": "x", "qe2": "y"}),
+        Moment({"qe2": "y"}),
+        Moment({"qe1": "x"}),
+    ] * 5
+    expected = GateConcatenator(moments, config).config
+    expected_samples = {
+        "qe1": expected.get_waveforms_from_op("qe1", "concat_waveform"),
+        "qe2": np.stack(expected.get_waveforms_from_op("qe2", "concat_waveform")),
+    }
+
+    concatenator = StreamingGateConcatenator(config, ["qe1", "qe2"], chunk_length=16)
+    chunks = list(concatenator.chunks(iter(moments)))
+    # 5 * (12 + 8 + 12) samples
+    assert [len(chunk["qe1"][0]) for chunk in chunks] == [16] * 10
+    np.testing.assert_array_equal(
+        np.concatenate([chunk["qe1"][0] for chunk in chunks]), expected_samples["qe1"]
+    )
+    np.testing.assert_array_equal(
+        np.concatenate([np.stack(chunk["qe2"]) for chunk in chunks], axis=1),
+        expected_samples["qe2"],
+    )
+
+    files = concatenator.to_files(iter(moments), tmp_path)
+    np.testing.assert_array_equal(files["qe1_concat_waveform"], expected_samples["qe1"])
+    np.testing.assert_array_equal(
+        files["qe2_concat_waveform_q"], expected_samples["qe2"][1]
+    )
+
+    streamed = StreamingGateConcatenator(config, ["qe1", "qe2"], chunk_length=64)
+    assert streamed.to_pulses(iter(moments), tmp_path / "pulses") == 3
+    np.testing.assert_array_equal(
+        np.concatenate(
+            [
+                streamed.config.get_waveforms_from_op(
+                    "qe1", streamed.concat_pulse_op_name(index)
+                )
+                for index in range(3)
+            ]
+        ),
+        expected_samples["qe1"],
+    )
+    assert streamed.config["pulses"]["qe2_concat_pulse_in_2"]["length"] == 32
+    assert "concat_waveform_0" not in config["elements"]["qe1"]["operations"]
+
+    # the 4 samples of the last chunk are padded to the shortest valid pulse
+    padded = StreamingGateConcatenator(config, ["qe1", "qe2"], chunk_length=52)
+    assert padded.to_pulses(iter(moments), tmp_path / "padded") == 4
+    assert padded.config["pulses"]["qe1_concat_pulse_in_3"]["length"] == 16
+    last = padded.config.get_waveforms_from_op("qe1", padded.concat_pulse_op_name(3))
+    np.testing.assert_array_equal(last, list(expected_samples["qe1"][-4:]) + [0.0] * 12)
+
+    for chunk_length in (8, 18):
+        with pytest.raises(ValueError):
+            StreamingGateConcatenator(config, ["qe1"], chunk_length=chunk_length)
+
+
+def test_streamed_pulses_use_bounded_memory(tmp_path):
+    config = QuaConfig(
+        {
+            "elements": {
+                "qe1": {
+                    "mixInputs": {"I": ("con1", 1), "Q": ("con1", 2)},
+                    "operations": {},
+                }
+            },
+            "pulses": {},
+            "waveforms": {},
+        }
+    )
+    config.add_control_operation_iq("qe1", "x", np.linspace(0, 1, 16), [0.3] * 16)
+    n_moments = 2**15
+    concatenator = StreamingGateConcatenator(config, ["qe1"], chunk_length=2**14)
+    tracemalloc.start()
+    try:
+        n_pulses = concatenator.to_pulses(
+            (Moment({"qe1": "x"}) for _ in range(n_moments)), tmp_path
+        )
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert n_pulses == 32
+    # 8MB of samples, while the buffers of the chunks take 0.5MB
+    assert peak < 2e6
+    samples = concatenator.config["waveforms"]["qe1_concat_waveform_i_31"]["samples"]
+    assert isinstance(samples, np.memmap)
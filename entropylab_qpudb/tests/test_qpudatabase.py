@@ -1,3 +1,4 @@
+import json
 import os
 import shutil
 from dataclasses import FrozenInstanceError
@@ -10,7 +11,13 @@ from entropylab.instruments.lab_topology import LabResources, ExperimentResource
 from entropylab.results_backend.sqlalchemy.db import SqlAlchemyDB
 from persistent.timestamp import _parseRaw
 
-from entropylab_qpudb import Resolver, QpuDatabaseConnection, CalState
+from entropylab_qpudb import (
+    Resolver,
+    QpuDatabaseConnection,
+    CalState,
+    QpuConnectionManager,
+    QpuDatabaseServer,
+)
 from entropylab_qpudb._qpudatabase import (
     _QpuDatabaseConnectionBase,
     create_new_qpu_database,
@@ -528,3 +535,259 @@ def test_migration_add_and_remove_elements_persistence(request):
         db.restore_from_history(2)
         with pytest.raises(AttributeError):
             db.get("q_new", "p_new")
+
+
+def test_connection_manager_reuses_connections(testdb):
+    with QpuConnectionManager() as manager:
+        db = manager.connect(testdb)
+        assert manager.connect(testdb) is db
+        assert testdb in manager
+        assert len(manager) == 1
+        assert db.get("q1", "p1").value == 3.32
+    assert db.closed
+    assert len(manager) == 0
+
+
+def test_connection_manager_reopens_closed_connection(testdb):
+    with QpuConnectionManager() as manager:
+        db = manager.connect(testdb)
+        db.close()
+        db2 = manager.connect(testdb)
+        assert db2 is not db
+        assert db2.get("q1", "p1").value == 3.32
+
+
+def test_connection_manager_cache_budget(testdb):
+    create_new_qpu_database(
+        "testdb2", {f"q{i}": {"p1": i} for i in range(20)}, force_create=True
+    )
+    try:
+        with QpuConnectionManager(cache_size=10) as manager:
+            db1 = manager.connect(testdb)
+            db2 = manager.connect("testdb2")
+            stats = manager.cache_stats()
+            assert list(stats["dbname"]) == [testdb, "testdb2"]
+            assert list(stats["cache_size"]) == [5, 5]
+            # the targets of the data and history caches of all the DBs add up to the budget
+            assert (
+                sum(
+                    db._con._cache.cache_size + db._con_hist._cache.cache_size
+                    for db in (db1, db2)
+                )
+                == 10
+            )
+
+            for i in range(20):
+                db2.get(f"q{i}", "p1")
+            manager.connect("testdb2")
+            assert manager.cache_stats()["cached_objects"].sum() <= 10
+            # the cache is ghosted, but the values are still there
+            assert db2.get("q3", "p1").value == 3
+            assert db1.get("q1", "p1").value == 3.32
+
+            manager.close(testdb)
+            assert list(manager.cache_stats()["cache_size"]) == [10]
+    finally:
+        for fl in glob("testdb2*"):
+            os.remove(fl)
+
+
+def test_cache_size_configuration(testdb):
+    with QpuDatabaseConnection(testdb, cache_size=50, cache_size_bytes=10000) as db:
+        assert db.cache_size == 50
+        assert db.cache_size_bytes == 10000
+        db.cache_size = 20
+        assert db.cache_size == 20
+        # the budget is split between the data and the history DBs
+        assert db._con._cache.cache_size + db._con_hist._cache.cache_size == 20
+        assert db._con._cache.cache_size > db._con_hist._cache.cache_size
+
+
+def test_stats(testdb):
+    with QpuDatabaseConnection(testdb) as db:
+        stats = db.stats()
+        assert stats.commits == 0
+        assert stats.cache_hits == 0 and stats.cache_misses == 0
+
+        db.get("q1", "p1")
+        db.get("q1", "p1")
+        stats = db.stats()
+        assert stats.cache_misses == 1
+        assert stats.cache_hits == 1
+        assert stats.cache_hit_ratio == 0.5
+        assert stats.loads > 0
+
+        db.set("q1", "p1", 5)
+        db.commit("a commit")
+        stats = db.stats()
+        assert stats.commits == 1
+        assert stats.commit_time > 0
+        assert stats.commit_time == stats.last_commit_time
+        assert stats.data_bytes_written > 0
+        assert stats.history_bytes_written > 0
+        assert stats.stores > 0
+
+        db.reset_stats()
+        assert db.stats().commits == 0
+        assert db.stats().loads == 0
+
+
+def test_warm_up(testdb):
+    with QpuDatabaseConnection(testdb) as db:
+        db.set("q1", "p2", [3, 4])
+        db.commit()
+
+    parameters = [("q1", "p1"), ("q1", "p2"), ("q2", "p1"), ("res1", "p1")]
+    with QpuDatabaseConnection(testdb) as db:
+        for element, attribute in parameters:
+            db.get(element, attribute)
+        assert db.stats().cache_misses == len(parameters)
+
+    with QpuDatabaseConnection(testdb, warm_up=True) as db:
+        loads = db.stats().loads
+        # q1 has 3 attributes, q2, res1 and system have one each
+        assert loads >= 6
+        for element, attribute in parameters:
+            db.get(element, attribute)
+        assert db.stats().cache_misses == 0
+        assert db.stats().cache_hits == len(parameters)
+        assert db.stats().loads == loads
+        assert db.get("q1", "p2").value == [3, 4]
+        assert db.warm_up() == 0
+
+
+def test_shared_connections_merge_writes(testdb):
+    pytest.importorskip("ZEO")
+    with QpuDatabaseServer(testdb):
+        db1 = QpuDatabaseConnection(testdb, shared=True)
+        db2 = QpuDatabaseConnection(testdb, shared=True)
+        try:
+            db1.set("q1", "p1", 1)
+            db2.set("q2", "p1", 2)
+            db2.commit("second writer")
+            db1.commit("first writer")
+
+            db1.set("res1", "p1", 11)
+            sleep(0.01)
+            db2.set("res1", "p1", 12)
+            db2.commit("most recent update")
+            db1.commit("older update")
+
+            history = db1.get_history()
+            # entries are appended in the order of the commits, so their indices do not change
+            assert list(history["message"]) == [
+                "initial commit",
+                "second writer",
+                "first writer",
+                "most recent update",
+                "older update",
+            ]
+            assert json.loads(db1.snapshot(False))["index"] == 4
+        finally:
+            db1.close()
+            db2.close()
+
+    with QpuDatabaseConnection(testdb) as db:
+        assert db.get("q1", "p1").value == 1
+        assert db.get("q2", "p1").value == 2
+        assert db.get("res1", "p1").value == 12
+    with QpuDatabaseConnection(testdb, history_index=1) as db:
+        assert db.get("q2", "p1").value == 2
+        assert db.get("q1", "p1").value == 3.32
+
+
+def test_shared_commits_record_their_own_transactions(testdb):
+    pytest.importorskip("ZEO")
+    with QpuDatabaseServer(testdb):
+        db1 = QpuDatabaseConnection(testdb, shared=True)
+        db2 = QpuDatabaseConnection(testdb, shared=True)
+        try:
+            db2.set("q1", "p1", 1)
+            db2.commit("db2 update")
+            # the transaction committed by db2 is not mistaken for a commit of db1
+            db1.commit("db1 no changes")
+
+            db1.set("q2", "p1", 2)
+            db2.set("res1", "p1", 12)
+            db1.commit("db1 update")
+            db2.commit("db2 later update")
+            db1.commit("db1 no changes")
+
+            # db1 did not append to the history since the last append of db2
+            history = db2.get_history()
+            assert list(history["message"]) == [
+                "initial commit",
+                "db2 update",
+                "db1 update",
+                "db2 later update",
+            ]
+            assert len(set(history["connected_tx"][1:])) == 3
+        finally:
+            db1.close()
+            db2.close()
+
+    # the entry of db1 points to its own commit, which does not include the later update of db2
+    with QpuDatabaseConnection(testdb, history_index=2) as db:
+        assert db.get("q1", "p1").value == 1
+        assert db.get("q2", "p1").value == 2
+        assert db.get("res1", "p1").value == 10
+
+
+def test_shared_connection_without_server(testdb):
+    pytest.importorskip("ZEO")
+    with pytest.raises(ConnectionError):
+        QpuDatabaseConnection(testdb, shared=True)
+
+
+def test_readonly_connection_alongside_writer(testdb):
+    with QpuDatabaseConnection(testdb) as writer:
+        reader1 = QpuDatabaseConnection(testdb, readonly=True, cache_size=100)
+        reader2 = QpuDatabaseConnection(testdb, readonly=True)
+        try:
+            assert reader1.readonly
+            writer.set("q1", "p1", 100)
+            writer.commit("a commit")
+            # readers see the state which was committed when they were opened
+            assert reader1.get("q1", "p1").value == 3.32
+            assert len(reader1.get_history()) == 1
+
+            reader1.refresh()
+            assert reader1.get("q1", "p1").value == 100
+            assert reader1.get("q2", "p1").value == 3.4
+            assert len(reader1.get_history()) == 2
+            assert reader1.cache_size == 100
+            assert reader2.get("q1", "p1").value == 3.32
+
+            writer.set("q1", "p1", 200)
+            writer.commit("another commit")
+            reader1.refresh()
+            assert reader1.get("q1", "p1").value == 200
+
+            with pytest.raises(ReadOnlyError):
+                reader1.commit()
+        finally:
+            reader1.close()
+            reader2.close()
+
+
+def test_refresh_shared_readonly_connection(testdb):
+    pytest.importorskip("ZEO")
+    with QpuDatabaseServer(testdb):
+        writer = QpuDatabaseConnection(testdb, shared=True)
+        reader = QpuDatabaseConnection(testdb, shared=True, readonly=True)
+        try:
+            assert reader.get("q1", "p1").value == 3.32
+            writer.set("q1", "p1", 100)
+            writer.commit("a commit")
+            reader.refresh()
+            assert reader.get("q1", "p1").value == 100
+            assert len(reader.get_history()) == 2
+        finally:
+            writer.close()
+            reader.close()
+
+
+def test_refresh_requires_readonly(testdb):
+    with QpuDatabaseConnection(testdb) as db:
+        with pytest.raises(ValueError):
+            db.refresh()
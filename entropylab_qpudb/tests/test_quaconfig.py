@@ -1,6 +1,11 @@
 # todo
+import json
+import pickle
+from copy import deepcopy
+
+import numpy as np
 import pytest
-from entropylab_qpudb import QuaConfig
+from entropylab_qpudb import QuaConfig, ConfigDiff
 
 
 @pytest.fixture
@@ -105,3 +110,361 @@ def test_set_output_dc_offset_by_element(config):
     # IQ pair
     config.set_output_dc_offset_by_element("qe2", "I", 0.2)
     assert config["controllers"]["con1"]["analog_outputs"][2]["offset"] == 0.2
+
+
+def test_copy_shares_unmodified_entries(config):
+    config_copy = deepcopy(config)
+    assert config_copy == config
+    assert config_copy["waveforms"].peek("ramp_wf") is config["waveforms"].peek(
+        "ramp_wf"
+    )
+    config_copy["waveforms"]["ramp_wf"]["samples"][0] = 1.0
+    config_copy["elements"]["qe1"]["intermediate_frequency"] = 50e6
+    assert config["waveforms"]["ramp_wf"]["samples"][0] == 0.0
+    assert config["elements"]["qe1"]["intermediate_frequency"] == 100e6
+    # untouched entries remain shared
+    assert config_copy["waveforms"].peek("ramp_wf2") is config["waveforms"].peek(
+        "ramp_wf2"
+    )
+
+
+def test_copy_is_isolated_from_accessed_entries(config):
+    element = config["elements"]["qe1"]
+    config_copy = config.copy()
+    element["intermediate_frequency"] = 50e6
+    assert config_copy["elements"]["qe1"]["intermediate_frequency"] == 100e6
+    assert config["elements"]["qe1"]["intermediate_frequency"] == 50e6
+
+    # the same holds for copies of copies, and for deep copies
+    copied_element = config_copy["elements"]["qe1"]
+    second_copy = config_copy.copy()
+    deep_copy = deepcopy(config_copy)
+    copied_element["intermediate_frequency"] = 60e6
+    assert second_copy["elements"]["qe1"]["intermediate_frequency"] == 100e6
+    assert deep_copy["elements"]["qe1"]["intermediate_frequency"] == 100e6
+
+
+def test_section_views_copy_only_iterated_entries(config):
+    config_copy = config.copy()
+    waveforms = config_copy["waveforms"]
+    values = waveforms.values()
+    assert len(values) == len(config["waveforms"])
+    first = next(iter(values))
+    first_name = next(iter(waveforms))
+    assert first is waveforms.peek(first_name)
+    assert first is not config["waveforms"].peek(first_name)
+    # the entries which were not iterated over are still shared
+    for name in list(waveforms)[1:]:
+        assert waveforms.peek(name) is config["waveforms"].peek(name)
+    for name, waveform in waveforms.items():
+        assert waveform is waveforms.peek(name)
+
+
+def test_mutating_original_does_not_affect_copy(config):
+    config_copy = config.copy()
+    config.set_output_dc_offset_by_element("qe1", "single", 0.3)
+    config.add_control_operation_single("qe1", "op", [0.1] * 16)
+    assert config_copy["controllers"]["con1"]["analog_outputs"][1]["offset"] == 0.0
+    assert "op" not in config_copy["elements"]["qe1"]["operations"]
+    assert "qe1_op_in_single" not in config_copy["waveforms"]
+
+
+def test_reset(config):
+    config["waveforms"]["ramp_wf"]["samples"][0] = 1.0
+    config["pulses"].pop("readoutPulse2")
+    config.reset()
+    assert config["waveforms"]["ramp_wf"]["samples"][0] == 0.0
+    assert "readoutPulse2" in config["pulses"]
+    config["waveforms"]["ramp_wf"]["samples"][0] = 1.0
+    config.reset()
+    assert config["waveforms"]["ramp_wf"]["samples"][0] == 0.0
+
+
+def test_copy_pickles(config):
+    config_copy = pickle.loads(pickle.dumps(config))
+    assert config_copy == config
+    config_copy["elements"]["qe1"]["intermediate_frequency"] = 50e6
+    assert config["elements"]["qe1"]["intermediate_frequency"] == 100e6
+
+
+def test_content_hash(config, tmp_path):
+    def reversed_dict(value):
+        if isinstance(value, dict):
+            return {key: reversed_dict(value[key]) for key in reversed(list(value))}
+        return value
+
+    # equal configs have the same hash, regardless of the order of their entries
+    reordered = QuaConfig(reversed_dict(deepcopy(config.data)))
+    assert reordered == config
+    assert reordered.content_hash() == config.content_hash()
+    config.save(tmp_path / "config.qua")
+    assert (
+        QuaConfig.load(tmp_path / "config.qua").content_hash() == config.content_hash()
+    )
+
+    # strings loaded from JSON are not shared between entries
+    plain = {
+        "version": 1,
+        "elements": {"qe1": {"operations": {"x": "x_pulse", "y": "x_pulse"}}},
+    }
+    round_trip = QuaConfig(json.loads(json.dumps(plain)))
+    assert round_trip == QuaConfig(plain)
+    assert round_trip.content_hash() == QuaConfig(plain).content_hash()
+
+    config["elements"]["qe1"]["intermediate_frequency"] = 50e6
+    assert reordered.content_hash() != config.content_hash()
+
+
+def test_config_diff(config):
+    before = config.copy()
+    config.set_output_dc_offset_by_element("qe1", "single", 0.3)
+    config.add_control_operation_single("qe1", "op", [0.1] * 16)
+    del config["pulses"]["readoutPulse2"]
+    config["version"] = 2
+    diff = ConfigDiff.between(before, config)
+    # only the modified values are recorded
+    assert {(operation, path) for operation, path, _ in diff.edits} == {
+        ("set", ("controllers", "con1", "analog_outputs", 1, "offset")),
+        ("set", ("elements", "qe1", "operations", "op")),
+        ("set", ("waveforms", "qe1_op_in_single")),
+        ("set", ("pulses", "qe1_op_in")),
+        ("delete", ("pulses", "readoutPulse2")),
+        ("set", ("version",)),
+    }
+    diff.apply(before)
+    assert before == config
+    # the diff is not affected by changes to the configs it was applied to
+    before["waveforms"]["qe1_op_in_single"]["samples"][0] = 1.0
+    assert diff == pickle.loads(pickle.dumps(diff))
+    assert diff.content_hash() == pickle.loads(pickle.dumps(diff)).content_hash()
+    assert ConfigDiff.between(config, config.copy()).edits == ()
+
+
+def test_samples_are_arrays(config):
+    config.add_control_operation_single("qe1", "op", [0.1] * 16)
+    samples = config["waveforms"]["qe1_op_in_single"]["samples"]
+    assert isinstance(samples, np.ndarray) and samples.dtype == np.float64
+    assert isinstance(config["waveforms"]["ramp_wf"]["samples"], np.ndarray)
+    # the returned arrays are shared with the config, and are read-only
+    waveform = config.get_waveform_arrays_from_op("qe1", "op")
+    with pytest.raises(ValueError):
+        waveform[0] = 1.0
+    assert config.get_waveform_arrays_from_op("qe1", "readoutOp").shape == (1000,)
+    # get_waveforms_from_op returns new lists
+    waveform = config.get_waveforms_from_op("qe1", "op")
+    assert waveform == [0.1] * 16
+    waveform += [0.0] * 4
+    assert len(config.get_waveforms_from_op("qe1", "op")) == 16
+    config.add_control_operation_iq("qe2", "op", [0.1] * 16, [0.2] * 16)
+    assert config.get_waveforms_from_op("qe2", "op") == ([0.1] * 16, [0.2] * 16)
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_save_and_load(config, tmp_path, compress):
+    config.add_control_operation_iq("qe2", "op", [0.1] * 16, [0.2] * 16)
+    filename = tmp_path / "config.qua"
+    config.save(filename, compress=compress)
+    loaded = QuaConfig.load(filename)
+    assert loaded == config
+    # integer keys and tuples are kept
+    assert loaded["elements"]["qe2"]["mixInputs"]["I"] == ("con1", 2)
+    assert loaded["controllers"]["con1"]["analog_outputs"][1]["offset"] == 0.0
+    assert isinstance(loaded["waveforms"]["ramp_wf"]["samples"], np.ndarray)
+    loaded.reset()
+    assert loaded == config
+    assert not loaded.intern_waveforms and not loaded.compact_waveforms
+
+
+def test_save_and_load_options(config, tmp_path):
+    filename = tmp_path / "config.qua"
+    QuaConfig(config.data, intern_waveforms=True, compact_waveforms=True).save(filename)
+    loaded = QuaConfig.load(filename)
+    assert loaded.intern_waveforms and loaded.compact_waveforms
+    assert not QuaConfig.load(filename, compact_waveforms=False).compact_waveforms
+
+
+def test_dump(config, tmp_path):
+    filename = tmp_path / "qua_config.json"
+    config.dump(filename)
+    with open(filename) as fp:
+        dumped = json.load(fp)
+    assert dumped["waveforms"]["ramp_wf"]["samples"] == list(
+        config["waveforms"]["ramp_wf"]["samples"]
+    )
+
+
+def test_intern_waveforms(config):
+    config.intern_waveforms = True
+    n_waveforms = len(config["waveforms"])
+    config.add_control_operation_single("qe1", "x", [0.1] * 16)
+    config.add_control_operation_iq("qe2", "x", [0.1] * 16, [0.0] * 16)
+    assert len(config["waveforms"]) == n_waveforms + 2
+    single = config["pulses"]["qe1_x_in"]["waveforms"]["single"]
+    assert config["pulses"]["qe2_x_in"]["waveforms"]["I"] == single
+    # updating one operation does not affect the pulses sharing its waveforms
+    config.add_control_operation_single("qe1", "x", [0.2] * 16)
+    np.testing.assert_array_equal(
+        config.get_waveforms_from_op("qe2", "x")[0], [0.1] * 16
+    )
+    with pytest.raises(ValueError):
+        config["waveforms"][single]["samples"][0] = 1.0
+
+
+def test_compact(config):
+    config.add_control_operation_single("qe1", "x", [0.1] * 16)
+    config.add_control_operation_single("qe1", "x", [0.1] * 16)
+    config.add_control_operation_iq("qe2", "x", [0.1] * 16, [0.1] * 16)
+    before = config.copy()
+    # ramp_wf2 is identical to ramp_wf, and const_wf is not played by any pulse
+    assert config.compact() == 4
+    assert set(config["waveforms"]) == {"ramp_wf", "qe1_x_in_single"}
+    assert config["pulses"]["readoutPulse2"]["waveforms"]["single"] == "ramp_wf"
+    for element, operation in [("qe1", "readoutOp2"), ("qe2", "x")]:
+        np.testing.assert_array_equal(
+            config.get_waveforms_from_op(element, operation),
+            before.get_waveforms_from_op(element, operation),
+        )
+    assert "ramp_wf2" in before["waveforms"]
+
+
+def test_indexes(config):
+    assert config.get_elements_by_port(("con1", 1)) == ["qe1"]
+    assert sorted(config.get_elements_by_pulse("readoutPulse")) == ["qe1", "qe2"]
+    assert config.get_pulses_by_waveform("ramp_wf2") == ["readoutPulse2"]
+    config.add_control_operation_single("qe1", "x", [0.1] * 16)
+    assert config.get_elements_by_pulse("qe1_x_in") == ["qe1"]
+    assert config.get_pulses_by_waveform("qe1_x_in_single") == ["qe1_x_in"]
+    # the indexes are rebuilt after the config is modified directly
+    config["elements"]["qe3"] = {"singleInput": {"port": ("con1", 1)}}
+    assert config.get_elements_by_port(("con1", 1)) == ["qe1", "qe3"]
+
+
+def test_update_intermediate_frequency(config):
+    config["elements"]["qe2"]["mixInputs"].update(mixer="mixer_qe2", lo_frequency=5e9)
+    config["mixers"] = {
+        "mixer_qe2": [
+            {
+                "intermediate_frequency": if_freq,
+                "lo_frequency": 5e9,
+                "correction": [1, 0, 0, 1],
+            }
+            for if_freq in [50e6, 100e6, 150e6]
+        ]
+    }
+    for if_freq in [110e6, 120e6, 130e6]:
+        config.update_intermediate_frequency("qe2", if_freq, strict=False)
+    assert config["elements"]["qe2"]["intermediate_frequency"] == 130e6
+    assert [
+        entry["intermediate_frequency"] for entry in config["mixers"]["mixer_qe2"]
+    ] == [
+        50e6,
+        130e6,
+        150e6,
+    ]
+    config.update_intermediate_frequency("qe2", 140e6)
+    assert config["elements"]["qe2"]["intermediate_frequency"] == 140e6
+    assert config["mixers"]["mixer_qe2"][1]["intermediate_frequency"] == 130e6
+    with pytest.raises(KeyError):
+        config.update_intermediate_frequency("qe2", 150e6, strict=False)
+
+
+def test_changes_since_checkpoint(config):
+    downstream = config.copy()
+    checkpoint = config.checkpoint()
+    config.set_output_dc_offset_by_element("qe1", "single", 0.3)
+    config["elements"]["qe2"]["intermediate_frequency"]  # accessed, but not changed
+    config.add_control_operation_single("qe1", "op", [0.1] * 16)
+    del config["pulses"]["readoutPulse2"]
+    config["version"] = 2
+    config["mixers"] = {"mixer_qe2": []}
+    diff = config.changes_since(checkpoint)
+    assert {(operation, path) for operation, path, _ in diff.edits} == {
+        ("set", ("controllers", "con1", "analog_outputs", 1, "offset")),
+        ("set", ("elements", "qe1", "operations", "op")),
+        ("set", ("waveforms", "qe1_op_in_single")),
+        ("set", ("pulses", "qe1_op_in")),
+        ("delete", ("pulses", "readoutPulse2")),
+        ("set", ("version",)),
+        ("set", ("mixers",)),
+    }
+    diff.apply(downstream)
+    assert downstream == config
+    assert config.diff(downstream).edits == ()
+
+    # the changes of a nested checkpoint are kept by the outer checkpoint once it is released
+    inner = config.checkpoint()
+    config["pulses"] = {"readoutPulse": config["pulses"]["readoutPulse"]}
+    assert {path for _, path, _ in config.changes_since(inner).edits} == {
+        ("pulses", "qe1_op_in")
+    }
+    config.release(inner)
+    # the pulse did not exist at the outer checkpoint
+    paths = {path for _, path, _ in config.changes_since(checkpoint).edits}
+    assert ("pulses", "qe1_op_in") not in paths
+    assert ("pulses", "readoutPulse2") in paths
+    with pytest.raises(ValueError):
+        config.changes_since(inner)
+    config.release(checkpoint)
+    assert not checkpoint.active
+    assert ("set", ("version",), 2) in config.changes_since().edits
+
+
+def test_rollback(config):
+    original = config.copy()
+    outer = config.checkpoint()
+    config.set_output_dc_offset_by_element("qe1", "single", 0.3)
+    config.add_control_operation_single("qe1", "op", [0.1] * 16)
+    after_outer = config.copy()
+    for amplitude in [0.2, 0.3]:
+        config.checkpoint()
+        config.add_control_operation_single("qe1", "op", [amplitude] * 16)
+        config["waveforms"]["ramp_wf"]["samples"][0] = 1.0
+        del config["pulses"]["readoutPulse2"]
+        del config["integration_weights"]
+        config["mixers"] = {"mixer_qe2": []}
+        config.rollback()
+        assert config == after_outer
+    config.rollback(outer)
+    assert config == original
+    assert not outer.active
+    with pytest.raises(ValueError):
+        config.rollback()
+
+
+def test_add_drag_operations(config):
+    for element in ["qe3", "qe4", "qe5"]:
+        config["elements"][element] = {
+            "mixInputs": {"I": ("con1", 2), "Q": ("con1", 3)},
+            "operations": {},
+        }
+    config.add_drag_operations(
+        ["qe3", "qe4", "qe5"],
+        "x",
+        amplitude=[0.1, 0.2, 0.3],
+        sigma=4,
+        length=[16, 16, 20],
+        drag_coefficient=[0.0, 0.5, 0.5],
+    )
+    assert config["pulses"]["qe5_x_in"]["length"] == 20
+    wf_i, wf_q = config.get_waveform_arrays_from_op("qe3", "x")
+    assert len(wf_i) == 16 and wf_i.max() < 0.1 and not wf_q.any()
+    # every element gets the same waveforms as when adding its operation alone
+    t = np.arange(20) - 9.5
+    gaussian = 0.3 * np.exp(-(t**2) / 32)
+    config.add_control_operation_iq("qe4", "y", gaussian, -0.5 * t / 16 * gaussian)
+    for actual, expected in zip(
+        config.get_waveforms_from_op("qe5", "x"),
+        config.get_waveforms_from_op("qe4", "y"),
+    ):
+        np.testing.assert_allclose(actual, expected)
+
+
+def test_compact_waveforms(config):
+    config.compact_waveforms = True
+    config.add_control_operation_iq("qe2", "x", [0.0] * 16, [0.0, 0.1] * 8)
+    assert config["waveforms"]["qe2_x_in_i"] == {"type": "constant", "sample": 0.0}
+    assert config["waveforms"]["qe2_x_in_q"]["type"] == "arbitrary"
+    wf_i, _ = config.get_waveform_arrays_from_op("qe2", "x")
+    np.testing.assert_array_equal(wf_i, np.zeros(16))
+    # constant waveforms are expanded to read-only views
+    assert wf_i.strides == (0,) and not wf_i.flags.writeable
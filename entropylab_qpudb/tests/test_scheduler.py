@@ -0,0 +1,232 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+from entropylab import EntropyContext, pynode
+
+from entropylab_qpudb import (
+    QuaConfig,
+    QuaCalNode,
+    QpuDatabaseConnection,
+    QuaCalScheduler,
+    CalState,
+    NodeStatus,
+    ScheduledAction,
+)
+from entropylab_qpudb._qpudatabase import (
+    create_new_qpu_database,
+    QpuParameter,
+    ConfidenceInterval,
+)
+
+
+class CalNode(QuaCalNode):
+    # nodes are copied when a graph is run, so the connection is not held by the nodes
+    db = None
+    calls = Counter()
+
+    def prepare_config(self, config: QuaConfig, context: EntropyContext):
+        pass
+
+    def run_program(self, config, context: EntropyContext):
+        self.calls[("run", self.label)] += 1
+        for element, attribute in self.calibrated_parameters:
+            self.db.set(
+                element,
+                attribute,
+                1.0,
+                CalState.FINE,
+                ConfidenceInterval(0.01),
+            )
+
+    def update_config(self, config: QuaConfig, context: EntropyContext):
+        pass
+
+
+class CheckedCalNode(CalNode):
+    # the results of the data checks by node label, which pass unless set otherwise
+    check_results = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, check_data=self._check_data, **kwargs)
+
+    def _check_data(self, config: QuaConfig, context: EntropyContext) -> bool:
+        self.calls[("check", self.label)] += 1
+        return self.check_results.get(self.label, True)
+
+
+@pytest.fixture
+def db(tmp_path):
+    old = datetime.now() - timedelta(days=2)
+    create_new_qpu_database(
+        "scheddb",
+        {
+            "q1": {
+                "frequency": QpuParameter(
+                    5e9, old, CalState.FINE, ConfidenceInterval(0.01)
+                ),
+                "amplitude": QpuParameter(0.1, old, CalState.UNCAL),
+                "t1": QpuParameter(
+                    1e-5, datetime.now(), CalState.FINE, ConfidenceInterval(0.01)
+                ),
+            },
+            "q2": {
+                "frequency": QpuParameter(
+                    5e9, old, CalState.FINE, ConfidenceInterval(0.01)
+                ),
+            },
+        },
+        path=tmp_path,
+    )
+    with QpuDatabaseConnection("scheddb", path=tmp_path) as connection:
+        CalNode.db = connection
+        CalNode.calls.clear()
+        yield connection
+
+
+@pytest.fixture
+def graph():
+    @pynode("root", output_vars={"config"})
+    def root(context: EntropyContext):
+        return {"config": QuaConfig({"elements": {}})}
+
+    spec = dict(required_state=CalState.FINE, max_error=0.1)
+    freq1 = CalNode(root, name="freq1", calibrated_parameters=[("q1", "frequency")])
+    amp1 = CalNode(
+        freq1, name="amp1", calibrated_parameters=[("q1", "amplitude")], **spec
+    )
+    t1 = CalNode(amp1, name="t1", calibrated_parameters=[("q1", "t1")], **spec)
+    freq2 = CheckedCalNode(
+        root,
+        name="freq2",
+        calibrated_parameters=[("q2", "frequency")],
+        calibration_timeout=timedelta(hours=1),
+        **spec,
+    )
+    return [freq1, amp1, t1, freq2]
+
+
+def test_status(db, graph):
+    freq1, amp1, t1, freq2 = graph
+    scheduler = QuaCalScheduler(db)
+    assert scheduler.status(freq1)[0] == NodeStatus.IN_SPEC
+    assert scheduler.status(amp1)[0] == NodeStatus.OUT_OF_SPEC
+    assert scheduler.status(t1)[0] == NodeStatus.IN_SPEC
+    assert scheduler.status(freq2)[0] == NodeStatus.STALE
+    db.set("q1", "t1", 1e-5, CalState.FINE, ConfidenceInterval(0.5))
+    assert scheduler.status(t1)[0] == NodeStatus.OUT_OF_SPEC
+
+
+def test_plan(db, graph):
+    plan = QuaCalScheduler(db).plan([graph[2], graph[3]])
+    assert dict(zip(plan["node"], plan["action"])) == {
+        "freq1": ScheduledAction.SKIP,
+        "amp1": ScheduledAction.CALIBRATE,
+        "t1": ScheduledAction.CALIBRATE,
+        "freq2": ScheduledAction.CHECK,
+    }
+
+
+def test_stale_node_without_data_check_is_calibrated(db, graph):
+    freq2 = CalNode(
+        graph[0],
+        name="freq2",
+        calibrated_parameters=[("q2", "frequency")],
+        calibration_timeout=timedelta(hours=1),
+    )
+    assert freq2.check_data is None
+    scheduler = QuaCalScheduler(db)
+    assert scheduler.status(freq2)[0] == NodeStatus.STALE
+    assert scheduler.decide(freq2) == ScheduledAction.CALIBRATE
+
+
+def test_maintain_runs_only_needed_calibrations(db, graph):
+    freq1, amp1, t1, freq2 = graph
+    scheduler = QuaCalScheduler(db)
+    scheduler.maintain([t1, freq2])
+    assert CalNode.calls == Counter(
+        {("run", "amp1"): 1, ("run", "t1"): 1, ("check", "freq2"): 1}
+    )
+    report = scheduler.report()
+    assert list(report[report["node"] == "freq2"]["check_passed"]) == [True]
+
+    # everything is within spec, except for the stale node whose check now fails
+    CalNode.calls.clear()
+    CheckedCalNode.check_results = {"freq2": False}
+    try:
+        scheduler.maintain([t1, freq2])
+    finally:
+        CheckedCalNode.check_results = {}
+    assert CalNode.calls == Counter({("check", "freq2"): 1, ("run", "freq2"): 1})
+    assert scheduler.status(freq2)[0] == NodeStatus.IN_SPEC
+
+
+def test_failed_check_diagnoses_dependencies(db):
+    @pynode("root", output_vars={"config"})
+    def root(context: EntropyContext):
+        return {"config": QuaConfig({"elements": {}})}
+
+    spec = dict(required_state=CalState.FINE, max_error=0.1)
+    freq1 = CheckedCalNode(
+        root, name="freq1", calibrated_parameters=[("q1", "frequency")], **spec
+    )
+    freq2 = CheckedCalNode(
+        freq1, name="freq2", calibrated_parameters=[("q2", "frequency")], **spec
+    )
+    t1 = CheckedCalNode(
+        freq2,
+        name="t1",
+        calibrated_parameters=[("q1", "t1")],
+        calibration_timeout=timedelta(0),
+        **spec,
+    )
+    scheduler = QuaCalScheduler(db)
+
+    # the stale node fails its check, and its dependency in spec passes its diagnosis
+    CheckedCalNode.check_results = {"t1": False}
+    try:
+        scheduler.maintain(t1)
+    finally:
+        CheckedCalNode.check_results = {}
+    assert CalNode.calls == Counter(
+        {("check", "t1"): 1, ("check", "freq2"): 1, ("run", "t1"): 1}
+    )
+    report = scheduler.report()
+    assert list(zip(report["node"], report["action"], report["iteration"])) == [
+        ("freq1", ScheduledAction.SKIP, 0),
+        ("freq2", ScheduledAction.SKIP, 0),
+        ("t1", ScheduledAction.CHECK, 0),
+        ("freq1", ScheduledAction.SKIP, 1),
+        ("freq2", ScheduledAction.CHECK, 1),
+        ("t1", ScheduledAction.CALIBRATE, 1),
+    ]
+
+    # failed diagnoses are followed recursively, and the nodes are calibrated from the root of the failure
+    CalNode.calls.clear()
+    CheckedCalNode.check_results = {"t1": False, "freq2": False, "freq1": False}
+    try:
+        scheduler.maintain(t1)
+    finally:
+        CheckedCalNode.check_results = {}
+    report = scheduler.report()
+    assert list(zip(report["node"], report["action"], report["iteration"])) == [
+        ("freq1", ScheduledAction.SKIP, 0),
+        ("freq2", ScheduledAction.SKIP, 0),
+        ("t1", ScheduledAction.CHECK, 0),
+        ("freq1", ScheduledAction.SKIP, 1),
+        ("freq2", ScheduledAction.CHECK, 1),
+        ("t1", ScheduledAction.SKIP, 1),
+        ("freq1", ScheduledAction.CHECK, 2),
+        ("freq2", ScheduledAction.CALIBRATE, 2),
+        ("t1", ScheduledAction.CALIBRATE, 2),
+    ]
+    assert CalNode.calls == Counter(
+        {
+            ("check", "t1"): 1,
+            ("check", "freq2"): 1,
+            ("check", "freq1"): 1,
+            ("run", "freq1"): 1,
+            ("run", "freq2"): 1,
+            ("run", "t1"): 1,
+        }
+    )